@@ -11,9 +11,16 @@ Handles:
 - Escalation decision logic
 - Event logging for observability
 - Final output consolidation
+
+One Coordinator serves concurrent requests (the API shares a single
+instance), so everything belonging to a run - its context, session ID and
+event log - lives in a PipelineRun bound to the executing thread through a
+context variable, never on the Coordinator itself.
 """
 
 import json
+from contextvars import ContextVar
+from dataclasses import dataclass, field
 from typing import Dict, List, Optional, Callable
 from datetime import datetime
 from pathlib import Path
@@ -24,6 +31,18 @@ from agents.imaging_agent import ImagingAgent
 from agents.therapy_agent import TherapyAgent
 from agents.pharmacy_agent import PharmacyAgent
 from agents.doctor_agent import DoctorAgent
+from config import SYSTEM_CONFIG
+from utils.data_store import DataStore
+from utils.request_context import RequestContext
+
+
+@dataclass
+class PipelineRun:
+    """State of one ``execute_pipeline`` call."""
+
+    context: RequestContext
+    session_id: str
+    event_log: List[Dict] = field(default_factory=list)
 
 
 class Coordinator:
@@ -38,16 +57,27 @@ class Coordinator:
     - Generate final recommendations/orders
     """
     
-    def __init__(self, data_dir: str = "./data", upload_dir: str = "./uploads"):
+    def __init__(
+        self,
+        data_dir: str = "./data",
+        upload_dir: str = "./uploads",
+        data_store: Optional[DataStore] = None
+    ):
         """
         Initialize coordinator with all agents.
         
         Args:
             data_dir: Path to data folder with CSVs/JSONs
             upload_dir: Path to uploads folder
+            data_store: Shared reference data (defaults to the process-wide store for data_dir)
         """
-        # Event log for tracking
-        self.event_log: List[Dict] = []
+        # Events logged outside a pipeline run (startup, maintenance);
+        # each run collects its own log in its PipelineRun
+        self._event_log: List[Dict] = []
+        self._run: ContextVar[Optional[PipelineRun]] = ContextVar(f"coordinator_run_{id(self)}", default=None)
+        # Most recently finished run, for the session APIs called after execute_pipeline returns
+        self.last_run: Optional[PipelineRun] = None
+        self.data_store = data_store or DataStore.shared(data_dir)
         
         # Initialize agents with logging callback
         self.ingestion_agent = IngestionAgent(
@@ -61,26 +91,31 @@ class Coordinator:
         
         self.therapy_agent = TherapyAgent(
             data_dir=data_dir,
-            log_callback=self._log_event
+            log_callback=self._log_event,
+            data_store=self.data_store
         )
         
         # Pharmacy and Doctor agents
         self.pharmacy_agent = PharmacyAgent(
             data_dir=data_dir,
-            log_callback=self._log_event
+            log_callback=self._log_event,
+            data_store=self.data_store
         )
         
         self.doctor_agent = DoctorAgent(
             data_dir=data_dir,
-            log_callback=self._log_event
+            log_callback=self._log_event,
+            data_store=self.data_store
         )
         
-        # Pipeline state
-        self.current_session = None
-        
+        if SYSTEM_CONFIG["deterministic_mode"]:
+            self._log_event(
+                "Coordinator", "WARNING",
+                "Deterministic mode is for replay and tests: the clock is frozen and pharmacy stock is not held"
+            )
         self._log_event("Coordinator", "INFO", "Coordinator initialized successfully")
     
-    def execute_pipeline(self, upload_data: Dict) -> Dict:
+    def execute_pipeline(self, upload_data: Dict, context: Optional[RequestContext] = None) -> Dict:
         """
         Main pipeline execution method.
         
@@ -94,13 +129,25 @@ class Coordinator:
                 "spo2": 94,
                 "pincode": "380001"
             }
+            context: RNG and clock for this run, passed to every agent
+                (a fresh one following SYSTEM_CONFIG["deterministic_mode"] if omitted)
         
         Returns:
             Dict: Complete pipeline result with recommendations/order
         """
-        # Create new session
-        session_id = self._create_session()
-        
+        # Create new session, visible to agent log callbacks on this thread only
+        context = RequestContext.ensure(context)
+        run = PipelineRun(context, self._create_session(context))
+        token = self._run.set(run)
+        try:
+            return self._run_pipeline(upload_data, context)
+        finally:
+            self._run.reset(token)
+            self.last_run = run
+
+    def _run_pipeline(self, upload_data: Dict, context: RequestContext) -> Dict:
+        """Pipeline body of ``execute_pipeline``, inside the request's PipelineRun."""
+        session_id = self.current_session
         self._log_event("Coordinator", "INFO", f"Starting pipeline execution - Session: {session_id}")
         
         try:
@@ -132,7 +179,8 @@ class Coordinator:
             self._log_event("Coordinator", "INFO", "STEP 3: Therapy Agent")
             therapy_result = self.therapy_agent.process(
                 imaging_output=imaging_result,
-                patient_data=ingestion_result.get("patient", {})
+                patient_data=ingestion_result.get("patient", {}),
+                context=context
             )
             
             if therapy_result.get("error"):
@@ -154,7 +202,7 @@ class Coordinator:
                     "therapy_result": therapy_result,
                     "patient": ingestion_result.get("patient", {}),
                     "escalation_reason": self._get_escalation_reason(imaging_result, therapy_result)
-                })
+                }, context)
                 
                 # Return escalation response with doctor recommendations
                 return self._doctor_escalation_response(
@@ -173,7 +221,8 @@ class Coordinator:
                 # Call Pharmacy Agent
                 pharmacy_result = self.pharmacy_agent.process(
                     therapy_result=therapy_result,
-                    location=ingestion_result.get("location", {})
+                    location=ingestion_result.get("location", {}),
+                    context=context
                 )
                 
                 # Check pharmacy matching status
@@ -208,7 +257,8 @@ class Coordinator:
                 ingestion=ingestion_result,
                 imaging=imaging_result,
                 therapy=therapy_result,
-                pharmacy=pharmacy_result
+                pharmacy=pharmacy_result,
+                context=context
             )
             
             self._log_event("Coordinator", "SUCCESS", "Pipeline completed successfully")
@@ -298,7 +348,7 @@ class Coordinator:
             ],
             "disclaimer": "⚠️ CRITICAL SITUATION - Seek professional emergency care NOW",
             "session_id": self.current_session,
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": self._timestamp(),
             "event_log": self.event_log
         }
     
@@ -339,7 +389,7 @@ class Coordinator:
             },
             "disclaimer": "⚠️ Professional medical evaluation required - NOT FOR SELF-TREATMENT",
             "session_id": self.current_session,
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": self._timestamp(),
             "event_log": self.event_log,
             
             # Doctor recommendations from DoctorAgent
@@ -381,7 +431,8 @@ class Coordinator:
         ingestion: Dict,
         imaging: Dict,
         therapy: Dict,
-        pharmacy: Optional[Dict]
+        pharmacy: Optional[Dict],
+        context: RequestContext
     ) -> Dict:
         """
         Consolidate all agent results into final output.
@@ -431,7 +482,7 @@ class Coordinator:
             "pharmacy": pharmacy,
             
             # Order Information
-            "order": self._generate_order_summary(therapy, pharmacy) if pharmacy else None,
+            "order": self._generate_order_summary(therapy, pharmacy, context) if pharmacy else None,
             
             # Recommendations
             "recommendations": imaging.get("recommendations", []),
@@ -446,7 +497,7 @@ class Coordinator:
             ],
             
             # Metadata
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": self._timestamp(),
             "processing_summary": {
                 "ingestion": "completed",
                 "imaging": "completed",
@@ -462,14 +513,13 @@ class Coordinator:
     def _generate_order_summary(
         self,
         therapy_result: Dict,
-        pharmacy_result: Dict
+        pharmacy_result: Dict,
+        context: RequestContext
     ) -> Dict:
         """
         Generate order summary from pharmacy data.
         """
-        import random
-        
-        order_id = f"ORD{random.randint(10000000, 99999999)}"
+        order_id = context.numeric_id("ORD", 8)
         
         # Use REAL data from Pharmacy Agent ✅
         items = pharmacy_result.get("items", [])
@@ -520,16 +570,38 @@ class Coordinator:
             ],
             "disclaimer": "⚠️ System error - Please consult healthcare professional directly",
             "session_id": self.current_session,
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": self._timestamp(),
             "event_log": self.event_log
         }
     
-    def _create_session(self) -> str:
-        """Create unique session ID."""
-        import random
-        session_id = f"SES{datetime.now().strftime('%Y%m%d%H%M%S')}{random.randint(1000, 9999)}"
-        self.current_session = session_id
-        return session_id
+    def _create_session(self, context: Optional[RequestContext] = None) -> str:
+        """Create session ID from the run's context."""
+        context = RequestContext.ensure(context)
+        return f"SES{context.now().strftime('%Y%m%d%H%M%S')}{context.randint(1000, 9999)}"
+
+    @property
+    def current_context(self) -> Optional[RequestContext]:
+        """Context of the run executing on this thread, if any."""
+        run = self._run.get()
+        return run.context if run is not None else None
+
+    @property
+    def current_session(self) -> Optional[str]:
+        """Session ID of the run executing on this thread, if any."""
+        run = self._run.get()
+        return run.session_id if run is not None else None
+
+    @property
+    def event_log(self) -> List[Dict]:
+        """Event log of the run executing on this thread (the coordinator's own log outside a run)."""
+        run = self._run.get()
+        return run.event_log if run is not None else self._event_log
+    
+    def _timestamp(self) -> str:
+        """Now, from the current run's clock (wall clock outside a run)."""
+        if self.current_context is not None:
+            return self.current_context.timestamp()
+        return datetime.now().isoformat()
     
     def _log_event(
         self,
@@ -548,7 +620,7 @@ class Coordinator:
             metadata: Optional additional data
         """
         event = {
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": self._timestamp(),
             "agent": agent_name,
             "level": level,
             "message": message
@@ -570,13 +642,25 @@ class Coordinator:
         
         print(f"{prefix} [{level}] {agent_name}: {message}")
     
+    def _session_run(self) -> Optional[PipelineRun]:
+        """The run executing on this thread, else the last one to finish."""
+        return self._run.get() or self.last_run
+
     def get_event_log(self) -> List[Dict]:
-        """Get complete event log for current session."""
-        return self.event_log
+        """
+        Get complete event log for current session.
+
+        Outside a run this is the log of the last finished run (under
+        concurrent requests, whichever finished last); a specific request's
+        log is ``result["event_log"]``. Before any run it is the
+        coordinator's own startup log.
+        """
+        run = self._session_run()
+        return run.event_log if run is not None else self._event_log
     
     def clear_event_log(self) -> None:
         """Clear event log (for new session)."""
-        self.event_log = []
+        self.get_event_log().clear()
     
     def export_session(self, output_path: str) -> None:
         """
@@ -585,9 +669,10 @@ class Coordinator:
         Args:
             output_path: Path to save session JSON
         """
+        run = self._session_run()
         session_data = {
-            "session_id": self.current_session,
-            "event_log": self.event_log,
+            "session_id": run.session_id if run is not None else None,
+            "event_log": self.get_event_log(),
             "exported_at": datetime.now().isoformat()
         }
         
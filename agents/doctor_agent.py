@@ -14,7 +14,9 @@ import os
 import pandas as pd
 from typing import Dict, List, Optional
 from datetime import datetime, timedelta
-import random
+
+from utils.data_store import DataStore
+from utils.request_context import RequestContext
 
 
 class DoctorAgent:
@@ -25,15 +27,17 @@ class DoctorAgent:
     Output: Doctor recommendations with available slots
     """
     
-    def __init__(self, data_dir: str = "./data", log_callback=None):
+    def __init__(self, data_dir: str = "./data", log_callback=None, data_store: Optional[DataStore] = None):
         """
         Initialize Doctor Agent.
         
         Args:
             data_dir: Path to data folder containing doctors.csv
             log_callback: Logging function
+            data_store: Shared tables; a private store is created if omitted
         """
-        self.data_dir = data_dir
+        self.data_store = data_store or DataStore(data_dir, log_callback)
+        self.data_dir = str(self.data_store.data_dir)
         self.log_callback = log_callback
         
         # Load doctors database
@@ -51,10 +55,12 @@ class DoctorAgent:
         
         self._log("INFO", f"Doctor Agent initialized with {len(self.doctors_df)} doctors")
     
-    def process(self, escalation_data: Dict) -> Dict:
+    def process(self, escalation_data: Dict, context: Optional[RequestContext] = None) -> Dict:
         """
         Main processing method - match doctors for escalated cases.
         
+        ``context`` supplies the request's RNG and clock (a fresh one if omitted).
+        
         Expected input:
         {
             "imaging_result": {
@@ -96,6 +102,7 @@ class DoctorAgent:
         }
         """
         self._log("INFO", "Doctor Agent processing escalated case")
+        context = RequestContext.ensure(context)
         
         try:
             # Extract data
@@ -117,7 +124,8 @@ class DoctorAgent:
                 primary_condition,
                 severity,
                 urgency_level,
-                patient
+                patient,
+                context
             )
             
             # Sort by match score
@@ -144,7 +152,7 @@ class DoctorAgent:
                 "severity": severity,
                 "booking_instructions": self._generate_booking_instructions(urgency_level),
                 "emergency_note": self._generate_emergency_note(red_flags),
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": context.timestamp(),
                 "agent": "DoctorAgent",
                 "status": "success"
             }
@@ -155,7 +163,7 @@ class DoctorAgent:
             
         except Exception as e:
             self._log("ERROR", f"Doctor matching failed: {str(e)}")
-            return self._error_response(str(e))
+            return context.stamp(self._error_response(str(e)))
     
     def _load_doctors(self) -> pd.DataFrame:
         """Load doctors database from CSV."""
@@ -164,7 +172,7 @@ class DoctorAgent:
         if not os.path.exists(doctors_path):
             raise FileNotFoundError(f"Doctors database not found: {doctors_path}")
         
-        df = pd.read_csv(doctors_path)
+        df = self.data_store.table("doctors")
         
         # Validate required columns
         required_cols = ['doctor_id', 'name', 'specialty', 'tele_available', 
@@ -202,7 +210,8 @@ class DoctorAgent:
         condition: str,
         severity: str,
         urgency: str,
-        patient: Dict
+        patient: Dict,
+        context: RequestContext
     ) -> List[Dict]:
         """
         Find suitable doctors based on condition and patient needs.
@@ -233,11 +242,12 @@ class DoctorAgent:
                 condition,
                 severity,
                 urgency,
-                required_specialties
+                required_specialties,
+                context
             )
             
             # Parse available slots
-            slots = self._parse_available_slots(doctor.get('available_slots', ''))
+            slots = self._parse_available_slots(doctor.get('available_slots', ''), context.now())
             
             doctor_info = {
                 "doctor_id": doctor['doctor_id'],
@@ -266,7 +276,8 @@ class DoctorAgent:
         condition: str,
         severity: str,
         urgency: str,
-        required_specialties: List[str]
+        required_specialties: List[str],
+        context: RequestContext
     ) -> int:
         """
         Calculate match score (0-100) for doctor-patient matching.
@@ -304,7 +315,7 @@ class DoctorAgent:
             score += 20
         
         # Small random variation for diversity (10 points)
-        score += random.randint(0, 10)
+        score += context.randint(0, 10)
         
         # Urgency bonus (prioritize experienced doctors for urgent cases)
         if urgency in ["critical", "high"] and experience >= 10:
@@ -312,12 +323,14 @@ class DoctorAgent:
         
         return min(100, score)  # Cap at 100
     
-    def _parse_available_slots(self, slots_str: str) -> List[str]:
+    def _parse_available_slots(self, slots_str: str, now: Optional[datetime] = None) -> List[str]:
         """
         Parse available slots string into list of datetime strings.
         
         Input: "2025-10-08T10:00:00,2025-10-08T14:00:00,2025-10-09T09:00:00"
         Output: ["2025-10-08T10:00:00", "2025-10-08T14:00:00", "2025-10-09T09:00:00"]
+        
+        Slots before ``now`` (default: the wall clock) are dropped.
         """
         if not slots_str or pd.isna(slots_str):
             return []
@@ -325,7 +338,7 @@ class DoctorAgent:
         try:
             slots = [s.strip() for s in str(slots_str).split(',')]
             # Filter out past slots
-            now = datetime.now()
+            now = now or datetime.now()
             future_slots = [
                 slot for slot in slots 
                 if datetime.fromisoformat(slot.replace('Z', '')) > now
@@ -1,29 +1,45 @@
-"""Deterministic rule-based imaging agent for simulation purposes."""
+"""Rule-based imaging agent (model-backed when a classifier file is configured)."""
 
 from __future__ import annotations
 
-import hashlib
+import copy
 import json
 import math
 import random
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, Iterable, List
+from typing import Any, Dict, Iterable, List, Optional
 
 import numpy as np
-from PIL import Image
 
 from agents.base_agent import BaseAgent
-from config import RED_FLAG_KEYWORDS
+from config import IMAGING_CONFIG, RED_FLAG_KEYWORDS
+from models.xray_classifier import XrayClassifier, load_classifier
+from utils.image_artifact import ImageArtifact
+from utils.result_cache import ResultCache
+from utils.ttl_cache import stable_hash
 
 
 class ImagingAgent(BaseAgent):
-    """Heuristic classifier that generates safe, interpretable outputs."""
+    """X-ray triage: a trained classifier when a model file is present, else interpretable heuristics."""
 
     CONDITIONS = ["normal", "pneumonia", "covid_suspect", "bronchitis", "tb_suspect"]
+    # Bump whenever the heuristics change: cached results of older rules stop matching
+    RULES_VERSION = "2025.1"
 
     def __init__(self, log_callback=None) -> None:
         super().__init__("ImagingAgent", log_callback)
+        # Features are computed at a working resolution of at most this many pixels per side
+        self.max_side = IMAGING_CONFIG["image_resize_threshold"]
+        self.result_cache = ResultCache(
+            IMAGING_CONFIG["result_cache_size"],
+            IMAGING_CONFIG["result_cache_dir"],
+            IMAGING_CONFIG["result_cache_disk_entries"],
+        )
+        self.classifier = self._load_classifier()
+        self.classifier_timeout = IMAGING_CONFIG["classifier_timeout_s"]
+        self.classifier_fallbacks = 0
 
     # ------------------------------------------------------------------
     # Public API
@@ -33,19 +49,33 @@ class ImagingAgent(BaseAgent):
         try:
             self._validate_input(ingestion_output)
 
-            xray_path = Path(ingestion_output["xray_path"])
+            # Reuse the bytes read at ingestion; only path-only callers hit the disk
+            artifact = ingestion_output.get("xray_artifact") or ImageArtifact.from_path(ingestion_output["xray_path"])
             patient = ingestion_output.get("patient", {})
             notes = ingestion_output.get("notes", "")
             spo2 = ingestion_output.get("spo2")
 
-            features = self._extract_image_features(xray_path)
             metadata = {
                 "age": patient.get("age", 40),
                 "spo2": int(spo2) if spo2 is not None else 98,
                 "notes": notes.lower(),
             }
 
-            condition_probs = self._compute_probabilities(features, metadata, xray_path)
+            # Same image bytes + same metadata + same rules: reuse without decoding
+            key = self._result_key(artifact, metadata)
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                self._log("INFO", "Imaging result served from cache", {"sha256": artifact.sha256[:12]})
+                result = self._create_output(copy.deepcopy(cached))
+                self._end_processing(success=True)
+                return result
+
+            condition_probs = self._classify(artifact) if self.classifier is not None else None
+            model_failed = self.classifier is not None and condition_probs is None
+            if condition_probs is None:
+                features = self._extract_image_features(artifact)
+                condition_probs = self._compute_probabilities(features, metadata, artifact)
+
             severity = self._score_severity(condition_probs, metadata)
             confidence = self._score_confidence(condition_probs)
             red_flags = self._detect_red_flags(metadata, severity)
@@ -60,6 +90,9 @@ class ImagingAgent(BaseAgent):
                 "disclaimer": "⚠️ Educational simulation only – NOT medical advice.",
             }
 
+            if not model_failed:
+                # The key names the model: a heuristic fallback must not stand in for its result
+                self.result_cache.put(key, copy.deepcopy(payload))
             self._log("SUCCESS", "Imaging completed", {"severity": severity, "confidence": payload["confidence"]})
             result = self._create_output(payload)
             self._end_processing(success=True)
@@ -68,13 +101,59 @@ class ImagingAgent(BaseAgent):
             self._end_processing(success=False)
             return self._error_response(str(exc), exc)
 
+    def result_cache_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters of the imaging result cache."""
+        return {
+            "status": "success",
+            **self.result_cache.stats(),
+            "rules_version": self.RULES_VERSION,
+        }
+
+    def classifier_stats(self) -> Dict[str, Any]:
+        """Batching and latency metrics of the model backend (if one is loaded)."""
+        if self.classifier is None:
+            return {"status": "success", "enabled": False, "model": IMAGING_CONFIG["classifier_model"]}
+        return {
+            "status": "success",
+            "enabled": True,
+            **self.classifier.stats(),
+            "timeout_s": self.classifier_timeout,
+            "fallbacks": self.classifier_fallbacks,
+        }
+
+    def _load_classifier(self) -> Optional[XrayClassifier]:
+        try:
+            classifier = load_classifier(
+                IMAGING_CONFIG["classifier_model"],
+                max_batch=IMAGING_CONFIG["classifier_max_batch"],
+                max_wait_ms=IMAGING_CONFIG["classifier_max_wait_ms"],
+                threads=IMAGING_CONFIG["classifier_threads"],
+                warmup_batches=IMAGING_CONFIG["classifier_warmup_batches"],
+            )
+        except Exception as exc:
+            self._log("WARNING", f"X-ray classifier unavailable, using heuristics: {exc}")
+            return None
+        if classifier is not None:
+            self._log("INFO", f"X-ray classifier loaded ({classifier.backend.name})", classifier.stats())
+        return classifier
+
+    def _result_key(self, artifact: ImageArtifact, metadata: Dict[str, Any]) -> str:
+        """Content address of one analysis: image digest, metadata and everything the rules depend on."""
+        return stable_hash({
+            "sha256": artifact.sha256,
+            "metadata": metadata,
+            "rules_version": self.RULES_VERSION,
+            "max_side": self.max_side,
+            "model": self.classifier.fingerprint if self.classifier is not None else None,
+        })
+
     # ------------------------------------------------------------------
     # Validation
     # ------------------------------------------------------------------
     def _validate_input(self, data: Dict[str, Any]) -> None:
         self._validate_required_fields(data, ["xray_path", "patient"])
         path = Path(data["xray_path"])
-        if not path.exists():
+        if data.get("xray_artifact") is None and not path.exists():
             raise FileNotFoundError(f"X-ray not found: {path}")
         if path.suffix.lower() not in {".png", ".jpg", ".jpeg"}:
             raise ValueError("Only PNG/JPG images supported for simulation")
@@ -82,32 +161,38 @@ class ImagingAgent(BaseAgent):
     # ------------------------------------------------------------------
     # Feature extraction
     # ------------------------------------------------------------------
-    def _extract_image_features(self, path: Path) -> Dict[str, float]:
-        with Image.open(path) as img:
-            grayscaled = img.convert("L")
-            array = np.asarray(grayscaled, dtype=np.float32)
-
-        mean = float(np.mean(array))
-        std = float(np.std(array))
-        min_val = float(np.min(array))
-        max_val = float(np.max(array))
-        dark_ratio = float(np.mean(array < 90))
-        bright_ratio = float(np.mean(array > 200))
+    def _extract_image_features(self, artifact: ImageArtifact) -> Dict[str, Any]:
+        # Bounded decode (see utils/image_artifact.py for how far features can move);
+        # every statistic comes from one 256-bin histogram of the uint8 pixels
+        histogram = artifact.histogram(self.max_side)
+        features = self._histogram_features(histogram)
+        features["histogram"] = histogram
+        return features
+
+    @staticmethod
+    def _histogram_features(histogram: np.ndarray) -> Dict[str, float]:
+        """Mean, std, contrast and dark/bright ratios of the pixels counted in ``histogram``."""
+        total = int(histogram.sum())
+        levels = np.arange(histogram.size, dtype=np.float64)
+        mean = float(levels @ histogram) / total
+        variance = float(((levels - mean) ** 2) @ histogram) / total
+        occupied = np.flatnonzero(histogram)
 
         return {
             "mean": mean,
-            "std": std,
-            "contrast": max_val - min_val,
-            "dark_ratio": dark_ratio,
-            "bright_ratio": bright_ratio,
+            "std": math.sqrt(variance),
+            "contrast": float(occupied[-1] - occupied[0]),
+            "dark_ratio": float(histogram[:90].sum()) / total,
+            "bright_ratio": float(histogram[201:].sum()) / total,
         }
 
     # ------------------------------------------------------------------
     # Probability generation
     # ------------------------------------------------------------------
-    def _compute_probabilities(self, features: Dict[str, float], metadata: Dict[str, Any], path: Path) -> Dict[str, float]:
-        seed = int(hashlib.sha1(path.read_bytes()).hexdigest()[:8], 16)
-        rng = random.Random(seed)
+    def _compute_probabilities(
+        self, features: Dict[str, Any], metadata: Dict[str, Any], artifact: ImageArtifact
+    ) -> Dict[str, float]:
+        rng = random.Random(artifact.seed)
 
         weights = {condition: rng.uniform(0.5, 1.5) for condition in self.CONDITIONS}
 
@@ -161,8 +246,29 @@ class ImagingAgent(BaseAgent):
         elif age < 5:
             weights["bronchitis"] += 0.3
 
-        # Normalise to probabilities
-        min_clip = 0.01
+        return self._normalise(weights)
+
+    def _classify(self, artifact: ImageArtifact) -> Optional[Dict[str, float]]:
+        """
+        Model probabilities for the image (batched with concurrent requests).
+
+        Returns None when the model times out or fails, so the caller falls
+        back to the heuristics instead of holding the request.
+        """
+        try:
+            probs = self.classifier.predict(
+                artifact.working_grayscale(self.max_side), timeout=self.classifier_timeout or None
+            )
+        except Exception as exc:
+            self.classifier_fallbacks += 1
+            reason = "timed out" if isinstance(exc, FutureTimeoutError) else f"failed: {exc}"
+            self._log("WARNING", f"Classifier {reason} - using heuristics", {"sha256": artifact.sha256[:12]})
+            return None
+        return self._normalise({condition: probs.get(condition, 0.0) for condition in self.CONDITIONS})
+
+    @staticmethod
+    def _normalise(weights: Dict[str, float], min_clip: float = 0.01) -> Dict[str, float]:
+        """Clip, normalise and round to 3 decimals, keeping the sum at exactly 1.0."""
         clipped = {k: max(min_clip, v) for k, v in weights.items()}
         total = sum(clipped.values())
         probs = {k: round(v / total, 3) for k, v in clipped.items()}
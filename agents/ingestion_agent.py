@@ -11,8 +11,6 @@ from datetime import datetime
 from pathlib import Path
 from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 
-from PIL import Image
-
 try:  # Optional dependency – degrade gracefully during tests
     import pdfplumber  # type: ignore
 except Exception:  # pragma: no cover - optional dependency
@@ -20,6 +18,7 @@ except Exception:  # pragma: no cover - optional dependency
 
 from agents.base_agent import BaseAgent
 from config import DEFAULT_LOCATION
+from utils.image_artifact import ImageArtifact
 
 UploadedLike = Union[Path, str, io.BytesIO, Any]
 
@@ -54,7 +53,7 @@ class IngestionAgent(BaseAgent):
         normalized = self._normalise_payload(input_data)
         self._validate_input(normalized.__dict__)
 
-        xray_path = self._persist_file(normalized.xray, prefix="xray")
+        xray = self._persist_image(normalized.xray, prefix="xray")
         document_paths, document_text = self._persist_documents(normalized.documents)
 
         patient = self._build_patient_profile(normalized.patient, document_text)
@@ -81,7 +80,10 @@ class IngestionAgent(BaseAgent):
 
         payload = {
             "patient": patient,
-            "xray_path": str(xray_path),
+            "xray_path": str(xray.path),
+            "xray_sha256": xray.sha256,
+            # Later stages reuse these bytes and their decode instead of re-reading the file
+            "xray_artifact": xray,
             "notes": notes,
             "spo2": normalized.spo2 if normalized.spo2 is not None else 97,
             "location": {
@@ -178,6 +180,37 @@ class IngestionAgent(BaseAgent):
         if not input_data.get("xray"):
             raise ValueError("X-ray artifact is required")
 
+    def _persist_image(self, upload: UploadedLike, prefix: str) -> ImageArtifact:
+        """Read an image upload once, verify it in memory, then persist it."""
+
+        artifact = self._load_artifact(upload)
+        try:
+            artifact.verify()
+        except Exception as error:
+            raise ValueError(f"Invalid X-ray image: {error}")
+
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        suffix = self._infer_extension(upload) or artifact.suffix
+        artifact.write_to(self.upload_dir / f"{prefix}_{timestamp}{suffix}")
+        return artifact
+
+    def _load_artifact(self, upload: UploadedLike) -> ImageArtifact:
+        """Stream an upload (path or file-like) into an ImageArtifact."""
+
+        if isinstance(upload, ImageArtifact):
+            return upload
+        if isinstance(upload, (str, Path)):
+            candidate = Path(upload)
+            if not candidate.exists():
+                candidate = self.upload_dir / candidate.name
+            if candidate.exists():
+                return ImageArtifact.from_path(candidate, max_bytes=self.max_file_size_bytes)
+        elif hasattr(upload, "read"):
+            upload.seek(0)
+            name = getattr(upload, "name", "") or ""
+            return ImageArtifact.from_stream(upload, name=str(name), max_bytes=self.max_file_size_bytes)
+        raise ValueError("Unsupported upload type; expected file-like or path")
+
     def _persist_file(self, upload: UploadedLike, prefix: str) -> Path:
         """Persist an uploaded artifact into the uploads directory."""
 
@@ -205,14 +238,6 @@ class IngestionAgent(BaseAgent):
                 raise ValueError("Uploaded file exceeds 10MB limit")
             destination.write_bytes(blob)
 
-        if prefix == "xray":
-            try:
-                with Image.open(destination) as img:
-                    img.verify()
-            except Exception as error:
-                destination.unlink(missing_ok=True)
-                raise ValueError(f"Invalid X-ray image: {error}")
-
         return destination
 
     def _persist_documents(self, uploads: Iterable[UploadedLike]) -> Tuple[List[Path], str]:
@@ -413,4 +438,4 @@ if __name__ == "__main__":
         "spo2": 97,
         "pincode": "400001",
     }
-    print(json.dumps(agent.process(sample), indent=2))
+    print(json.dumps(agent.process(sample), indent=2, default=repr))
@@ -11,16 +11,114 @@ Responsibilities:
 - Calculate pricing and delivery fees
 """
 
-import json
+import heapq
 import math
 import re
+import threading
+import time
 from datetime import datetime, timedelta
-from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
 
-from config import DEFAULT_LOCATION
+from config import DEFAULT_LOCATION, PHARMACY_CONFIG
+from utils.data_store import DataStore
+from utils.geo_utils import PincodeDirectory, SpatialGridIndex, haversine_km
+from utils.inventory_deltas import DeltaInbox, InventoryDelta, parse_delta, read_delta_file, write_csv_atomic
+from utils.inventory_index import StockMatrix, encode_categorical, encode_frame, frame_memory_bytes
+from utils.request_context import RequestContext
+from utils.reservations import Reservation, ReservationLedger
+from utils.snapshot import build_snapshot, read_manifest
+
+# Priority offsets (lower score wins): exact pincode >>> same city >> distance
+EXACT_PINCODE_BOOST = 100000
+SAME_CITY_BOOST = 10000
+
+# Location match codes used by the vectorized search
+MATCH_EXACT_PINCODE = 0
+MATCH_SAME_CITY = 1
+MATCH_NEARBY = 2
+MATCH_LABELS = ("exact_pincode", "same_city", "nearby")
+
+
+def top_k_order(scores: np.ndarray, k: Optional[int]) -> np.ndarray:
+    """
+    Row order with the ``k`` lowest scores first (sorted), the rest after.
+
+    Uses ``argpartition`` so only the head is sorted; ties keep row order.
+    The tail is left in row order. ``k=None`` sorts everything.
+    """
+    size = scores.size
+    if k is None or k >= size:
+        return np.argsort(scores, kind="stable")
+    if k <= 0:
+        return np.arange(size)
+    head = np.sort(np.argpartition(scores, k - 1)[:k])
+    head = head[np.argsort(scores[head], kind="stable")]
+    tail = np.ones(size, dtype=bool)
+    tail[head] = False
+    return np.concatenate([head, np.flatnonzero(tail)])
+
+
+class PincodeCoverage(NamedTuple):
+    """Precomputed, priority-ordered candidate pharmacies for one pincode centroid."""
+
+    lat: float
+    lon: float
+    city_key: str
+    indices: np.ndarray
+    distances_km: np.ndarray
+    match_codes: np.ndarray
+
+
+class MatchRequest(NamedTuple):
+    """A validated request with its location resolved, ready for search."""
+
+    therapy_map: Dict[str, Dict]
+    location_context: Dict
+    patient_coords: Tuple[float, float]
+    search_kwargs: Dict
+    context: Optional[RequestContext] = None
+
+    @property
+    def group_key(self) -> Tuple:
+        """Requests with equal keys get identical search and stock results."""
+        filters = tuple(
+            (name, tuple(value) if isinstance(value, (list, tuple, set)) else value)
+            for name, value in sorted(self.search_kwargs.items())
+        )
+        return (self.patient_coords, filters, tuple(self.therapy_map))
+
+
+# Low-cardinality pharmacy columns held as categoricals
+PHARMACY_CATEGORY_COLUMNS = ("city", "district", "area", "pincode")
+CATALOG_CATEGORY_COLUMNS = ("drug_name", "form", "strength")
+
+# Agent attributes produced by _compute_location_indexes (shared via the DataStore)
+LOCATION_INDEX_ATTRS = (
+    "_pharmacy_records", "_ph_lat_rad", "_ph_lon_rad", "_ph_delivery_km",
+    "_ph_pincode_codes", "_pincode_code_map", "_ph_city_codes", "_city_code_map",
+    "spatial_index", "pincode_coverage", "_coverage_radius_km",
+)
+
+
+class LiveInventory:
+    """
+    Mutable inventory state: stock matrix, reservation ledger and delta bookkeeping.
+
+    Created once per DataStore, so every PharmacyAgent built on the same
+    store sees the same stock and the same holds.
+    """
+
+    def __init__(self, inventory: pd.DataFrame, stock: StockMatrix, reservations: ReservationLedger, fingerprint: Tuple):
+        self.inventory = inventory
+        self.stock = stock
+        self.reservations = reservations
+        self.fingerprint = fingerprint
+        self.write_lock = threading.Lock()
+        self.deltas_since_compaction = 0
+        self.last_compaction = time.monotonic()
 
 
 class PharmacyAgent:
@@ -31,34 +129,90 @@ class PharmacyAgent:
     Output: Matched pharmacy with stock, pricing, and ETA
     """
     
-    def __init__(self, data_dir: str = "./data", log_callback=None):
+    def __init__(self, data_dir: str = "./data", log_callback=None, data_store: Optional[DataStore] = None):
         """
         Initialize Pharmacy Agent.
         
         Args:
-            data_dir: Path to data folder
+            data_dir: Path to data folder (ignored when ``data_store`` is given)
             log_callback: Logging function
+            data_store: Shared tables and indexes; a private store is created if omitted
         """
-        self.data_dir = Path(data_dir)
+        self.data_store = data_store or DataStore(data_dir, log_callback)
+        self.data_dir = self.data_store.data_dir
         self.log_callback = log_callback
         
         # Load data
         self.pharmacies = self._load_pharmacies()
-        self.inventory = self._load_inventory()
-        self.zipcodes = self._load_zipcodes()
+        self.medicines = self._load_medicines()
+        self.pincodes = self._load_pincode_directory()
+        self.zipcodes = self.pincodes.to_frame()
         
         # Configuration
         self.max_search_radius_km = 25
+        self.initial_search_radius_km = PHARMACY_CONFIG["initial_search_radius_km"]
+        self.min_candidates = PHARMACY_CONFIG["min_candidates"]
+        self.max_results = PHARMACY_CONFIG["max_results"]  # Ranked matches returned (best + alternatives)
         self.delivery_speed_kmph = 30  # Average delivery speed
         self.base_delivery_fee = 25  # Base fee in rupees
         self.per_km_charge = 5  # Additional charge per km
+
+        # Derived search structures (rebuilt when source files change)
+        self._build_location_indexes()
+        self._live = self.data_store.derived("pharmacy_live_inventory", self._create_live_inventory)
+
+        # Incremental inventory updates (API + file drop) and compaction
+        self.delta_inbox = DeltaInbox(self.data_dir / "inventory_deltas")
+        self._inbox_lock = threading.Lock()
+        self._last_inbox_poll = 0.0
         
         self._log("INFO", f"Pharmacy Agent initialized with {len(self.pharmacies)} pharmacies")
     
-    def process(self, therapy_result: Dict, location: Dict) -> Dict:
+    @property
+    def stock(self) -> StockMatrix:
+        return self._live.stock
+
+    @stock.setter
+    def stock(self, stock: StockMatrix) -> None:
+        self._live.stock = stock
+
+    @property
+    def reservations(self) -> ReservationLedger:
+        return self._live.reservations
+
+    @reservations.setter
+    def reservations(self, ledger: ReservationLedger) -> None:
+        self._live.reservations = ledger
+
+    @property
+    def inventory(self) -> pd.DataFrame:
+        return self._live.inventory
+
+    @inventory.setter
+    def inventory(self, frame: pd.DataFrame) -> None:
+        self._live.inventory = frame
+
+    def _create_live_inventory(self) -> LiveInventory:
+        """Load inventory and build the shared stock matrix and reservation ledger."""
+        self._live = LiveInventory(self._load_inventory(), None, None, self._location_fingerprint)
+        stock = self._build_stock_matrix()
+        self._live.stock = stock
+        # The encoded copy above replaces the store's string table
+        self.data_store.invalidate("inventory")
+        self._live.reservations = ReservationLedger(
+            stock,
+            ttl_seconds=PHARMACY_CONFIG["reservation_ttl_minutes"] * 60,
+            stripes=PHARMACY_CONFIG["reservation_lock_stripes"],
+        )
+        return self._live
+
+    def process(self, therapy_result: Dict, location: Dict, context: Optional[RequestContext] = None) -> Dict:
         """
         Main processing method - match pharmacy and check stock.
         
+        ``context`` supplies the request's RNG (reservation IDs) and clock;
+        a fresh one is used if omitted.
+        
         Expected input:
         {
             "therapy_result": {
@@ -66,7 +220,12 @@ class PharmacyAgent:
                 "primary_condition": "pneumonia"
             },
             "location": {
-                "pincode": "380001"
+                "pincode": "380001",
+                "pharmacy_filters": {            # optional
+                    "verified_only": True,
+                    "min_rating": 4.0,
+                    "required_services": ["home_delivery"]
+                }
             }
         }
         
@@ -94,80 +253,395 @@ class PharmacyAgent:
         }
         """
         self._log("INFO", "Pharmacy Agent started processing")
+        context = RequestContext.ensure(context)
         
         try:
-            # Extract required medicines
-            otc_options = therapy_result.get("otc_options", [])
-            
-            if not otc_options:
-                self._log("WARNING", "No OTC medicines to match")
-                return self._no_medicines_response()
-            
-            # Build therapy map (sku -> recommendation details)
-            therapy_map = {item.get("sku"): item for item in otc_options if item.get("sku")}
+            self._refresh_location_indexes()
+            self._poll_inventory_inbox()
+
+            request, early_response = self._resolve_request(therapy_result, location, context)
+            if early_response is not None:
+                return context.stamp(early_response)
 
-            # Get patient location coordinates
-            location_context = self._normalize_location(location)
-            pincode = location_context.get("pincode")
+            nearby_pharmacies, pharmacy_matches = self._search_and_check_stock(request)
+            return context.stamp(self._finalize_match(request, nearby_pharmacies, pharmacy_matches))
             
-            if not pincode:
-                raw_val = location_context.get("raw_input")
-                self._log("WARNING", f"Invalid location payload: {raw_val}")
-                return self._location_error_response(raw_val or "")
-
-            patient_coords = self._get_coordinates(pincode)
-
-            if not patient_coords:
-                self._log("WARNING", f"Invalid pincode: {pincode}")
-                return self._location_error_response(pincode)
-
-            location_context["coordinates_used"] = patient_coords
-            default_coords = (DEFAULT_LOCATION["lat"], DEFAULT_LOCATION["lon"])
-            location_context["default_coordinates_applied"] = (
-                math.isclose(patient_coords[0], default_coords[0], rel_tol=1e-4)
-                and math.isclose(patient_coords[1], default_coords[1], rel_tol=1e-4)
+        except Exception as e:
+            self._log("ERROR", f"Pharmacy matching failed: {str(e)}")
+            return context.stamp(self._error_response(str(e)))
+
+    def process_many(
+        self,
+        requests: List[Tuple[Dict, Dict]],
+        context: Optional[RequestContext] = None
+    ) -> List[Dict]:
+        """
+        Match many (therapy_result, location) pairs in one call.
+
+        Requests that resolve to the same pincode, coordinates, search filters
+        and SKU basket share one candidate search and one stock check; only the
+        per-request response (quantities, reservation) is built individually.
+        Used by nightly re-matching of pending orders and replay tooling.
+
+        Args:
+            requests: List of (therapy_result, location) pairs, as for ``process``
+            context: RNG and clock for the whole batch (drawn from in input order)
+
+        Returns:
+            One response per request, in input order
+        """
+        self._log("INFO", f"Pharmacy Agent batch processing {len(requests)} request(s)")
+        results: List[Optional[Dict]] = [None] * len(requests)
+        context = RequestContext.ensure(context)
+
+        try:
+            self._refresh_location_indexes()
+            self._poll_inventory_inbox()
+        except Exception as e:
+            self._log("ERROR", f"Pharmacy matching failed: {str(e)}")
+            return [context.stamp(self._error_response(str(e))) for _ in requests]
+
+        groups: Dict[Tuple, List[Tuple[int, MatchRequest]]] = {}
+        for position, (therapy_result, location) in enumerate(requests):
+            try:
+                request, early_response = self._resolve_request(therapy_result, location, context)
+            except Exception as e:
+                self._log("ERROR", f"Pharmacy matching failed: {str(e)}")
+                results[position] = self._error_response(str(e))
+                continue
+            if early_response is not None:
+                results[position] = early_response
+            else:
+                groups.setdefault(request.group_key, []).append((position, request))
+
+        for members in groups.values():
+            try:
+                nearby_pharmacies, pharmacy_matches = self._search_and_check_stock(members[0][1])
+            except Exception as e:
+                self._log("ERROR", f"Pharmacy matching failed: {str(e)}")
+                for position, _ in members:
+                    results[position] = self._error_response(str(e))
+                continue
+
+            for position, request in members:
+                try:
+                    results[position] = self._finalize_match(
+                        request, nearby_pharmacies, list(pharmacy_matches)
+                    )
+                except Exception as e:
+                    self._log("ERROR", f"Pharmacy matching failed: {str(e)}")
+                    results[position] = self._error_response(str(e))
+
+        self._log("INFO", f"Batch matched {len(requests)} request(s) in {len(groups)} search group(s)")
+        return [context.stamp(result) for result in results]
+
+    def apply_inventory_deltas(
+        self,
+        deltas: Iterable[Union[InventoryDelta, Dict]],
+        source: str = "api"
+    ) -> Dict:
+        """
+        Apply inventory changes in place, without reloading inventory.csv.
+
+        Each delta sets an absolute quantity or adds a signed change to one
+        (pharmacy_id, sku) cell, optionally with a new price. Cells are written
+        under the pharmacy's reservation lock, so holds never see a torn
+        update, while matching requests keep reading the matrix. Unknown
+        pharmacies or SKUs are rejected: they need a full data reload.
+
+        Args:
+            deltas: InventoryDelta tuples or raw dicts (see ``parse_delta``)
+            source: Label for logs ("api", a file name, ...)
+
+        Returns:
+            Dict with status, the new inventory version and applied/rejected counts
+        """
+        rejected: List[str] = []
+        applied = 0
+
+        live = self._live
+        with live.write_lock:
+            stock = live.stock
+
+            # Validate the whole batch before touching the matrix
+            resolved = []
+            for delta in deltas:
+                try:
+                    if not isinstance(delta, InventoryDelta):
+                        delta = parse_delta(delta)
+                except (TypeError, ValueError, OverflowError) as e:
+                    rejected.append(str(e))
+                    continue
+
+                row = stock.pharmacy_index.get(delta.pharmacy_id)
+                col = stock.sku_index.get(delta.sku)
+                if row is None or col is None:
+                    rejected.append(f"unknown pharmacy or SKU: {delta.pharmacy_id}/{delta.sku}")
+                    continue
+                resolved.append((row, col, delta))
+
+            try:
+                for row, col, delta in resolved:
+                    with live.reservations.row_lock(row):
+                        stock.apply_delta(row, col, delta.qty, delta.qty_delta, delta.price)
+                    applied += 1
+            finally:
+                # Even if a write fails midway, caches keyed on the version must see the cells already changed
+                if applied:
+                    stock.version += 1
+                    live.deltas_since_compaction += applied
+            version = stock.version
+
+        self._log(
+            "INFO" if not rejected else "WARNING",
+            f"Inventory deltas from {source}: {applied} applied, {len(rejected)} rejected (version {version})"
+        )
+        if applied:
+            self._maybe_compact_inventory()
+
+        return {
+            "status": "success" if not rejected else ("partial" if applied else "error"),
+            "version": version,
+            "applied": applied,
+            "rejected": len(rejected),
+            "errors": rejected[:20],
+            "timestamp": datetime.now().isoformat(),
+        }
+
+    def ingest_inventory_drops(self) -> List[Dict]:
+        """
+        Apply every pending NDJSON/CSV delta file in ``data/inventory_deltas/``.
+
+        Files are applied oldest first and then moved to ``processed/`` (or
+        ``failed/`` when no line could be parsed or applying the file raised).
+        A bad file never stops the files after it.
+
+        Returns:
+            One apply summary per file
+        """
+        summaries = []
+        for path in self.delta_inbox.pending():
+            try:
+                deltas, errors = read_delta_file(path)
+                summary = self.apply_inventory_deltas(deltas, source=path.name)
+            except Exception as e:
+                self._log("ERROR", f"Inventory delta file {path.name} failed: {e}")
+                summary = {"status": "error", "applied": 0, "rejected": 0, "errors": [str(e)]}
+                deltas, errors = [], []
+            summary["file"] = path.name
+            summary["rejected"] += len(errors)
+            summary["errors"] = (errors + summary["errors"])[:20]
+            if errors and summary["status"] == "success":
+                summary["status"] = "partial"
+            try:
+                self.delta_inbox.archive(path, failed=not deltas or summary["status"] == "error")
+            except OSError as e:
+                self._log("ERROR", f"Could not archive inventory delta file {path.name}: {e}")
+            summaries.append(summary)
+        return summaries
+
+    def _poll_inventory_inbox(self) -> None:
+        """Pick up dropped delta files, at most once per poll interval and one thread at a time."""
+        now = time.monotonic()
+        if now - self._last_inbox_poll < PHARMACY_CONFIG["inventory_poll_interval_s"]:
+            return
+        if not self._inbox_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_inbox_poll = now
+            self.ingest_inventory_drops()
+        except Exception as e:
+            # Inbox trouble must never fail a patient's match
+            self._log("ERROR", f"Inventory inbox polling failed: {e}")
+        finally:
+            self._inbox_lock.release()
+
+    def compact_inventory(self) -> Dict:
+        """Write the current in-memory inventory back to ``inventory.csv``."""
+        with self._live.write_lock:
+            return self._compact_inventory_locked()
+
+    def memory_diagnostics(self) -> Dict:
+        """
+        Memory held by the pharmacy tables, with and without dictionary encoding.
+
+        ``decoded_bytes`` is the footprint with plain string columns (the
+        representation before encoding), ``encoded_bytes`` the current one.
+        """
+        tables = {}
+        for name, frame in (("inventory", self.inventory), ("pharmacies", self.pharmacies)):
+            decoded = frame_memory_bytes(frame, decoded=True)
+            encoded = frame_memory_bytes(frame)
+            tables[name] = {
+                "rows": len(frame),
+                "decoded_bytes": decoded,
+                "encoded_bytes": encoded,
+                "reduction": round(decoded / encoded, 2) if encoded else None,
+            }
+
+        stock = self.stock
+        matrix_bytes = stock.qty.nbytes + stock.price.nbytes + stock.listed.nbytes + self.reservations.held.nbytes
+        self._log(
+            "INFO",
+            "Memory: " + ", ".join(
+                f"{name} {info['decoded_bytes'] / 1024:.0f}KB -> {info['encoded_bytes'] / 1024:.0f}KB"
+                for name, info in tables.items()
             )
-            
-            # Find nearby pharmacies
-            nearby_pharmacies = self._find_nearby_pharmacies(
-                patient_coords,
+        )
+        return {
+            "status": "success",
+            "tables": tables,
+            "stock_matrix_bytes": int(matrix_bytes),
+            "timestamp": datetime.now().isoformat(),
+        }
+
+    def _maybe_compact_inventory(self) -> None:
+        due = (
+            self._live.deltas_since_compaction >= PHARMACY_CONFIG["inventory_compact_every"]
+            or time.monotonic() - self._live.last_compaction >= PHARMACY_CONFIG["inventory_compact_interval_s"]
+        )
+        if due:
+            self.compact_inventory()
+
+    def _compact_inventory_locked(self) -> Dict:
+        """Snapshot the stock matrix to disk; caller holds the inventory write lock."""
+        stock = self.stock
+        frame = stock.to_frame()
+
+        # Rows for pharmacies missing from pharmacies.json are not in the matrix; keep them
+        orphaned = self.inventory[~self.inventory['pharmacy_id'].astype(str).isin(stock.pharmacy_index)]
+        columns = ['pharmacy_id', 'sku', 'qty_available', 'price']
+        frame = pd.concat([frame, orphaned[columns]], ignore_index=True)
+
+        write_csv_atomic(
+            self.data_dir / "inventory.csv",
+            columns,
+            frame[columns].itertuples(index=False, name=None)
+        )
+
+        self.inventory = self._join_catalog(frame)
+        self.data_store.invalidate("inventory")
+        if read_manifest(self.data_dir):
+            # Keep the binary snapshot in step so the next start can mmap it
+            build_snapshot(self.data_dir, ["inventory"])
+
+        compacted = self._live.deltas_since_compaction
+        self._live.deltas_since_compaction = 0
+        self._live.last_compaction = time.monotonic()
+        self._log("INFO", f"Inventory compacted to disk: {len(frame)} rows, {compacted} delta(s), version {stock.version}")
+        return {"status": "success", "version": stock.version, "rows": len(frame), "deltas": compacted}
+
+    def _resolve_request(
+        self,
+        therapy_result: Dict,
+        location: Dict,
+        context: Optional[RequestContext] = None
+    ) -> Tuple[Optional[MatchRequest], Optional[Dict]]:
+        """
+        Validate one request and resolve its location.
+
+        Returns:
+            (MatchRequest, None) when matching can proceed, otherwise
+            (None, response) with the early no-medicines / location error
+        """
+        # Extract required medicines
+        otc_options = therapy_result.get("otc_options", [])
+        
+        if not otc_options:
+            self._log("WARNING", "No OTC medicines to match")
+            return None, self._no_medicines_response()
+        
+        # Build therapy map (sku -> recommendation details)
+        therapy_map = {item.get("sku"): item for item in otc_options if item.get("sku")}
+
+        # Get patient location coordinates
+        location_context = self._normalize_location(location)
+        pincode = location_context.get("pincode")
+        
+        if not pincode:
+            raw_val = location_context.get("raw_input")
+            self._log("WARNING", f"Invalid location payload: {raw_val}")
+            return None, self._location_error_response(raw_val or "")
+
+        patient_coords = self._get_coordinates(pincode)
+
+        if not patient_coords:
+            self._log("WARNING", f"Invalid pincode: {pincode}")
+            return None, self._location_error_response(pincode)
+
+        location_context["coordinates_used"] = patient_coords
+        location_context["default_coordinates_applied"] = pincode not in self.pincodes
+
+        search_kwargs = {
+            "patient_city": location_context.get("city"),
+            "patient_pincode": location_context.get("pincode"),
+            **self._search_filters((location or {}).get("pharmacy_filters")),
+        }
+        return MatchRequest(therapy_map, location_context, tuple(patient_coords), search_kwargs, context), None
+
+    def _search_and_check_stock(self, request: MatchRequest) -> Tuple[List[Dict], List[Dict]]:
+        """Candidate search plus stock check for one request (or one batch group)."""
+        # Find nearby pharmacies, starting with a small ring around the patient
+        rows, nearby_pharmacies = self._search_candidates(
+            request.patient_coords,
+            self.max_search_radius_km,
+            min_candidates=self.min_candidates,
+            **request.search_kwargs
+        )
+        pharmacy_matches = self._check_stock_availability(nearby_pharmacies, request.therapy_map, rows=rows)
+
+        if not pharmacy_matches and self.min_candidates is not None:
+            # The ring may have stopped early; fall back to the full radius
+            rows, nearby_pharmacies = self._search_candidates(
+                request.patient_coords,
                 self.max_search_radius_km,
-                patient_city=location_context.get("city"),
-                patient_pincode=location_context.get("pincode")
-            )
-            
-            if not nearby_pharmacies:
-                self._log("WARNING", "No pharmacies found in delivery range")
-                return self._no_pharmacies_response()
-            
-            # Check stock availability at each pharmacy
-            pharmacy_matches = self._check_stock_availability(
-                nearby_pharmacies,
-                therapy_map
+                **request.search_kwargs
             )
-            
-            if not pharmacy_matches:
-                self._log("WARNING", "No pharmacies have required medicines in stock")
-                return self._out_of_stock_response(nearby_pharmacies[0])
-            
-            # Select best pharmacy (closest with full stock)
-            best_match = self._select_best_pharmacy(pharmacy_matches)
-            
-            # Calculate pricing and delivery details
+            pharmacy_matches = self._check_stock_availability(nearby_pharmacies, request.therapy_map, rows=rows)
+
+        return nearby_pharmacies, pharmacy_matches
+
+    def _finalize_match(
+        self,
+        request: MatchRequest,
+        nearby_pharmacies: List[Dict],
+        pharmacy_matches: List[Dict]
+    ) -> Dict:
+        """Pick the best pharmacy and build the response for one request."""
+        if not nearby_pharmacies:
+            self._log("WARNING", "No pharmacies found in delivery range")
+            return self._no_pharmacies_response()
+        
+        if not pharmacy_matches:
+            self._log("WARNING", "No pharmacies have required medicines in stock")
+            return self._out_of_stock_response(nearby_pharmacies[0])
+        
+        # Rank the best N matches; the first is reserved, the rest are fallbacks
+        ranked = self._rank_pharmacies(pharmacy_matches, self.max_results)
+        
+        # Calculate pricing and delivery details; if stock was promised to a
+        # concurrent request in the meantime, move on to the next ranked match
+        for position, match in enumerate(ranked):
             result = self._prepare_pharmacy_response(
-                best_match,
-                patient_coords,
-                therapy_map,
-                location_context
+                match,
+                request.patient_coords,
+                request.therapy_map,
+                request.location_context,
+                RequestContext.ensure(request.context)
             )
-            
-            self._log("SUCCESS", f"Matched pharmacy: {result['pharmacy_name']} ({result['distance_km']:.1f} km)")
-            
-            return result
-            
-        except Exception as e:
-            self._log("ERROR", f"Pharmacy matching failed: {str(e)}")
-            return self._error_response(str(e))
+            if result is not None:
+                break
+        else:
+            self._log("WARNING", "Stock at every ranked pharmacy is already reserved")
+            return self._out_of_stock_response(nearby_pharmacies[0])
+
+        result["alternatives"] = [
+            self._alternative_summary(match) for match in ranked[position + 1:]
+        ]
+        
+        self._log("SUCCESS", f"Matched pharmacy: {result['pharmacy_name']} ({result['distance_km']:.1f} km)")
+        
+        return result
     
     def _load_pharmacies(self) -> pd.DataFrame:
         """Load pharmacies database."""
@@ -176,35 +650,231 @@ class PharmacyAgent:
         if not pharmacy_file.exists():
             raise FileNotFoundError(f"Pharmacies database not found: {pharmacy_file}")
         
-        with open(pharmacy_file, 'r') as f:
-            data = json.load(f)
-        
-        df = pd.DataFrame(data)
+        df = self.data_store.derived(
+            "pharmacy_table",
+            lambda: encode_frame(self.data_store.table("pharmacies"), {name: () for name in PHARMACY_CATEGORY_COLUMNS}),
+            version=self.data_store.table_version("pharmacies"),
+        )
         self._log("INFO", f"Loaded {len(df)} pharmacies")
         return df
     
+    def _location_sources_fingerprint(self) -> Tuple:
+        """(mtime, size) of the files the location indexes are derived from."""
+        fingerprint = []
+        for name in ("pharmacies.json", "zipcodes.csv"):
+            try:
+                stat = (self.data_dir / name).stat()
+                fingerprint.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                fingerprint.append(None)
+        return tuple(fingerprint)
+
+    def _build_location_indexes(self) -> None:
+        """Fetch (or build) the shared location indexes for the current data and radius."""
+        fingerprint = self._location_sources_fingerprint()
+        indexes = self.data_store.derived(
+            ("pharmacy_location", self.max_search_radius_km),
+            self._compute_location_indexes,
+            version=fingerprint,
+        )
+        for name, value in indexes.items():
+            setattr(self, name, value)
+        self._location_fingerprint = fingerprint
+
+    def _compute_location_indexes(self) -> Dict:
+        """Build pharmacy columns, the spatial grid and the pincode coverage table."""
+        self._build_pharmacy_columns()
+        self.spatial_index = self._build_spatial_index()
+        self.pincode_coverage = self._build_pincode_coverage(self.max_search_radius_km)
+        self._coverage_radius_km = self.max_search_radius_km
+        return {name: getattr(self, name) for name in LOCATION_INDEX_ATTRS}
+
+    def _refresh_location_indexes(self) -> None:
+        """Reload and rebuild the location indexes if their inputs changed."""
+        fingerprint = self._location_sources_fingerprint()
+        if fingerprint != self._location_fingerprint:
+            self._log("INFO", "Pharmacy or zipcode data changed on disk - rebuilding location indexes")
+            self.data_store.refresh("pharmacies")
+            self.pharmacies = self._load_pharmacies()
+            self.pincodes = self._load_pincode_directory()
+            self.zipcodes = self.pincodes.to_frame()
+            self._build_location_indexes()
+            live = self._live
+            with live.write_lock:
+                if live.fingerprint != fingerprint:
+                    if live.deltas_since_compaction:
+                        # Fold applied deltas into self.inventory before re-pivoting
+                        self._compact_inventory_locked()
+                    live.stock = self._build_stock_matrix()
+                    dropped = live.reservations.rebind(live.stock)
+                    if dropped:
+                        self._log("WARNING", f"Expired {dropped} reservation(s) at pharmacies no longer listed")
+                    live.fingerprint = fingerprint
+        elif self._coverage_radius_km != self.max_search_radius_km:
+            self._build_location_indexes()
+
+    def _build_pincode_coverage(self, radius_km: float) -> Dict[str, PincodeCoverage]:
+        """
+        Precompute the ordered candidate list for every known pincode centroid.
+
+        Each entry holds the pharmacies within ``min(radius_km, delivery_km)``
+        of the centroid, already classified as exact pincode / same city /
+        nearby (using the pincode's own city) and sorted by priority.
+        """
+        coverage: Dict[str, PincodeCoverage] = {}
+        for record in self.pincodes:
+            key = record.pincode
+            found = self.spatial_index.query(record.lat, record.lon, radius_km)
+            city_key = record.city.lower()
+            match_codes = self._classify_location_match(found.indices, city_key, key)
+            order = np.argsort(self._priority_scores(found.distances_km, match_codes), kind="stable")
+
+            coverage[key] = PincodeCoverage(
+                lat=record.lat,
+                lon=record.lon,
+                city_key=city_key,
+                indices=found.indices[order],
+                distances_km=found.distances_km[order],
+                match_codes=match_codes[order],
+            )
+
+        self._log("INFO", f"Pincode coverage built for {len(coverage)} pincodes within {radius_km}km")
+        return coverage
+
+    def _coverage_entry(
+        self,
+        patient_coords: Tuple[float, float],
+        max_radius_km: float,
+        patient_pincode: Optional[str]
+    ) -> Optional[PincodeCoverage]:
+        """Return the precomputed coverage if it applies to this exact query."""
+        if not patient_pincode or max_radius_km != self._coverage_radius_km:
+            return None
+        entry = self.pincode_coverage.get(str(patient_pincode))
+        if entry is None:
+            return None
+        if not (math.isclose(patient_coords[0], entry.lat, abs_tol=1e-9)
+                and math.isclose(patient_coords[1], entry.lon, abs_tol=1e-9)):
+            return None
+        return entry
+
+    def _build_pharmacy_columns(self) -> None:
+        """
+        Hold the pharmacy table as contiguous NumPy columns.
+
+        Coordinates are stored in radians, pincodes and (lower-cased) cities as
+        integer codes, so candidate search is a handful of array operations.
+        Dict copies are only made for pharmacies that end up in a result.
+        """
+        df = self.pharmacies
+        missing = pd.Series("", index=df.index)
+
+        self._pharmacy_records: List[Dict] = df.to_dict("records")
+        self._ph_lat_rad = np.ascontiguousarray(np.radians(df["lat"].to_numpy(dtype=np.float64)))
+        self._ph_lon_rad = np.ascontiguousarray(np.radians(df["lon"].to_numpy(dtype=np.float64)))
+
+        delivery_km = df["delivery_km"] if "delivery_km" in df else pd.Series(10, index=df.index)
+        self._ph_delivery_km = np.ascontiguousarray(delivery_km.fillna(10).to_numpy(dtype=np.float64))
+
+        pincode = encode_categorical(df.get("pincode", missing))
+        self._ph_pincode_codes = np.ascontiguousarray(pincode.cat.codes, dtype=np.int32)
+        self._pincode_code_map = {value: code for code, value in enumerate(pincode.cat.categories)}
+
+        city = encode_categorical(df.get("city", missing).astype(str).str.lower())
+        self._ph_city_codes = np.ascontiguousarray(city.cat.codes, dtype=np.int32)
+        self._city_code_map = {value: code for code, value in enumerate(city.cat.categories)}
+
+    def _build_spatial_index(self) -> SpatialGridIndex:
+        """Bucket pharmacies into a uniform lat/lon grid for radius queries."""
+        df = self.pharmacies
+        index = SpatialGridIndex(
+            df["lat"].to_numpy(dtype=np.float64),
+            df["lon"].to_numpy(dtype=np.float64),
+            reach_km=self._ph_delivery_km,
+            cell_deg=PHARMACY_CONFIG["grid_cell_deg"],
+            verified=df["verified"].fillna(False).to_numpy(dtype=bool) if "verified" in df else None,
+            rating=df["rating"].fillna(0).to_numpy(dtype=np.float32) if "rating" in df else None,
+            services=df["services"].tolist() if "services" in df else None,
+        )
+        self._log("INFO", f"Spatial index built: {index.cell_count} cells of {index.cell_deg}°")
+        return index
+
+    @staticmethod
+    def _search_filters(filters: Optional[Dict]) -> Dict:
+        """Map an optional ``pharmacy_filters`` payload to search keyword arguments."""
+        filters = filters or {}
+        services = filters.get("required_services") or []
+        if isinstance(services, str):
+            services = [item.strip() for item in services.split(",") if item.strip()]
+        min_rating = filters.get("min_rating")
+        return {
+            "verified_only": bool(filters.get("verified_only", False)),
+            "min_rating": float(min_rating) if min_rating is not None else None,
+            "required_services": list(services),
+        }
+
+    def _load_medicines(self) -> pd.DataFrame:
+        """Load the medicine catalog used to describe inventory SKUs."""
+        meds_file = self.data_dir / "meds.csv"
+        
+        if not meds_file.exists():
+            self._log("WARNING", f"Medicines catalog not found: {meds_file}")
+            return pd.DataFrame(columns=['sku', 'drug_name', 'form', 'strength'])
+        
+        df = self.data_store.table("meds")
+        self._log("INFO", f"Loaded {len(df)} catalog medicines")
+        return df
+
     def _load_inventory(self) -> pd.DataFrame:
-        """Load inventory database."""
+        """Load inventory database, joined with catalog drug details."""
         inventory_file = self.data_dir / "inventory.csv"
         
         if not inventory_file.exists():
             raise FileNotFoundError(f"Inventory database not found: {inventory_file}")
         
-        df = pd.read_csv(inventory_file)
+        df = self._join_catalog(self.data_store.table("inventory"))
         self._log("INFO", f"Loaded {len(df)} inventory records")
         return df
+
+    def _join_catalog(self, inventory: pd.DataFrame) -> pd.DataFrame:
+        """
+        Attach drug_name/form/strength from meds.csv to inventory rows.
+
+        IDs and catalog text are dictionary-encoded: pharmacy_id shares the
+        pharmacy table's ID order and sku the catalog order, so each row holds
+        small integer codes instead of repeated strings.
+        """
+        catalog_cols = [col for col in CATALOG_CATEGORY_COLUMNS if col in self.medicines]
+        if catalog_cols:
+            catalog = self.medicines[['sku'] + catalog_cols].drop_duplicates('sku')
+            inventory = inventory.merge(catalog, on='sku', how='left')
+        columns = {
+            'pharmacy_id': self.pharmacies['id'].astype(str).tolist(),
+            'sku': self.medicines['sku'].astype(str).tolist() if 'sku' in self.medicines else [],
+        }
+        columns.update({col: () for col in catalog_cols})
+        return encode_frame(inventory, columns)
+
+    def _build_stock_matrix(self) -> StockMatrix:
+        """Pivot inventory into a dense pharmacy × SKU matrix aligned with pharmacy rows."""
+        stock = StockMatrix.from_frames(self.inventory, self.pharmacies['id'], self.medicines)
+        if stock.unmatched_rows:
+            self._log("WARNING", f"{stock.unmatched_rows} inventory rows reference unknown pharmacies")
+        pharmacies, skus = stock.shape
+        self._log("INFO", f"Stock matrix built: {pharmacies} pharmacies × {skus} SKUs")
+        return stock
     
-    def _load_zipcodes(self) -> pd.DataFrame:
-        """Load zipcodes database."""
+    def _load_pincode_directory(self) -> PincodeDirectory:
+        """Load the shared pincode directory for this data folder."""
         zipcode_file = self.data_dir / "zipcodes.csv"
         
         if not zipcode_file.exists():
             self._log("WARNING", f"Zipcodes database not found: {zipcode_file}")
-            return pd.DataFrame(columns=['pincode', 'lat', 'lon'])
+            return PincodeDirectory()
         
-        df = pd.read_csv(zipcode_file)
-        self._log("INFO", f"Loaded {len(df)} zipcodes")
-        return df
+        directory = self.data_store.pincodes
+        self._log("INFO", f"Loaded {len(directory)} zipcodes")
+        return directory
     
     def _get_coordinates(self, pincode: str) -> Optional[Tuple[float, float]]:
         """
@@ -214,23 +884,17 @@ class PharmacyAgent:
             pincode: Indian pincode (6 digits)
             
         Returns:
-            Tuple of (lat, lon) or None if not found
+            Tuple of (lat, lon), the default location for an unknown
+            6-digit pincode (see ``self.pincodes.resolve``), or None if
+            the value is not a pincode
         """
         if not pincode or len(str(pincode).strip()) != 6:
             return None
-        
-        try:
-            pincode_int = int(pincode)
-            match = self.zipcodes[self.zipcodes['pincode'] == pincode_int]
-            
-            if not match.empty:
-                return (float(match.iloc[0]['lat']), float(match.iloc[0]['lon']))
-        except:
-            pass
 
-        # Fallback to default location (Ahmedabad)
-        self._log("WARNING", f"Pincode {pincode} not found, using default location")
-        return (DEFAULT_LOCATION["lat"], DEFAULT_LOCATION["lon"])
+        lookup = self.pincodes.resolve(pincode)
+        if not lookup.found:
+            self._log("WARNING", f"Pincode {pincode} not found, using default location")
+        return lookup.coords
 
     def _normalize_location(self, location: Optional[Dict]) -> Dict:
         """Extract and sanitize location fields from payload."""
@@ -279,7 +943,11 @@ class PharmacyAgent:
         patient_coords: Tuple[float, float],
         max_radius_km: float,
         patient_city: Optional[str] = None,
-        patient_pincode: Optional[str] = None
+        patient_pincode: Optional[str] = None,
+        min_candidates: Optional[int] = None,
+        verified_only: bool = False,
+        min_rating: Optional[float] = None,
+        required_services: Optional[List[str]] = None
     ) -> List[Dict]:
         """
         Find pharmacies within delivery radius, prioritizing same city/pincode.
@@ -289,57 +957,137 @@ class PharmacyAgent:
             max_radius_km: Maximum search radius
             patient_city: Patient's city for prioritization
             patient_pincode: Patient's pincode for exact matching
+            min_candidates: Stop growing the search ring once this many pharmacies
+                are in range (None searches the full radius)
+            verified_only: Only consider verified pharmacies
+            min_rating: Minimum pharmacy rating
+            required_services: Services every candidate must offer
             
         Returns:
-            List of pharmacy dicts with distance calculated, sorted by priority
+            List of pharmacy dicts with distance calculated. The first
+            ``max_results`` are sorted by priority; the remainder (still
+            needed for the stock check) may follow in table order.
+        """
+        return self._search_candidates(
+            patient_coords,
+            max_radius_km,
+            patient_city=patient_city,
+            patient_pincode=patient_pincode,
+            min_candidates=min_candidates,
+            verified_only=verified_only,
+            min_rating=min_rating,
+            required_services=required_services,
+        )[1]
+
+    def _search_candidates(
+        self,
+        patient_coords: Tuple[float, float],
+        max_radius_km: float,
+        patient_city: Optional[str] = None,
+        patient_pincode: Optional[str] = None,
+        min_candidates: Optional[int] = None,
+        verified_only: bool = False,
+        min_rating: Optional[float] = None,
+        required_services: Optional[List[str]] = None
+    ) -> Tuple[np.ndarray, List[Dict]]:
+        """
+        Candidate search behind ``_find_nearby_pharmacies``.
+
+        Returns:
+            (rows, pharmacies) - pharmacy table rows (also the StockMatrix
+            rows) aligned with the result dicts
         """
-        nearby = []
         patient_lat, patient_lon = patient_coords
-        
-        for _, pharmacy in self.pharmacies.iterrows():
-            # Calculate distance
-            distance = self._haversine_distance(
-                patient_lat, patient_lon,
-                pharmacy['lat'], pharmacy['lon']
+        filters = {
+            "verified_only": verified_only,
+            "min_rating": min_rating,
+            "required_services": required_services,
+        }
+
+        coverage = self._coverage_entry(patient_coords, max_radius_km, patient_pincode)
+        if coverage is not None:
+            # Dictionary lookup: the candidate list for this centroid is precomputed
+            in_range = coverage.indices
+            in_range_km = coverage.distances_km
+            keep = self.spatial_index.filter_mask(in_range, **filters)
+            if not keep.all():
+                in_range, in_range_km = in_range[keep], in_range_km[keep]
+            searched_radius_km, cells_visited = max_radius_km, 0
+            city_key = str(patient_city).lower() if patient_city else ""
+            precomputed = city_key == coverage.city_key
+            match_codes = coverage.match_codes[keep] if precomputed else None
+        else:
+            found = self.spatial_index.query(
+                patient_lat,
+                patient_lon,
+                max_radius_km,
+                min_results=min_candidates,
+                initial_radius_km=self.initial_search_radius_km,
+                **filters,
             )
-            
-            # Check if within delivery range
-            pharmacy_delivery_km = pharmacy.get('delivery_km', 10)
-            
-            if distance <= min(max_radius_km, pharmacy_delivery_km):
-                pharmacy_dict = pharmacy.to_dict()
-                pharmacy_dict['distance_km'] = round(distance, 2)
-                
-                # Calculate priority score (lower is better)
-                # CRITICAL: Exact pincode must always win, regardless of distance
-                # Priority: exact pincode match >>> same city >> distance
-                priority_score = distance
-                
-                if patient_pincode and str(pharmacy.get('pincode', '')) == str(patient_pincode):
-                    # Exact pincode match gets massive priority boost - guaranteed to be first
-                    priority_score -= 100000  # Extremely high priority
-                    pharmacy_dict['location_match'] = 'exact_pincode'
-                elif patient_city and str(pharmacy.get('city', '')).lower() == str(patient_city).lower():
-                    # Same city gets moderate priority
-                    priority_score -= 10000  # High priority but less than exact pincode
-                    pharmacy_dict['location_match'] = 'same_city'
-                else:
-                    pharmacy_dict['location_match'] = 'nearby'
-                
-                pharmacy_dict['priority_score'] = priority_score
-                nearby.append(pharmacy_dict)
-        
-        # Sort by priority score (exact pincode > same city > closest)
-        nearby.sort(key=lambda x: x['priority_score'])
-        
-        match_stats = {}
-        for p in nearby:
-            match_type = p.get('location_match', 'nearby')
-            match_stats[match_type] = match_stats.get(match_type, 0) + 1
-        
-        self._log("INFO", f"Found {len(nearby)} pharmacies within {max_radius_km}km - {match_stats}")
-        
-        return nearby
+            in_range = found.indices
+            in_range_km = found.distances_km
+            searched_radius_km, cells_visited = found.searched_radius_km, found.cells_visited
+            match_codes = None
+
+        if match_codes is None:
+            # CRITICAL: Exact pincode must always win, regardless of distance
+            match_codes = self._classify_location_match(in_range, patient_city, patient_pincode)
+            order = top_k_order(self._priority_scores(in_range_km, match_codes), self.max_results)
+            in_range, in_range_km, match_codes = in_range[order], in_range_km[order], match_codes[order]
+
+        priority = self._priority_scores(in_range_km, match_codes)
+        nearby = [
+            self._candidate_record(in_range[i], in_range_km[i], match_codes[i], priority[i])
+            for i in range(in_range.size)
+        ]
+        
+        counts = np.bincount(match_codes, minlength=len(MATCH_LABELS))
+        match_stats = {label: int(count) for label, count in zip(MATCH_LABELS, counts) if count}
+        
+        self._log(
+            "INFO",
+            f"Found {len(nearby)} pharmacies within {searched_radius_km:g}km "
+            f"({cells_visited} grid cells) - {match_stats}"
+        )
+        
+        return in_range, nearby
+
+    def _classify_location_match(
+        self,
+        indices: np.ndarray,
+        patient_city: Optional[str],
+        patient_pincode: Optional[str]
+    ) -> np.ndarray:
+        """Return MATCH_* codes for the given pharmacy rows."""
+        match_codes = np.full(indices.size, MATCH_NEARBY, dtype=np.int8)
+
+        if patient_city:
+            city_code = self._city_code_map.get(str(patient_city).lower(), -1)
+            match_codes[self._ph_city_codes[indices] == city_code] = MATCH_SAME_CITY
+
+        if patient_pincode:
+            pincode_code = self._pincode_code_map.get(str(patient_pincode), -1)
+            match_codes[self._ph_pincode_codes[indices] == pincode_code] = MATCH_EXACT_PINCODE
+
+        return match_codes
+
+    @staticmethod
+    def _priority_scores(distances_km: np.ndarray, match_codes: np.ndarray) -> np.ndarray:
+        """Priority score per candidate (lower is better)."""
+        return (
+            distances_km
+            - EXACT_PINCODE_BOOST * (match_codes == MATCH_EXACT_PINCODE)
+            - SAME_CITY_BOOST * (match_codes == MATCH_SAME_CITY)
+        )
+
+    def _candidate_record(self, index: int, distance: float, match_code: int, priority: float) -> Dict:
+        """Materialize a result dict for one pharmacy row."""
+        pharmacy_dict = dict(self._pharmacy_records[index])
+        pharmacy_dict['distance_km'] = round(float(distance), 2)
+        pharmacy_dict['location_match'] = MATCH_LABELS[match_code]
+        pharmacy_dict['priority_score'] = float(priority)
+        return pharmacy_dict
     
     def _haversine_distance(
         self,
@@ -352,140 +1100,244 @@ class PharmacyAgent:
         Returns:
             Distance in kilometers
         """
-        # Convert to radians
-        lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-        
-        # Haversine formula
-        dlat = lat2 - lat1
-        dlon = lon2 - lon1
-        a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-        c = 2 * math.asin(math.sqrt(a))
-        
-        # Earth radius in kilometers
-        r = 6371
-        
-        return c * r
+        return haversine_km(lat1, lon1, lat2, lon2)
     
     def _check_stock_availability(
         self,
         pharmacies: List[Dict],
-        therapy_map: Dict[str, Dict]
+        therapy_map: Dict[str, Dict],
+        rows: Optional[np.ndarray] = None
     ) -> List[Dict]:
         """
         Check which pharmacies have the required medicines in stock.
         
         Args:
             pharmacies: List of nearby pharmacies
-            otc_options: List of required medicines with SKUs
+            therapy_map: Required medicines keyed by SKU
+            rows: Pharmacy table rows of ``pharmacies`` (from the candidate
+                search); looked up by ID when omitted
             
         Returns:
             List of pharmacies with stock information
         """
         required_skus = [sku for sku in therapy_map.keys() if sku]
-        matches = []
-
-        for pharmacy in pharmacies:
-            pharmacy_id = pharmacy['id']
-
-            # Get inventory for this pharmacy
-            pharmacy_inventory = self.inventory[
-                self.inventory['pharmacy_id'] == pharmacy_id
-            ]
+        if not pharmacies or not required_skus:
+            return []
+
+        stock = self.stock
+        if rows is None or self._live.fingerprint != self._location_fingerprint:
+            # Matrix rows only follow the pharmacy table built from the same files
+            rows = stock.pharmacy_codes(pharmacy['id'] for pharmacy in pharmacies)
+        cols = stock.sku_codes(required_skus)
+
+        # Popcount over the availability bitsets drops candidates holding none
+        # of the basket before any quantity/price cell is read
+        stocked_counts = stock.availability.coverage_counts(rows, cols)
+        stocked = np.flatnonzero(stocked_counts)
+        if not stocked.size:
+            return []
+
+        # One fancy-indexing lookup for every (stocked candidate, SKU) pair;
+        # quantities are available-to-promise, i.e. net of live reservations
+        self.reservations.sweep()
+        _, price = stock.block(rows[stocked], cols)
+        qty = self.reservations.available(rows[stocked], cols)
+        in_stock = qty > 0
+        if not in_stock.all():
+            held_out = ~in_stock.any(axis=1)
+            stocked_counts[stocked] = in_stock.sum(axis=1)
+            if held_out.any():
+                keep = ~held_out
+                stocked, qty, price, in_stock = stocked[keep], qty[keep], price[keep], in_stock[keep]
+
+        stock_percentage = stocked_counts / len(required_skus) * 100
 
-            # Check availability of each required medicine
+        matches = []
+        for r, i in enumerate(stocked):
             available_items = []
-            missing_items = []
-
-            for sku in required_skus:
-                item = pharmacy_inventory[pharmacy_inventory['sku'] == sku]
-
-                if not item.empty and item.iloc[0]['qty'] > 0:
-                    therapy_details = therapy_map.get(sku, {})
-                    available_items.append({
-                        'sku': sku,
-                        'drug_name': item.iloc[0]['drug_name'],
-                        'form': item.iloc[0]['form'],
-                        'strength': item.iloc[0]['strength'],
-                        'price': float(item.iloc[0]['price']),
-                        'qty_available': int(item.iloc[0]['qty']),
-                        'therapy_details': therapy_details
-                    })
-                else:
-                    missing_items.append(sku)
-
-            # Add pharmacy to matches if it has at least some items
-            if available_items:
-                pharmacy_copy = pharmacy.copy()
-                pharmacy_copy['available_items'] = available_items
-                pharmacy_copy['missing_items'] = missing_items
-                pharmacy_copy['stock_percentage'] = len(available_items) / len(required_skus) * 100
-                matches.append(pharmacy_copy)
+            for k in np.flatnonzero(in_stock[r]):
+                sku = required_skus[k]
+                col = cols[k]
+                available_items.append({
+                    'sku': sku,
+                    'drug_name': stock.drug_name[col],
+                    'form': stock.form[col],
+                    'strength': stock.strength[col],
+                    'price': round(float(price[r, k]), 2),
+                    'qty_available': int(qty[r, k]),
+                    'therapy_details': therapy_map.get(sku, {})
+                })
+
+            pharmacy_copy = pharmacies[i].copy()
+            pharmacy_copy['available_items'] = available_items
+            pharmacy_copy['missing_items'] = [required_skus[k] for k in np.flatnonzero(~in_stock[r])]
+            pharmacy_copy['stock_percentage'] = float(stock_percentage[i])
+            matches.append(pharmacy_copy)
 
         return matches
     
-    def _select_best_pharmacy(self, pharmacy_matches: List[Dict]) -> Dict:
+    def match_baskets(
+        self,
+        baskets: List[List[str]],
+        pharmacy_ids: Optional[List[str]] = None
+    ) -> List[Dict]:
+        """
+        Screen many SKU baskets against current stock using the availability bitsets.
+
+        Meant for batch and what-if matching: no quantity or price cells are
+        read, only the per-SKU and per-pharmacy bitsets.
+
+        Args:
+            baskets: SKU lists, one per basket
+            pharmacy_ids: Optional candidate pharmacies (e.g. from a geo search);
+                defaults to every pharmacy
+
+        Returns:
+            One dict per basket, in input order, with ``full_match`` (pharmacy IDs
+            stocking the whole basket, table order) and ``coverage`` (pharmacy ID ->
+            number of basket SKUs in stock, only pharmacies with at least one)
+        """
+        stock = self.stock
+        bitsets = stock.availability
+        if pharmacy_ids is None:
+            rows = np.arange(len(stock.pharmacy_ids))
+            candidates = None
+        else:
+            rows = stock.pharmacy_codes(pharmacy_ids)
+            rows = rows[rows >= 0]
+            candidates = bitsets.rows_to_bits(rows)
+
+        results = []
+        for basket in baskets:
+            skus = list(dict.fromkeys(str(sku) for sku in basket if sku))
+            cols = [int(col) for col in stock.sku_codes(skus)]
+            full = bitsets.full_basket(cols, candidates)
+            counts = bitsets.coverage_counts(rows, cols)
+            covered = np.flatnonzero(counts)
+            results.append({
+                "skus": skus,
+                "full_match": [stock.pharmacy_ids[row] for row in bitsets.bits_to_rows(full)],
+                "coverage": {stock.pharmacy_ids[rows[i]]: int(counts[i]) for i in covered},
+            })
+        return results
+
+    @staticmethod
+    def _ranking_key(match: Dict) -> Tuple:
+        return (
+            match.get('priority_score', 999999),  # Lower priority_score is better (exact pincode has -100000)
+            -match['stock_percentage'],            # Higher stock % is better
+            match['distance_km']                   # Lower distance is better
+        )
+
+    def _rank_pharmacies(self, pharmacy_matches: List[Dict], limit: Optional[int] = None) -> List[Dict]:
         """
-        Select the best pharmacy based on location match, stock availability, and distance.
+        Best ``limit`` pharmacies by location match, stock availability and distance.
 
         Priority:
         1. Location match (exact pincode > same city > nearby)
         2. Full stock availability (100%)
         3. Closest distance
+
+        Uses a bounded heap, so only the top ``limit`` entries are ordered.
         """
         if not pharmacy_matches:
             raise ValueError("No pharmacy matches available")
 
-        # Sort by priority_score (which includes location priority), then stock, then distance
-        pharmacy_matches.sort(
-            key=lambda x: (
-                x.get('priority_score', 999999),  # Lower priority_score is better (exact pincode has -100000)
-                -x['stock_percentage'],            # Higher stock % is better
-                x['distance_km']                   # Lower distance is better
-            )
-        )
-
-        best = pharmacy_matches[0]
+        limit = len(pharmacy_matches) if not limit or limit <= 0 else limit
+        ranked = heapq.nsmallest(limit, pharmacy_matches, key=self._ranking_key)
 
+        best = ranked[0]
         self._log(
             "INFO",
             f"Selected {best['name']}: {best['stock_percentage']:.0f}% stock, "
-            f"{best['distance_km']:.1f}km away, match: {best.get('location_match', 'unknown')}"
+            f"{best['distance_km']:.1f}km away, match: {best.get('location_match', 'unknown')} "
+            f"({len(ranked) - 1} alternative(s))"
         )
 
-        return best
+        return ranked
+
+    def _select_best_pharmacy(self, pharmacy_matches: List[Dict]) -> Dict:
+        """Select the single best pharmacy (see ``_rank_pharmacies``)."""
+        return self._rank_pharmacies(pharmacy_matches, 1)[0]
+
+    @staticmethod
+    def _alternative_summary(match: Dict) -> Dict:
+        """Compact description of a ranked fallback pharmacy for the API/UI."""
+        return {
+            "pharmacy_id": match['id'],
+            "pharmacy_name": match['name'],
+            "distance_km": match['distance_km'],
+            "city": match.get('city', ''),
+            "pincode": match.get('pincode', ''),
+            "location_match": match.get('location_match', 'nearby'),
+            "stock_percentage": match['stock_percentage'],
+            "missing_items": match.get('missing_items', []),
+            "services": match.get('services', []),
+        }
 
     def _prepare_pharmacy_response(
         self,
         pharmacy: Dict,
         patient_coords: Tuple[float, float],
         therapy_map: Dict[str, Dict],
-        location_context: Dict
-    ) -> Dict:
-        """Prepare final pharmacy response matching assignment contract."""
+        location_context: Dict,
+        context: RequestContext
+    ) -> Optional[Dict]:
+        """
+        Prepare final pharmacy response matching assignment contract.
+
+        Returns None if no unit could be held at this pharmacy (another
+        request took the remaining stock since the stock check).
+        """
         distance_km = pharmacy['distance_km']
         eta_minutes = self._calculate_eta(distance_km)
         delivery_fee = self._calculate_delivery_fee(distance_km)
 
-        # Prepare items list matching contract format
+        wanted = {
+            item['sku']: min(
+                item['qty_available'],
+                self._estimate_required_quantity(therapy_map.get(item['sku'], {}))
+            )
+            for item in pharmacy['available_items']
+        }
+        reservation = self._reserve_items(pharmacy['id'], wanted, context)
+        if reservation is None:
+            return None
+        held = reservation.status == "held"
+
+        # Prepare items list matching contract format (sku + qty), with pricing details
         reserved_items: List[Dict] = []
         
         for item in pharmacy['available_items']:
             sku = item['sku']
+            reserved_qty = reservation.lines.get(sku, 0)
+            if reserved_qty <= 0:
+                continue
             therapy_details = therapy_map.get(sku, {})
-            recommended_qty = self._estimate_required_quantity(therapy_details)
             qty_available = item['qty_available']
-            reserved_qty = min(qty_available, recommended_qty)
+            unit_price = item['price']
 
-            # Match assignment contract format
             reserved_items.append({
                 "sku": sku,
-                "qty": reserved_qty
+                "qty": reserved_qty,
+                "drug_name": item['drug_name'],
+                "form": item['form'],
+                "strength": item['strength'],
+                "quantity_available": qty_available,
+                "reserved_quantity": reserved_qty,
+                "unit_price": unit_price,
+                "line_total": round(reserved_qty * unit_price, 2),
+                "therapy_reference": {
+                    "dose": therapy_details.get("dose"),
+                    "frequency": therapy_details.get("frequency"),
+                    "duration": therapy_details.get("duration"),
+                    "warnings": therapy_details.get("warnings", []),
+                },
             })
 
-        reservation_id, reservation_expires = self._mock_reserve_items(
-            pharmacy['id'],
-            sum(item["qty"] for item in reserved_items)
-        )
+        reserved_units = sum(item["qty"] for item in reserved_items)
+        subtotal = round(sum(item["line_total"] for item in reserved_items), 2)
+        stock_percentage = pharmacy.get('stock_percentage', 0.0)
 
         # Match exact assignment output format
         return {
@@ -493,18 +1345,33 @@ class PharmacyAgent:
             "items": reserved_items,
             "eta_min": eta_minutes,
             "delivery_fee": delivery_fee,
+            "subtotal": subtotal,
+            "total_price": round(subtotal + delivery_fee, 2),
+            "availability": "in_stock" if stock_percentage >= 100 else "partial",
+            "stock_percentage": stock_percentage,
+            "missing_items": pharmacy.get('missing_items', []),
             "pharmacy_name": pharmacy['name'],
             "pharmacy_address": f"{pharmacy['name']} - {pharmacy['lat']:.4f}, {pharmacy['lon']:.4f}",
             "distance_km": distance_km,
             "city": pharmacy.get('city', location_context.get("city", "")),
             "pincode": pharmacy.get('pincode', location_context.get("pincode", "")),
             "location_match": pharmacy.get('location_match', 'nearby'),
+            "location_context": {
+                "pincode_used": location_context.get("pincode"),
+                "city": location_context.get("city"),
+                "fallback_to_default": bool(
+                    location_context.get("used_default")
+                    or location_context.get("default_coordinates_applied")
+                ),
+                "coordinates": list(patient_coords),
+            },
             "services": pharmacy.get('services', []),
-            "estimated_delivery": (datetime.now() + timedelta(minutes=eta_minutes)).isoformat(),
-            "timestamp": datetime.now().isoformat(),
-            "reservation_id": reservation_id,
-            "reservation_expires_at": reservation_expires.isoformat(),
-            "reserved_units": sum(item["qty"] for item in reserved_items),
+            "estimated_delivery": (context.now() + timedelta(minutes=eta_minutes)).isoformat(),
+            "timestamp": context.timestamp(),
+            # Replay contexts only preview the hold: there is nothing to release or commit
+            "reservation_id": reservation.reservation_id if held else None,
+            "reservation_expires_at": reservation.expires_at_datetime.isoformat() if held else None,
+            "reserved_units": reserved_units,
             "status": "success"
         }
 
@@ -565,22 +1432,57 @@ class PharmacyAgent:
         quantity = daily_doses * duration_days
         return max(1, min(quantity, 14))
 
-    def _mock_reserve_items(self, pharmacy_id: str, total_units: int) -> Tuple[str, datetime]:
-        """Generate a mock reservation for the matched pharmacy."""
-        reservation_id = self._generate_reservation_id(pharmacy_id)
-        expires_at = datetime.now() + timedelta(hours=2)
+    def _reserve_items(
+        self,
+        pharmacy_id: str,
+        quantities: Dict[str, int],
+        context: RequestContext
+    ) -> Optional[Reservation]:
+        """
+        Hold stock for the matched pharmacy in the shared reservation ledger.
+
+        Deterministic contexts are for replay and tests: they get the same
+        grant a hold would (a "preview" reservation) but never take stock,
+        so replays neither deplete inventory nor return IDs the ledger
+        does not know.
+        """
+        if context.deterministic:
+            reservation = self.reservations.preview(pharmacy_id, quantities, now=context.epoch())
+            if reservation is None:
+                self._log("WARNING", f"Could not hold stock at {pharmacy_id}: already promised to other orders")
+            else:
+                self._log("INFO", f"Replay context: {reservation.total_units} unit(s) at {pharmacy_id} not held")
+            return reservation
+
+        reservation = self.reservations.hold(
+            self._generate_reservation_id(context),
+            pharmacy_id,
+            quantities,
+            now=context.epoch()
+        )
+        if reservation is None:
+            self._log("WARNING", f"Could not hold stock at {pharmacy_id}: already promised to other orders")
+            return None
+
+        self.reservations.start_sweeper(PHARMACY_CONFIG["reservation_sweep_interval_s"])
         self._log(
             "INFO",
-            f"Reserved {total_units} unit(s) at {pharmacy_id} under reservation {reservation_id} until {expires_at.strftime('%H:%M')}"
+            f"Reserved {reservation.total_units} unit(s) at {pharmacy_id} under reservation "
+            f"{reservation.reservation_id} until {reservation.expires_at_datetime.strftime('%H:%M')}"
         )
-        return reservation_id, expires_at
+        return reservation
 
-    def _generate_reservation_id(self, pharmacy_id: str) -> str:
-        """Generate a reproducible mock reservation ID."""
-        import random
+    def _generate_reservation_id(self, context: RequestContext) -> str:
+        """
+        Generate a reservation ID from the request's RNG (no global state).
 
-        random.seed(f"{pharmacy_id}{datetime.now().strftime('%Y%m%d%H%M')}")
-        return f"RSV{random.randint(100000, 999999)}"
+        An ID the ledger already tracks is skipped rather than overwriting
+        that hold.
+        """
+        reservation_id = context.hex_id("RSV", 10)
+        while self.reservations.get(reservation_id) is not None:
+            reservation_id = context.hex_id("RSV", 10)
+        return reservation_id
 
     def _generate_delivery_note(self, pharmacy: Dict) -> str:
         """Craft a short delivery note based on pharmacy capabilities."""
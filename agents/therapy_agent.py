@@ -12,10 +12,22 @@ Responsibilities:
 
 import os
 import csv
+import copy
+import numpy as np
 import pandas as pd
 from typing import Dict, List, Optional, Tuple
 from datetime import datetime
-import random
+
+from config import THERAPY_CONFIG
+from utils.allergen_ontology import AllergenIndex, AllergenOntology
+from utils.data_store import DataStore
+from utils.interaction_index import LEVEL_CODES, InteractionIndex, SkuInteractionGraph
+from utils.medicine_index import MedicineIndex, RankedRows, RelevanceScorer
+from utils.request_context import RequestContext
+from utils.ttl_cache import TTLCache, stable_hash
+
+# Reference tables a therapy plan depends on; a change to any clears the plan cache
+THERAPY_TABLES = ("meds", "interactions", "drug_classes", "allergen_ontology")
 
 
 class TherapyAgent:
@@ -28,20 +40,29 @@ class TherapyAgent:
     DISCLAIMER: OTC recommendations only - NO prescriptions.
     """
     
-    def __init__(self, data_dir: str = "./data", log_callback=None):
+    def __init__(self, data_dir: str = "./data", log_callback=None, data_store: Optional[DataStore] = None):
         """
         Initialize Therapy Agent with data sources.
         
         Args:
             data_dir: Path to data folder containing meds.csv and interactions.csv
             log_callback: Function for logging to coordinator
+            data_store: Shared tables; a private store is created if omitted
         """
-        self.data_dir = data_dir
+        self.data_store = data_store or DataStore(data_dir, log_callback)
+        self.data_dir = str(self.data_store.data_dir)
         self.log_callback = log_callback
+        self.max_otc_options = THERAPY_CONFIG["max_otc_options"]
+        self.basket_conflict_level = LEVEL_CODES[THERAPY_CONFIG["basket_conflict_level"]]
         
         # Load data
-        self.meds_df = self._load_medicines()
-        self.interactions_df = self._load_interactions()
+        self._load_data()
+        
+        # Plans are pure functions of the normalized inputs and the data version
+        self.plan_cache = TTLCache(
+            THERAPY_CONFIG["plan_cache_size"],
+            THERAPY_CONFIG["plan_cache_ttl_seconds"],
+        )
         
         # Condition to indication mapping (OTC medicines only)
         self.condition_map = {
@@ -54,10 +75,17 @@ class TherapyAgent:
         
         self._log("INFO", "Therapy Agent initialized successfully")
     
-    def process(self, imaging_output: Dict, patient_data: Dict) -> Dict:
+    def process(
+        self,
+        imaging_output: Dict,
+        patient_data: Dict,
+        context: Optional[RequestContext] = None
+    ) -> Dict:
         """
         Main entry point - receives Imaging Agent output and patient data.
         
+        ``context`` supplies the request's clock (a fresh one if omitted).
+        
         Expected input from Imaging Agent:
         {
             "condition_probs": {"pneumonia": 0.42, "normal": 0.38, ...},
@@ -98,96 +126,223 @@ class TherapyAgent:
         }
         """
         self._log("INFO", "Therapy Agent processing started")
+        context = RequestContext.ensure(context)
         
         try:
             # Validate inputs
             self._validate_inputs(imaging_output, patient_data)
             
-            # Extract key data
+            self._refresh_data()
+            
+            # Extract key data; lists are de-duplicated and sorted so that
+            # equivalent inputs share one cache entry and one result
             condition_probs = imaging_output.get("condition_probs", {})
             severity = imaging_output.get("severity_hint", "mild")
             red_flags = imaging_output.get("red_flags", [])
             patient_age = patient_data.get("age", 18)
-            allergies = patient_data.get("allergies", [])
-            current_meds = patient_data.get("current_medications", [])
+            allergies = self._canonical_list(patient_data.get("allergies", []))
+            current_meds = self._canonical_list(patient_data.get("current_medications", []))
             
             # Determine primary condition
             primary_condition = max(condition_probs.items(), key=lambda x: x[1])[0]
             
-            # Check if prescription needed (not OTC-treatable)
-            needs_prescription = self._requires_prescription(
-                primary_condition, 
-                severity, 
-                red_flags
-            )
-            
-            if needs_prescription:
-                self._log("WARNING", "Case requires prescription - escalating")
-                return self._prescription_required_response(primary_condition, severity)
-            
-            # Get OTC medicine options
-            otc_options = self._get_otc_medicines(
-                primary_condition,
-                patient_age,
-                allergies,
-                severity
-            )
-            
-            # Check for drug interactions
-            interaction_warnings = self._check_interactions(
-                otc_options,
-                current_meds
+            # Probabilities only matter through the medicines they rank first,
+            # so the cache keys on the head window of that ranking (scored once)
+            ranked = self._ranked_candidates(condition_probs)
+            key = self._plan_key(
+                primary_condition, severity, patient_age, allergies, current_meds,
+                ranked.head, self._has_critical_flags(red_flags)
             )
             
-            # Filter out allergy conflicts
-            otc_options, allergy_conflicts = self._filter_allergies(
-                otc_options,
-                allergies
-            )
-            
-            # Check age restrictions
-            otc_options, age_restrictions = self._check_age_restrictions(
-                otc_options,
-                patient_age
-            )
+            cached = self.plan_cache.get(key)
+            if cached is not None:
+                self._log("INFO", f"Therapy plan served from cache ({primary_condition}, {severity})")
+                return context.stamp(copy.deepcopy(cached))
             
-            # Generate safety advice
-            safety_advice = self._generate_safety_advice(
-                primary_condition,
-                severity,
-                otc_options
+            result = self._build_plan(
+                primary_condition, severity, red_flags, patient_age,
+                allergies, current_meds, ranked
             )
-            
-            # Decide if doctor escalation needed
-            escalate = self._should_escalate(
-                red_flags,
-                severity,
-                interaction_warnings,
-                len(otc_options)
-            )
-            
-            result = {
-                "otc_options": otc_options,
-                "interaction_warnings": interaction_warnings,
-                "allergy_conflicts": allergy_conflicts,
-                "age_restrictions": age_restrictions,
-                "requires_prescription": False,
-                "escalate_to_doctor": escalate,
-                "safety_advice": safety_advice,
-                "primary_condition": primary_condition,
-                "severity": severity,
-                "disclaimer": "⚠️ OTC RECOMMENDATIONS ONLY - NOT MEDICAL ADVICE. Consult healthcare professional.",
-                "timestamp": datetime.now().isoformat(),
-                "agent": "TherapyAgent"
-            }
-            
-            self._log("SUCCESS", f"Generated {len(otc_options)} OTC recommendations")
-            
-            return result
+            if ranked.decided_by_head:
+                # A plan that read past the head also depends on the rest of the ranking
+                self.plan_cache.put(key, copy.deepcopy(result))
+            return context.stamp(result)
             
         except Exception as e:
             self._log("ERROR", f"Therapy Agent failed: {str(e)}")
-            return self._error_response(str(e))
+            return context.stamp(self._error_response(str(e)))
+    
+    def _build_plan(
+        self,
+        primary_condition: str,
+        severity: str,
+        red_flags: List[str],
+        patient_age: int,
+        allergies: List[str],
+        current_meds: List[str],
+        ranked: RankedRows
+    ) -> Dict:
+        """Compute the therapy plan for normalized inputs (the uncached path of ``process``)."""
+        # Check if prescription needed (not OTC-treatable)
+        needs_prescription = self._requires_prescription(
+            primary_condition, 
+            severity, 
+            red_flags
+        )
+        
+        if needs_prescription:
+            self._log("WARNING", "Case requires prescription - escalating")
+            return self._prescription_required_response(primary_condition, severity)
+        
+        # Get OTC medicine options
+        otc_options = self._get_otc_medicines(
+            primary_condition,
+            patient_age,
+            allergies,
+            severity,
+            ranked=ranked
+        )
+        
+        # Check for drug interactions
+        interaction_warnings = self._check_interactions(
+            otc_options,
+            current_meds
+        )
+        interaction_warnings += self._check_basket_interactions(otc_options)
+        
+        # Filter out allergy conflicts
+        otc_options, allergy_conflicts = self._filter_allergies(
+            otc_options,
+            allergies
+        )
+        
+        # Check age restrictions
+        otc_options, age_restrictions = self._check_age_restrictions(
+            otc_options,
+            patient_age
+        )
+        
+        # Generate safety advice
+        safety_advice = self._generate_safety_advice(
+            primary_condition,
+            severity,
+            otc_options
+        )
+        
+        # Decide if doctor escalation needed
+        escalate = self._should_escalate(
+            red_flags,
+            severity,
+            interaction_warnings,
+            len(otc_options)
+        )
+        
+        result = {
+            "otc_options": otc_options,
+            "interaction_warnings": interaction_warnings,
+            "allergy_conflicts": allergy_conflicts,
+            "age_restrictions": age_restrictions,
+            "requires_prescription": False,
+            "escalate_to_doctor": escalate,
+            "safety_advice": safety_advice,
+            "primary_condition": primary_condition,
+            "severity": severity,
+            "disclaimer": "⚠️ OTC RECOMMENDATIONS ONLY - NOT MEDICAL ADVICE. Consult healthcare professional.",
+            "timestamp": datetime.now().isoformat(),
+            "agent": "TherapyAgent"
+        }
+        
+        self._log("SUCCESS", f"Generated {len(otc_options)} OTC recommendations")
+        
+        return result
+    
+    @staticmethod
+    def _canonical_list(values) -> List[str]:
+        """Unique, trimmed, non-empty entries in sorted order (case kept for display)."""
+        return sorted({str(value).strip() for value in values or [] if str(value).strip()})
+    
+    def _age_band(self, patient_age) -> int:
+        """
+        Number of catalog ``age_min`` thresholds the patient meets.
+        
+        Ages in the same band pass exactly the same age checks, so the band
+        (not the exact age) is what a plan depends on.
+        """
+        return int(np.searchsorted(self._age_thresholds, float(patient_age), side="right"))
+    
+    def _plan_key(
+        self,
+        primary_condition: str,
+        severity: str,
+        patient_age: int,
+        allergies: List[str],
+        current_meds: List[str],
+        ranking_head: np.ndarray,
+        critical_flags: bool
+    ) -> str:
+        """
+        Canonical hash of everything a therapy plan depends on.
+
+        The condition probabilities enter as ``ranking_head``, the head window
+        of the SKU ranking they produce: inputs that differ in probability but
+        rank the same medicines first share one entry.
+        """
+        return stable_hash({
+            "condition": primary_condition,
+            "severity": severity,
+            "age_band": self._age_band(patient_age),
+            "allergies": allergies,
+            "current_medications": current_meds,
+            "ranking": ranking_head.tolist(),
+            "critical_flags": critical_flags,
+            "data_version": self.data_version,
+        })
+    
+    def plan_cache_stats(self) -> Dict:
+        """Hit/miss counters of the therapy plan cache."""
+        return {
+            "status": "success",
+            **self.plan_cache.stats(),
+            "data_version": self.data_version,
+        }
+    
+    def _load_data(self) -> None:
+        """Load the reference tables and (re)build the indexes derived from them."""
+        self.meds_df = self._load_medicines()
+        self.interactions_df = self._load_interactions()
+        meds_version = self.data_store.table_version("meds")
+        self.medicine_index = self.data_store.derived(
+            "therapy_medicine_index",
+            lambda: MedicineIndex(self.meds_df),
+            version=meds_version,
+        )
+        self.interaction_index, interactions_version = self._build_interaction_index()
+        self.allergen_index = self._build_allergen_index(meds_version)
+        self.interaction_graph = self.data_store.derived(
+            "therapy_interaction_graph",
+            lambda: SkuInteractionGraph(self.interaction_index, self.medicine_index.drug_names),
+            version=(meds_version, interactions_version),
+        )
+        self.option_details = self._build_option_details(meds_version)
+        
+        age_min = self.medicine_index.age_min
+        self._age_thresholds = np.unique(age_min[np.isfinite(age_min)])
+        self.data_version = self._data_version()
+    
+    def _data_version(self) -> Tuple:
+        """Source versions of THERAPY_TABLES (None for a missing optional table)."""
+        return tuple(
+            self.data_store.table_version(name) if self.data_store.has_table(name) else None
+            for name in THERAPY_TABLES
+        )
+    
+    def _refresh_data(self) -> None:
+        """Rebuild the indexes and drop cached plans if a reference table changed on disk."""
+        self.data_store.refresh(*THERAPY_TABLES)
+        if self._data_version() != self.data_version:
+            self._log("INFO", "Reference data changed - rebuilding indexes and clearing plan cache")
+            self._load_data()
+            self.plan_cache.clear()
     
     def _load_medicines(self) -> pd.DataFrame:
         """Load medicines database from CSV."""
@@ -196,7 +351,7 @@ class TherapyAgent:
         if not os.path.exists(meds_path):
             raise FileNotFoundError(f"Medicines database not found: {meds_path}")
         
-        df = pd.read_csv(meds_path)
+        df = self.data_store.table("meds")
         
         # Validate required columns
         required_cols = ['sku', 'drug_name', 'indication', 'age_min', 'contra_allergy_keywords']
@@ -215,10 +370,82 @@ class TherapyAgent:
             self._log("WARNING", "Interactions database not found - skipping interaction checks")
             return pd.DataFrame(columns=['drug_a', 'drug_b', 'level', 'note'])
         
-        df = pd.read_csv(interactions_path)
+        df = self.data_store.table("interactions")
         self._log("INFO", f"Loaded {len(df)} drug interactions")
         return df
     
+    def _build_interaction_index(self) -> Tuple[InteractionIndex, Tuple]:
+        """Pair-keyed interaction index (shared), with drug classes expanded, and its source version."""
+        has_classes = self.data_store.has_table("drug_classes")
+        version = (
+            self.data_store.table_version("interactions") if self.data_store.has_table("interactions") else None,
+            self.data_store.table_version("drug_classes") if has_classes else None,
+        )
+
+        def build() -> InteractionIndex:
+            classes = self.data_store.table("drug_classes") if has_classes else None
+            return InteractionIndex(self.interactions_df, classes)
+
+        index = self.data_store.derived("therapy_interaction_index", build, version=version)
+        self._log("INFO", f"Interaction index: {len(index)} drug pairs from {index.rows} rows")
+        return index, version
+    
+    def _optional_table(self, name: str) -> Optional[pd.DataFrame]:
+        return self.data_store.table(name) if self.data_store.has_table(name) else None
+    
+    def _build_allergen_index(self, meds_version) -> AllergenIndex:
+        """Allergen -> excluded-SKU bitsets from the allergen ontology (shared)."""
+        version = tuple(
+            self.data_store.table_version(name) if self.data_store.has_table(name) else None
+            for name in ("allergen_ontology", "drug_classes")
+        ) + (meds_version,)
+        
+        def build() -> AllergenIndex:
+            ontology = AllergenOntology(
+                self._optional_table("allergen_ontology"),
+                self._optional_table("drug_classes"),
+            )
+            return AllergenIndex(ontology, self.medicine_index)
+        
+        index = self.data_store.derived("therapy_allergen_index", build, version=version)
+        self._log("INFO", f"Allergen ontology: {len(index.ontology.concepts)} concepts")
+        return index
+    
+    def _build_option_details(self, meds_version) -> Dict[str, Dict[str, str]]:
+        """
+        Per-SKU form and strength (meds.csv) and price range (inventory.csv), shared.
+        
+        The price range spans the listed price of the SKU across all
+        pharmacies, so it is indicative rather than a quote.
+        """
+        has_inventory = self.data_store.has_table("inventory")
+        # The pharmacy agent owns the live inventory and drops it from the store;
+        # read it without loading it back into the store's cache
+        version = (meds_version, self.data_store.source_version("inventory") if has_inventory else None)
+        
+        def build() -> Dict[str, Dict[str, str]]:
+            price_ranges = {}
+            if has_inventory:
+                inventory = self.data_store.peek("inventory")
+                prices = inventory.groupby("sku", observed=True)["price"].agg(["min", "max"]).dropna()
+                for sku, low, high in prices.itertuples():
+                    low, high = int(np.floor(low)), int(np.ceil(high))
+                    price_ranges[str(sku)] = f"₹{low}-{high}" if low != high else f"₹{low}"
+            
+            meds = self.meds_df
+            forms = meds["form"] if "form" in meds.columns else pd.Series(index=meds.index, dtype=object)
+            strengths = meds["strength"] if "strength" in meds.columns else pd.Series(index=meds.index, dtype=object)
+            return {
+                str(sku): {
+                    "form": str(form) if pd.notna(form) else "Not specified",
+                    "strength": str(strength) if pd.notna(strength) else "Not specified",
+                    "price_range": price_ranges.get(str(sku), "Price unavailable"),
+                }
+                for sku, form, strength in zip(meds["sku"], forms, strengths)
+            }
+        
+        return self.data_store.derived("therapy_option_details", build, version=version)
+    
     def _validate_inputs(self, imaging_output: Dict, patient_data: Dict) -> None:
         """Validate required inputs."""
         if not imaging_output or not patient_data:
@@ -230,6 +457,11 @@ class TherapyAgent:
         if "age" not in patient_data:
             raise ValueError("Missing patient age")
     
+    @staticmethod
+    def _has_critical_flags(red_flags: List[str]) -> bool:
+        """True if any red flag is CRITICAL or EMERGENCY (the only ones that change the plan)."""
+        return any("CRITICAL" in flag or "EMERGENCY" in flag for flag in red_flags)
+    
     def _requires_prescription(
         self, 
         condition: str, 
@@ -241,8 +473,7 @@ class TherapyAgent:
         MUCH MORE LENIENT - allow OTC for mild/moderate cases.
         """
         # Only CRITICAL red flags require prescription (not all red flags)
-        critical_flags = [f for f in red_flags if "CRITICAL" in f or "EMERGENCY" in f]
-        if critical_flags:
+        if self._has_critical_flags(red_flags):
             return True
         
         # Only SEVERE cases need prescription (not moderate)
@@ -258,15 +489,36 @@ class TherapyAgent:
         
         return False
     
+    def _relevance_scorer(self) -> RelevanceScorer:
+        """Scorer for the current condition map (shared per map and meds version)."""
+        key = tuple((name, tuple(phrases)) for name, phrases in self.condition_map.items())
+        return self.data_store.derived(
+            ("therapy_relevance", key),
+            lambda: RelevanceScorer(self.medicine_index, self.condition_map),
+            version=self.data_store.table_version("meds"),
+        )
+    
+    def _ranked_candidates(self, condition_probs: Dict[str, float]) -> RankedRows:
+        """Catalog ranking for ``condition_probs``, head window selected (one mat-vec)."""
+        scores = self._relevance_scorer().scores(condition_probs)
+        return RankedRows(scores, window=4 * self.max_otc_options)
+    
     def _get_otc_medicines(
         self,
         condition: str,
         patient_age: int,
         allergies: List[str],
-        severity: str
+        severity: str,
+        condition_probs: Optional[Dict[str, float]] = None,
+        ranked: Optional[RankedRows] = None
     ) -> List[Dict]:
         """
         Find OTC medicines suitable for the condition.
+        
+        Medicines are ranked by relevance over the full ``condition_probs``
+        (just ``condition`` if omitted), so an ambiguous result also draws on
+        the runner-up conditions. ``ranked`` passes a ranking already computed
+        by the caller.
         """
         # Get indications for this condition
         indications = self.condition_map.get(condition, [])
@@ -275,44 +527,41 @@ class TherapyAgent:
             self._log("INFO", f"No OTC treatment for {condition}")
             return []
         
-        # Find matching medicines
-        suitable_meds = []
+        # One mat-vec scores every SKU; age and basic allergy checks (detailed
+        # check later) run on the ranked candidates only as far as needed
+        index = self.medicine_index
+        if ranked is None:
+            ranked = self._ranked_candidates(condition_probs or {condition: 1.0})
+        candidates = (
+            row
+            for chunk in ranked
+            for row in index.eligible(chunk, patient_age, allergies, allergens=self.allergen_index)
+        )
+        
+        # Greedy basket: skip a candidate that interacts with one already chosen
+        rows, skipped = self.interaction_graph.select_compatible(
+            candidates, self.max_otc_options, self.basket_conflict_level
+        )
+        for row, chosen in skipped:
+            self._log(
+                "INFO",
+                f"Skipped {index.drug_names[row]}: interacts with recommended {index.drug_names[chosen]}"
+            )
         
-        for _, med in self.meds_df.iterrows():
-            med_indication = str(med['indication']).lower()
-            
-            # Check if any indication matches
-            if any(ind in med_indication for ind in indications):
-                
-                # Check age restriction
-                if patient_age < med['age_min']:
-                    continue
-                
-                # Basic allergy check (detailed check later)
-                contra_keywords = str(med['contra_allergy_keywords']).lower().split(',')
-                contra_keywords = [k.strip() for k in contra_keywords]
-                
-                has_allergy = any(
-                    allergy.lower() in contra_keywords or 
-                    allergy.lower() in str(med['drug_name']).lower()
-                    for allergy in allergies
-                )
-                
-                if has_allergy:
-                    continue
-                
-                # Add to suitable list
-                suitable_meds.append({
-                    "sku": med['sku'],
-                    "drug_name": med['drug_name'],
-                    "indication": med['indication'],
-                    "age_min": int(med['age_min']),
-                    "contraindications": contra_keywords
-                })
+        suitable_meds = [
+            {
+                "sku": index.skus[row],
+                "drug_name": index.drug_names[row],
+                "indication": index.indications[row],
+                "age_min": int(index.age_min[row]),
+                "contraindications": index.contraindications[row]
+            }
+            for row in rows
+        ]
         
         # Enhance with dosage info
         otc_options = []
-        for med in suitable_meds[:5]:  # Limit to top 5 options
+        for med in suitable_meds:
             option = self._format_medicine_option(med, severity)
             otc_options.append(option)
         
@@ -326,6 +575,7 @@ class TherapyAgent:
         
         # Dosage database (simplified - in production, this would be from data)
         dosage_info = self._get_dosage_info(drug_name, severity)
+        details = self.option_details.get(str(med['sku']), {})
         
         return {
             "sku": med['sku'],
@@ -335,8 +585,9 @@ class TherapyAgent:
             "max_daily": dosage_info['max_daily'],
             "duration": dosage_info['duration'],
             "warnings": dosage_info['warnings'],
-            "price_range": f"₹{random.randint(5, 100)}-{random.randint(100, 500)}",
-            "form": random.choice(["Tablet", "Syrup", "Capsule"])
+            "price_range": details.get("price_range", "Price unavailable"),
+            "form": details.get("form", "Not specified"),
+            "strength": details.get("strength", "Not specified")
         }
     
     def _get_dosage_info(self, drug_name: str, severity: str) -> Dict:
@@ -402,7 +653,7 @@ class TherapyAgent:
         """
         Check for drug-drug interactions between OTC and current medications.
         """
-        if not current_meds or self.interactions_df.empty:
+        if not current_meds or not len(self.interaction_index):
             return []
         
         warnings = []
@@ -411,37 +662,57 @@ class TherapyAgent:
             otc_drug = otc['drug_name']
             
             for current_drug in current_meds:
-                # Check both directions (A-B and B-A)
-                interaction = self.interactions_df[
-                    ((self.interactions_df['drug_a'].str.lower() == otc_drug.lower()) & 
-                     (self.interactions_df['drug_b'].str.lower() == current_drug.lower())) |
-                    ((self.interactions_df['drug_a'].str.lower() == current_drug.lower()) & 
-                     (self.interactions_df['drug_b'].str.lower() == otc_drug.lower()))
-                ]
-                
-                if not interaction.empty:
-                    for _, row in interaction.iterrows():
-                        level = row['level']
-                        note = row['note']
-                        
-                        # Format severity emoji
-                        severity_emoji = {
-                            'mild': '⚠️',
-                            'moderate': '⚠️⚠️',
-                            'high': '🚨',
-                            'severe': '🚨🚨'
-                        }.get(level, '⚠️')
-                        
-                        warnings.append({
-                            "drug_a": otc_drug,
-                            "drug_b": current_drug,
-                            "level": level,
-                            "warning": f"{severity_emoji} {level.upper()}: {note}",
-                            "recommendation": self._get_interaction_recommendation(level)
-                        })
+                # Unordered pair lookup covers both directions (A-B and B-A)
+                for interaction in self.interaction_index.lookup(otc_drug, current_drug):
+                    level = interaction.level
+                    note = interaction.note
+                    
+                    warnings.append({
+                        "drug_a": otc_drug,
+                        "drug_b": current_drug,
+                        "level": level,
+                        "warning": f"{self._severity_emoji(level)} {level.upper()}: {note}",
+                        "recommendation": self._get_interaction_recommendation(level)
+                    })
         
         return warnings
     
+    def _check_basket_interactions(self, otc_options: List[Dict]) -> List[Dict]:
+        """
+        Interactions among the recommended OTC medicines themselves.
+
+        One submatrix lookup on the SKU interaction graph finds the pairs;
+        only those pairs go back to the index for their notes.
+        """
+        rows = [self.medicine_index.sku_rows.get(str(otc['sku'])) for otc in otc_options]
+        rows = [row for row in rows if row is not None]
+        warnings = []
+        
+        for row_a, row_b, _ in self.interaction_graph.conflicts(rows):
+            drug_a = self.medicine_index.drug_names[row_a]
+            drug_b = self.medicine_index.drug_names[row_b]
+            for interaction in self.interaction_index.lookup(drug_a, drug_b):
+                level = interaction.level
+                warnings.append({
+                    "drug_a": drug_a,
+                    "drug_b": drug_b,
+                    "level": level,
+                    "warning": f"{self._severity_emoji(level)} {level.upper()} (recommended together): {interaction.note}",
+                    "recommendation": self._get_interaction_recommendation(level)
+                })
+        
+        return warnings
+    
+    @staticmethod
+    def _severity_emoji(level: str) -> str:
+        """Emoji prefix for an interaction level."""
+        return {
+            'mild': '⚠️',
+            'moderate': '⚠️⚠️',
+            'high': '🚨',
+            'severe': '🚨🚨'
+        }.get(level, '⚠️')
+    
     def _get_interaction_recommendation(self, level: str) -> str:
         """Get recommendation based on interaction severity."""
         recommendations = {
@@ -459,6 +730,9 @@ class TherapyAgent:
     ) -> Tuple[List[Dict], List[Dict]]:
         """
         Remove medicines that conflict with patient allergies.
+        
+        Catalog medicines are checked against the allergen bitsets (synonyms
+        and drug classes included); anything else by drug-name substring.
         Returns: (safe_options, conflicted_options)
         """
         if not allergies:
@@ -468,23 +742,20 @@ class TherapyAgent:
         conflicts = []
         
         for option in otc_options:
-            drug_name = option['drug_name'].lower()
-            has_conflict = False
-            
-            for allergy in allergies:
-                allergy_lower = allergy.lower()
-                
-                # Check drug name
-                if allergy_lower in drug_name:
-                    conflicts.append({
-                        "drug": option['drug_name'],
-                        "allergy": allergy,
-                        "reason": f"Patient allergic to {allergy}"
-                    })
-                    has_conflict = True
-                    break
+            row = self.medicine_index.sku_rows.get(str(option.get('sku')))
+            if row is not None:
+                conflict = self.allergen_index.first_conflict(row, allergies)
+            else:
+                drug_name = option['drug_name'].lower()
+                conflict = next((allergy for allergy in allergies if allergy.lower() in drug_name), None)
             
-            if not has_conflict:
+            if conflict is not None:
+                conflicts.append({
+                    "drug": option['drug_name'],
+                    "allergy": conflict,
+                    "reason": f"Patient allergic to {conflict}"
+                })
+            else:
                 safe_options.append(option)
         
         return safe_options, conflicts
@@ -566,8 +837,7 @@ class TherapyAgent:
         MUCH MORE LENIENT - only escalate for true emergencies.
         """
         # Only CRITICAL/EMERGENCY red flags require escalation (not all red flags)
-        critical_flags = [f for f in red_flags if "CRITICAL" in f or "EMERGENCY" in f]
-        if critical_flags:
+        if self._has_critical_flags(red_flags):
             return True
         
         # Only SEVERE cases (not moderate)
@@ -3,14 +3,16 @@ Enhanced Routes for Multi-Agent Healthcare System
 Integrates with Coordinator and all agents
 """
 
-from fastapi import APIRouter, HTTPException, File, UploadFile, Form
+from fastapi import APIRouter, HTTPException, File, UploadFile, Form, Header, Depends
 from fastapi.responses import JSONResponse
 from typing import List, Optional
 from datetime import datetime
+import io
 import uuid
 import json
 import os
 import sys
+import hmac
 from pathlib import Path
 
 # Add project root to path
@@ -26,7 +28,9 @@ from api.schema import (
     XRayAnalysisRequest,
     XRayAnalysisResponse,
     TherapyRecommendationResponse,
-    SimplePatientRequest
+    SimplePatientRequest,
+    InventoryDeltaRequest,
+    InventoryDeltaResponse
 )
 
 # Import agents
@@ -36,11 +40,17 @@ from agents.imaging_agent import ImagingAgent
 from agents.therapy_agent import TherapyAgent
 from agents.pharmacy_agent import PharmacyAgent
 from agents.doctor_agent import DoctorAgent
+from utils.data_store import DataStore
+from config import PHARMACY_CONFIG
 
 router = APIRouter(prefix="/api/v1", tags=["Healthcare"])
 
+# Load reference data once at import time; with gunicorn --preload this runs
+# in the master before workers fork, so the tables are shared copy-on-write
+data_store = DataStore.shared("./data").preload()
+
 # Initialize Coordinator
-coordinator = Coordinator(data_dir="./data", upload_dir="./uploads")
+coordinator = Coordinator(data_dir="./data", upload_dir="./uploads", data_store=data_store)
 
 # In-memory storage for demo (use database in production)
 patients_db = {}
@@ -202,10 +212,9 @@ async def analyze_xray(
         upload_dir = Path("./uploads")
         upload_dir.mkdir(exist_ok=True)
         
-        file_path = upload_dir / f"{uuid.uuid4()}_{file.filename}"
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+        # The X-ray stays in memory; ingestion persists it once
+        xray_upload = io.BytesIO(await file.read())
+        xray_upload.name = file.filename
 
         saved_documents: List[Path] = []
         if documents:
@@ -271,7 +280,7 @@ async def analyze_xray(
             pincode_value = profile_data.get("zip_code") or profile_data.get("pincode")
         
         upload_data = {
-            "xray_file": str(file_path),
+            "xray_file": xray_upload,
             "documents": saved_documents,
             "patient_info": patient_info,
             "symptoms": symptoms if symptoms else summary_text,
@@ -293,11 +302,7 @@ async def analyze_xray(
             "created_at": datetime.now().isoformat()
         }
         
-        # Clean up uploaded file
-        try:
-            os.remove(file_path)
-        except:
-            pass
+        # Clean up uploaded documents
         for doc_path in saved_documents:
             try:
                 os.remove(doc_path)
@@ -402,6 +407,53 @@ async def get_all_patients():
         "patients": list(patients_db.values())
     }
 
+def require_inventory_admin(x_admin_token: Optional[str] = Header(None)):
+    """Reject inventory mutations unless the configured admin token is presented"""
+    expected = PHARMACY_CONFIG.get("inventory_admin_token")
+    if not expected:
+        raise HTTPException(status_code=403, detail="Inventory mutations are disabled (INVENTORY_ADMIN_TOKEN not set)")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, expected):
+        raise HTTPException(status_code=401, detail="Invalid or missing X-Admin-Token")
+
+# Plain def: FastAPI runs these in its threadpool, so CSV parsing, the atomic
+# rewrite and the snapshot rebuild under row_lock never block the event loop
+@router.post("/inventory/deltas", response_model=InventoryDeltaResponse,
+             dependencies=[Depends(require_inventory_admin)])
+def apply_inventory_deltas(payload: InventoryDeltaRequest):
+    """Apply stock/price changes to the live pharmacy inventory without a reload"""
+    result = coordinator.pharmacy_agent.apply_inventory_deltas(
+        [delta.dict() for delta in payload.deltas],
+        source="api"
+    )
+    if result["status"] == "error":
+        raise HTTPException(status_code=422, detail=result["errors"])
+    return result
+
+@router.post("/inventory/compact", dependencies=[Depends(require_inventory_admin)])
+def compact_inventory():
+    """Write the in-memory inventory back to data/inventory.csv"""
+    return coordinator.pharmacy_agent.compact_inventory()
+
+@router.get("/diagnostics/memory")
+async def memory_diagnostics():
+    """Memory used by the pharmacy tables before/after dictionary encoding"""
+    return coordinator.pharmacy_agent.memory_diagnostics()
+
+@router.get("/diagnostics/therapy-cache")
+async def therapy_cache_diagnostics():
+    """Hit/miss counters of the memoized therapy plans"""
+    return coordinator.therapy_agent.plan_cache_stats()
+
+@router.get("/diagnostics/imaging-cache")
+async def imaging_cache_diagnostics():
+    """Hit/miss counters of the content-addressed imaging results"""
+    return coordinator.imaging_agent.result_cache_stats()
+
+@router.get("/diagnostics/imaging-classifier")
+async def imaging_classifier_diagnostics():
+    """Batch sizes and latency of the X-ray model backend"""
+    return coordinator.imaging_agent.classifier_stats()
+
 @router.post("/upload/documents")
 async def upload_documents(
     files: List[UploadFile] = File(...),
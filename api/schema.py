@@ -143,4 +143,24 @@ class TherapyRecommendationResponse(BaseModel):
     """Response model for therapy recommendations"""
     success: bool
     recommendations: dict
-    pharmacy_matches: Optional[List[dict]] = None
\ No newline at end of file
+    pharmacy_matches: Optional[List[dict]] = None
+
+class InventoryDeltaItem(BaseModel):
+    """One inventory change: absolute qty or qty_delta, optionally a new price"""
+    pharmacy_id: str
+    sku: str
+    qty: Optional[int] = None
+    qty_delta: Optional[int] = None
+    price: Optional[float] = None
+
+class InventoryDeltaRequest(BaseModel):
+    """Batch of inventory deltas applied in place"""
+    deltas: List[InventoryDeltaItem]
+
+class InventoryDeltaResponse(BaseModel):
+    status: str  # success, partial, error
+    version: int
+    applied: int
+    rejected: int
+    errors: List[str] = []
+    timestamp: datetime
@@ -12,6 +12,8 @@ import pandas as pd
 import requests
 import streamlit as st
 
+from utils.geo_utils import load_pincode_directory
+
 # API Configuration
 # Priority: Streamlit secrets > Environment variable > Default production URL
 try:
@@ -40,13 +42,11 @@ def get_demo_xray_path() -> Path:
 @st.cache_data(show_spinner=False)
 def load_zip_data() -> pd.DataFrame:
     """Load sample zipcode coverage from the data folder - Only Mumbai region with pharmacy coverage."""
-    path = Path("data/zipcodes.csv")
-    df = pd.read_csv(path)
+    df = load_pincode_directory(Path("data/zipcodes.csv")).to_frame()
     
     # Filter out Ahmedabad - we only have pharmacies in Mumbai metropolitan region
     df = df[df["city"] != "Ahmedabad"].copy()
     
-    df["pincode"] = df["pincode"].astype(str)
     df["label"] = df["city"] + " – " + df["pincode"]
     return df.sort_values(["city", "pincode"]).reset_index(drop=True)
 
@@ -775,7 +775,17 @@ def display_analysis_results(result):
                 )
             if pharmacy.get('delivery_note'):
                 st.info(pharmacy['delivery_note'])
-        
+
+            alternatives = pharmacy.get('alternatives') or []
+            if alternatives:
+                with st.expander(f"🏪 Other nearby pharmacies ({len(alternatives)})"):
+                    for rank, alt in enumerate(alternatives, start=2):
+                        st.write(
+                            f"{rank}. **{alt.get('pharmacy_name', 'N/A')}** – "
+                            f"{alt.get('distance_km', 0):.1f} km, {alt.get('city', 'N/A')} "
+                            f"({alt.get('stock_percentage', 0):.0f}% in stock)"
+                        )
+
         # Order summary
         if result.get('order'):
             st.markdown("---")
@@ -0,0 +1,101 @@
+"""
+Benchmark XrayClassifier throughput against the micro-batch size.
+
+Usage:
+    python benchmark_classifier.py [model.npz|model.onnx]
+
+Without a model, a random dense network (input 64x64 -> 512 -> 128 -> 5) is
+written to a temporary .npz. CLIENTS threads each classify IMAGES_PER_CLIENT
+images of 1024x1024 through one classifier per max_batch setting. The
+report shows, for each setting:
+
+- end-to-end throughput (preprocessing on the client threads included);
+- the mean batch actually formed;
+- p50/p95 forward latency per batch and p95 queue wait.
+
+A second table times the backend's forward pass alone at each batch size,
+which is the ceiling batching can reach once preprocessing is spread over
+more cores.
+"""
+
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from models.xray_classifier import DEFAULT_CLASSES, DEFAULT_INPUT_SIZE, XrayClassifier, load_backend, save_numpy_model
+
+BATCH_SIZES = [1, 2, 4, 8, 16, 32]
+CLIENTS = 32
+IMAGES_PER_CLIENT = 16
+MAX_WAIT_MS = 2
+
+
+def random_model(directory: Path) -> Path:
+    rng = np.random.default_rng(0)
+    sizes = [DEFAULT_INPUT_SIZE * DEFAULT_INPUT_SIZE, 512, 128, len(DEFAULT_CLASSES)]
+    layers = [
+        (rng.normal(0, 1 / np.sqrt(n_in), (n_in, n_out)), np.zeros(n_out))
+        for n_in, n_out in zip(sizes, sizes[1:])
+    ]
+    return save_numpy_model(directory / "random_mlp.npz", layers)
+
+
+def run(classifier: XrayClassifier, images) -> float:
+    """Images per second with CLIENTS threads calling ``predict`` concurrently."""
+    def client(offset: int) -> None:
+        for index in range(IMAGES_PER_CLIENT):
+            classifier.predict(images[(offset + index) % len(images)])
+
+    threads = [threading.Thread(target=client, args=(offset,)) for offset in range(CLIENTS)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return CLIENTS * IMAGES_PER_CLIENT / (time.perf_counter() - started)
+
+
+def forward_only(backend, batch_size: int, rounds: int = 50) -> float:
+    """Images per second of back-to-back forward passes at ``batch_size``."""
+    batch = np.zeros((batch_size, backend.input_size, backend.input_size), dtype=np.float32)
+    backend.predict(batch)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        backend.predict(batch)
+    return batch_size * rounds / (time.perf_counter() - started)
+
+
+def main() -> None:
+    rng = np.random.default_rng(1)
+    images = [rng.integers(0, 256, (1024, 1024), dtype=np.uint8) for _ in range(8)]
+
+    with tempfile.TemporaryDirectory() as scratch:
+        model = Path(sys.argv[1]) if len(sys.argv) > 1 else random_model(Path(scratch))
+        print(f"Model: {model.name}   clients: {CLIENTS} x {IMAGES_PER_CLIENT} images   max_wait: {MAX_WAIT_MS} ms")
+        print(f"{'max_batch':>9} {'img/s':>9} {'mean batch':>11} {'p50 ms':>8} {'p95 ms':>8} {'wait p95':>9}")
+        for max_batch in BATCH_SIZES:
+            classifier = XrayClassifier(load_backend(model), max_batch=max_batch, max_wait_ms=MAX_WAIT_MS)
+            try:
+                throughput = run(classifier, images)
+                stats = classifier.stats()
+            finally:
+                classifier.close()
+            latency, wait = stats["batch_latency_ms"], stats["queue_wait_ms"]
+            print(
+                f"{max_batch:>9} {throughput:>9.0f} {stats['mean_batch_size']:>11.2f} "
+                f"{latency['p50']:>8.2f} {latency['p95']:>8.2f} {wait['p95']:>9.2f}"
+            )
+
+        backend = load_backend(model)
+        print(f"\nForward pass only ({backend.name})")
+        print(f"{'batch':>9} {'img/s':>9}")
+        for batch_size in BATCH_SIZES:
+            print(f"{batch_size:>9} {forward_only(backend, batch_size):>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
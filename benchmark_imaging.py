@@ -0,0 +1,114 @@
+"""
+Benchmark ImagingAgent feature extraction: full-resolution vs bounded decode.
+
+Usage:
+    python benchmark_imaging.py [side ...]
+
+Synthesizes chest-film-like grayscale images (smooth anatomy, dark lung
+fields, sensor noise) at each side length (default 2048 and 3000), encoded
+as PNG and JPEG, and reports per format:
+
+- median latency of ``_extract_image_features`` (decode included);
+- peak RSS above the baseline, measured in a fresh process (Linux);
+- the absolute difference of every feature against full resolution.
+
+The bounded path uses IMAGING_CONFIG["image_resize_threshold"].
+"""
+
+import io
+import multiprocessing
+import statistics
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+from agents.imaging_agent import ImagingAgent
+from config import IMAGING_CONFIG
+from utils.image_artifact import ImageArtifact
+
+RUNS = 5
+
+
+def synthetic_film(side: int, seed: int = 0) -> np.ndarray:
+    """Bright mediastinum and ribs, two dark lung fields, Gaussian noise."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:side, 0:side] / side
+    film = 150 + 60 * np.exp(-((x - 0.5) ** 2) / 0.01)
+    for centre in (0.3, 0.7):
+        film -= 80 * np.exp(-(((x - centre) / 0.14) ** 2 + ((y - 0.5) / 0.3) ** 2))
+    film += 12 * np.sin(y * side / 40) * (np.abs(x - 0.5) > 0.1)
+    film += rng.normal(0, 10, film.shape)
+    return np.clip(film, 0, 255).astype(np.uint8)
+
+
+def encode(pixels: np.ndarray, fmt: str) -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format=fmt, **({"quality": 90} if fmt == "JPEG" else {}))
+    return buffer.getvalue()
+
+
+def extract(blob: bytes, max_side: int):
+    agent = ImagingAgent(log_callback=lambda *args: None)
+    agent.max_side = max_side
+    # Hashes precomputed: only decode + statistics are timed
+    artifact = ImageArtifact(blob, name="film", sha256="", sha1="0")
+    return agent._extract_image_features(artifact)
+
+
+def _status_kib(field: str) -> int:
+    with open("/proc/self/status") as status:
+        return next(int(line.split()[1]) for line in status if line.startswith(field + ":"))
+
+
+def _peak_worker(blob: bytes, max_side: int, queue) -> None:
+    # Reset the RSS high-water mark left by the imports (Linux only)
+    with open("/proc/self/clear_refs", "w") as clear_refs:
+        clear_refs.write("5")
+    before = _status_kib("VmRSS")
+    extract(blob, max_side)
+    queue.put((_status_kib("VmHWM") - before) / 1024)
+
+
+def peak_mib(blob: bytes, max_side: int) -> float:
+    """Peak RSS growth of one extraction, in a freshly spawned interpreter."""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    worker = context.Process(target=_peak_worker, args=(blob, max_side, queue))
+    worker.start()
+    result = queue.get()
+    worker.join()
+    return result
+
+
+def median_ms(blob: bytes, max_side: int) -> float:
+    timings = []
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        extract(blob, max_side)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main() -> None:
+    sides = [int(arg) for arg in sys.argv[1:]] or [2048, 3000]
+    bound = IMAGING_CONFIG["image_resize_threshold"]
+    print(f"Working resolution bound: {bound} px")
+
+    for side in sides:
+        pixels = synthetic_film(side)
+        for fmt in ("PNG", "JPEG"):
+            blob = encode(pixels, fmt)
+            full, reduced = extract(blob, 0), extract(blob, bound)
+            print(f"\n{side}x{side} {fmt} ({len(blob) / 2 ** 20:.1f} MiB encoded)")
+            print(f"  latency   full {median_ms(blob, 0):8.1f} ms   bounded {median_ms(blob, bound):8.1f} ms")
+            print(f"  peak RSS  full {peak_mib(blob, 0):8.1f} MiB  bounded {peak_mib(blob, bound):8.1f} MiB")
+            for name, value in full.items():
+                if name == "histogram":
+                    continue
+                print(f"  {name:<12} full {value:9.4f}   bounded {reduced[name]:9.4f}   |diff| {abs(value - reduced[name]):.4f}")
+
+
+if __name__ == "__main__":
+    main()
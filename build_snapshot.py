@@ -0,0 +1,30 @@
+"""
+Compile data/ into the binary columnar snapshot loaded by the agents.
+
+Usage:
+    python build_snapshot.py [data_dir]
+
+Run after changing any file in data/ (the deploy build runs it too). Agents
+fall back to the CSV/JSON sources for any table whose source is newer than
+the snapshot, so a missed rebuild costs startup time, not correctness.
+"""
+
+import sys
+import time
+
+from utils.snapshot import build_snapshot, snapshot_dir
+
+
+def main() -> None:
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else "./data"
+    started = time.perf_counter()
+    manifest = build_snapshot(data_dir)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    print(f"Snapshot written to {snapshot_dir(data_dir)} in {elapsed_ms:.0f} ms")
+    for table, entry in manifest["tables"].items():
+        print(f"  {table:<13} {entry['rows']:>6} rows  {len(entry['columns'])} columns  <- {entry['source']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -67,19 +67,19 @@ print("DISTANCE CALCULATION CHECK")
 print("=" * 80)
 
 # Get coordinates for Bhiwandi 421302
-from utils.geo_utils import get_coordinates_for_pincode
+from utils.geo_utils import load_pincode_directory
 
-zip_df = pd.read_csv("data/zipcodes.csv")
-bhiwandi_coords = zip_df[(zip_df['city'] == 'Bhiwandi') & (zip_df['pincode'] == '421302')]
-navi_mumbai_coords = zip_df[(zip_df['city'] == 'Navi Mumbai') & (zip_df['pincode'] == '400715')]
+pincodes = load_pincode_directory("data/zipcodes.csv")
+bhiwandi_record = pincodes.get('421302')
+navi_mumbai_record = pincodes.get('400715')
 
-if not bhiwandi_coords.empty:
-    print(f"\nBhiwandi 421302 coordinates: Lat {bhiwandi_coords.iloc[0]['lat']}, Lon {bhiwandi_coords.iloc[0]['lon']}")
+if bhiwandi_record and bhiwandi_record.city == 'Bhiwandi':
+    print(f"\nBhiwandi 421302 coordinates: Lat {bhiwandi_record.lat}, Lon {bhiwandi_record.lon}")
 else:
     print("\nBhiwandi 421302 NOT found in zipcodes.csv")
 
-if not navi_mumbai_coords.empty:
-    print(f"Navi Mumbai 400715 coordinates: Lat {navi_mumbai_coords.iloc[0]['lat']}, Lon {navi_mumbai_coords.iloc[0]['lon']}")
+if navi_mumbai_record and navi_mumbai_record.city == 'Navi Mumbai':
+    print(f"Navi Mumbai 400715 coordinates: Lat {navi_mumbai_record.lat}, Lon {navi_mumbai_record.lon}")
 else:
     print("Navi Mumbai 400715 NOT found in zipcodes.csv")
 
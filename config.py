@@ -51,13 +51,25 @@ IMAGING_CONFIG = {
     "confidence_threshold": 0.6,  # Below this triggers doctor escalation
     "supported_formats": [".png", ".jpg", ".jpeg"],
     "max_image_size_mb": 10,
-    "image_resize_threshold": 1024,  # Resize if larger than this
+    "image_resize_threshold": 1024,  # Features use a working resolution of at most this many px per side (0 = full)
+    "result_cache_size": 256,  # Imaging results memoized by image content + metadata (0 disables the cache)
+    "result_cache_dir": None,  # e.g. str(BASE_DIR / "cache" / "imaging") to persist results across restarts
+    "result_cache_disk_entries": 4096,
+    "classifier_model": str(MODELS_DIR / "xray_classifier.onnx"),  # .onnx or .npz; heuristics are used when absent
+    "classifier_max_batch": 8,  # Concurrent requests share one forward pass of up to this many images
+    "classifier_max_wait_ms": 5,  # ...collected for at most this long
+    "classifier_threads": 0,  # Intra-op threads of the backend (0 = library default)
+    "classifier_warmup_batches": 2,
+    "classifier_timeout_s": 2.0,  # Longest wait for a model result before falling back to the heuristics
     "default_severity": "mild"
 }
 
 # Therapy Agent
 THERAPY_CONFIG = {
     "max_otc_options": 5,  # Maximum OTC medicines to recommend
+    "basket_conflict_level": "moderate",  # Recommended OTCs never interact at this level or above
+    "plan_cache_size": 1024,  # Memoized therapy plans (0 disables the cache)
+    "plan_cache_ttl_seconds": 600,
     "min_patient_age": 0,
     "interaction_check_enabled": True,
     "allergy_check_enabled": True,
@@ -68,9 +80,19 @@ THERAPY_CONFIG = {
 PHARMACY_CONFIG = {
     "max_search_radius_km": 25,  # Maximum delivery distance
     "max_results": 10,  # Maximum pharmacies to return
+    "grid_cell_deg": 0.05,  # Spatial index cell size (~5.5 km of latitude)
+    "initial_search_radius_km": 5,  # First ring of the expanding search
+    "min_candidates": 10,  # Stop growing the search ring once this many are in range
     "default_delivery_time_minutes": 45,
     "speed_kmph": 30,  # Assumed delivery speed for ETA calculation
-    "base_delivery_fee": 25  # Base delivery charge in rupees
+    "base_delivery_fee": 25,  # Base delivery charge in rupees
+    "reservation_ttl_minutes": 120,  # Holds expire after this window
+    "reservation_lock_stripes": 64,  # Striped per-pharmacy locks in the reservation ledger
+    "reservation_sweep_interval_s": 60,  # Background expiry sweep period
+    "inventory_poll_interval_s": 5,  # How often requests check data/inventory_deltas/ for drops
+    "inventory_compact_every": 500,  # Compact to inventory.csv after this many applied deltas...
+    "inventory_compact_interval_s": 300,  # ...or this long since the last compaction
+    "inventory_admin_token": os.environ.get("INVENTORY_ADMIN_TOKEN")  # Required in X-Admin-Token for inventory mutations; unset disables them
 }
 
 # Doctor Agent
@@ -170,6 +192,8 @@ LOGGING_CONFIG = {
 SYSTEM_CONFIG = {
     "max_processing_time_seconds": 30,
     "enable_caching": False,
+    "deterministic_mode": False,  # Replay/tests only: fixed seed, frozen clock, stock holds previewed not taken
+    "deterministic_seed": 0,
     "timeout_seconds": 60,
     "max_retries": 3
 }
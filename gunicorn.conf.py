@@ -0,0 +1,26 @@
+"""
+Gunicorn settings for the API.
+Location: gunicorn.conf.py
+
+``preload_app`` imports the app in the master process, which loads the
+shared DataStore (see api/routes_integrated.py) once before workers fork.
+Workers then share the tables copy-on-write instead of each parsing data/.
+
+One worker by default. Reservations (ReservationLedger) and applied
+inventory deltas live in the worker's memory, so with several workers
+each would promise the same stock independently, a posted delta would
+reach only one of them, and /inventory/compact would write one worker's
+view over the others'. Raise API_WORKERS only once that state is shared
+across processes. WEB_CONCURRENCY, which hosts set from the instance
+size, is deliberately not read.
+
+Run with: gunicorn api.main:app -c gunicorn.conf.py
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("API_WORKERS", "1"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
@@ -0,0 +1,456 @@
+"""
+Batched CPU inference for chest X-ray classification.
+Location: models/xray_classifier.py
+
+A backend turns a batch of preprocessed images into class probabilities:
+
+- ``NumpyBackend``: a dense ReLU network stored as ``.npz`` (pure NumPy,
+  always available; see ``save_numpy_model``);
+- ``OnnxBackend``: any ``.onnx`` model run by onnxruntime on CPU, when the
+  optional dependency is installed.
+
+``XrayClassifier`` puts one backend behind a request queue. Callers submit
+single images from their own threads; a worker thread collects requests
+for up to ``max_wait_ms`` or ``max_batch`` items, whichever comes first,
+and runs one batched forward pass. Preprocessing (resize, normalize)
+happens on the caller's thread, so only the forward pass is serialized.
+The backend is warmed up before the first request, and per-batch sizes,
+latencies and queue waits are kept for ``stats()``. A ``predict`` that
+times out cancels its request, so the worker never spends a forward pass
+on an image nobody is waiting for.
+
+The worker thread is started on the first ``submit`` of each process, not
+at construction: threads do not survive ``fork()``, so a classifier built
+in a pre-forking server's master (gunicorn ``preload_app``) gets a fresh
+queue and worker in every worker process.
+
+``load_classifier`` returns None when the model file does not exist, so
+callers can fall back to their heuristics.
+"""
+
+import abc
+import hashlib
+import os
+import queue
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+from PIL import Image
+
+try:  # Optional dependency – only needed for .onnx models
+    import onnxruntime  # type: ignore
+except Exception:  # pragma: no cover - optional dependency
+    onnxruntime = None
+
+try:  # Optional dependency – caps BLAS threads of the NumPy backend
+    from threadpoolctl import threadpool_limits  # type: ignore
+except Exception:  # pragma: no cover - optional dependency
+    threadpool_limits = None
+
+DEFAULT_CLASSES = ("normal", "pneumonia", "covid_suspect", "bronchitis", "tb_suspect")
+DEFAULT_INPUT_SIZE = 64
+# Batches kept for the latency percentiles
+METRICS_WINDOW = 1024
+
+_STOP = object()
+
+# Live classifiers, reset in forked children (see XrayClassifier._reset_after_fork)
+_INSTANCES: "weakref.WeakSet" = weakref.WeakSet()
+
+
+def _reset_instances_after_fork() -> None:
+    for classifier in list(_INSTANCES):
+        classifier._reset_after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_instances_after_fork)
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    shifted = logits - logits.max(axis=1, keepdims=True)
+    np.exp(shifted, out=shifted)
+    return shifted / shifted.sum(axis=1, keepdims=True)
+
+
+def _file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ClassifierBackend(abc.ABC):
+    """Forward pass over a batch of preprocessed images. Subclasses implement ``predict``."""
+
+    name = "base"
+
+    def __init__(self, classes: Sequence[str], input_size: int, mean: float = 0.5, std: float = 0.25):
+        self.classes = [str(name) for name in classes]
+        self.input_size = int(input_size)
+        self.mean = float(mean)
+        self.std = float(std)
+        self.threads = 0
+
+    def preprocess(self, pixels: np.ndarray) -> np.ndarray:
+        """Square float32 input for one grayscale image (uint8 or float in [0, 255])."""
+        image = Image.fromarray(np.asarray(pixels, dtype=np.uint8))
+        if image.size != (self.input_size, self.input_size):
+            image = image.resize((self.input_size, self.input_size), Image.BILINEAR)
+        array = np.asarray(image, dtype=np.float32) / 255.0
+        return (array - self.mean) / self.std
+
+    @abc.abstractmethod
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            batch: (B, input_size, input_size) float32 array from ``preprocess``
+
+        Returns:
+            (B, len(classes)) probabilities
+        """
+        raise NotImplementedError
+
+    def set_threads(self, threads: int) -> bool:
+        """Limit the intra-op threads; returns whether the limit can be applied."""
+        self.threads = int(threads)
+        return False
+
+
+class NumpyBackend(ClassifierBackend):
+    """Dense ReLU network: ``w0, b0, w1, b1, ...`` in an ``.npz``, softmax output."""
+
+    name = "numpy"
+
+    def __init__(self, path: Union[str, Path]):
+        with np.load(path, allow_pickle=False) as archive:
+            layers = []
+            while f"w{len(layers)}" in archive:
+                index = len(layers)
+                layers.append((
+                    np.ascontiguousarray(archive[f"w{index}"], dtype=np.float32),
+                    np.asarray(archive[f"b{index}"], dtype=np.float32),
+                ))
+            classes = archive["classes"].tolist() if "classes" in archive else DEFAULT_CLASSES
+            input_size = int(archive["input_size"]) if "input_size" in archive else DEFAULT_INPUT_SIZE
+            mean = float(archive["mean"]) if "mean" in archive else 0.5
+            std = float(archive["std"]) if "std" in archive else 0.25
+        if not layers:
+            raise ValueError(f"No layers (w0, b0, ...) in {path}")
+        if layers[0][0].shape[0] != input_size * input_size or layers[-1][0].shape[1] != len(classes):
+            raise ValueError(f"Layer shapes in {path} do not match input_size/classes")
+        super().__init__(classes, input_size, mean, std)
+        self.layers = layers
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        activations = batch.reshape(len(batch), -1)
+        if self.threads and threadpool_limits is not None:
+            with threadpool_limits(limits=self.threads):
+                return self._forward(activations)
+        return self._forward(activations)
+
+    def _forward(self, activations: np.ndarray) -> np.ndarray:
+        last = len(self.layers) - 1
+        for index, (weights, bias) in enumerate(self.layers):
+            activations = activations @ weights
+            activations += bias
+            if index < last:
+                np.maximum(activations, 0, out=activations)
+        return _softmax(activations)
+
+    def set_threads(self, threads: int) -> bool:
+        super().set_threads(threads)
+        return threadpool_limits is not None
+
+
+class OnnxBackend(ClassifierBackend):
+    """onnxruntime CPU session; input (B, 1, S, S), output logits (B, classes)."""
+
+    name = "onnxruntime"
+
+    def __init__(self, path: Union[str, Path], threads: int = 0):
+        if onnxruntime is None:
+            raise ImportError("onnxruntime is required for .onnx models")
+        self.path = str(path)
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = int(threads)
+            options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(self.path, options, providers=["CPUExecutionProvider"])
+        meta = self.session.get_modelmeta().custom_metadata_map
+        classes = meta["classes"].split(",") if meta.get("classes") else DEFAULT_CLASSES
+        input_spec = self.session.get_inputs()[0]
+        size = input_spec.shape[-1]
+        input_size = int(meta.get("input_size") or (size if isinstance(size, int) else DEFAULT_INPUT_SIZE))
+        super().__init__(classes, input_size, float(meta.get("mean", 0.5)), float(meta.get("std", 0.25)))
+        self.input_name = input_spec.name
+        self.threads = int(threads)
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        logits = self.session.run(None, {self.input_name: batch[:, None, :, :]})[0]
+        return _softmax(np.asarray(logits, dtype=np.float32))
+
+    def set_threads(self, threads: int) -> bool:
+        # intra_op_num_threads is fixed when the session is created
+        return int(threads) == self.threads
+
+
+def load_backend(path: Union[str, Path], threads: int = 0) -> ClassifierBackend:
+    """Backend for ``path`` by extension (``.onnx`` or ``.npz``)."""
+    path = Path(path)
+    if path.suffix.lower() == ".onnx":
+        return OnnxBackend(path, threads)
+    if path.suffix.lower() == ".npz":
+        backend = NumpyBackend(path)
+        backend.set_threads(threads)
+        return backend
+    raise ValueError(f"Unsupported model format: {path.suffix}")
+
+
+def save_numpy_model(
+    path: Union[str, Path],
+    layers: Sequence[tuple],
+    classes: Sequence[str] = DEFAULT_CLASSES,
+    input_size: int = DEFAULT_INPUT_SIZE,
+    mean: float = 0.5,
+    std: float = 0.25,
+) -> Path:
+    """Write (weights, bias) pairs in the format read by ``NumpyBackend``."""
+    arrays = {"classes": np.array(list(classes)), "input_size": input_size, "mean": mean, "std": std}
+    for index, (weights, bias) in enumerate(layers):
+        arrays[f"w{index}"] = np.asarray(weights, dtype=np.float32)
+        arrays[f"b{index}"] = np.asarray(bias, dtype=np.float32)
+    path = Path(path)
+    with open(path, "wb") as handle:
+        np.savez(handle, **arrays)
+    return path
+
+
+class _Pending:
+    __slots__ = ("inputs", "future", "enqueued_at")
+
+    def __init__(self, inputs: np.ndarray):
+        self.inputs = inputs
+        self.future: Future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class XrayClassifier:
+    """Micro-batching front end for one backend (thread-safe)."""
+
+    def __init__(
+        self,
+        backend: ClassifierBackend,
+        max_batch: int = 8,
+        max_wait_ms: float = 5.0,
+        warmup_batches: int = 2,
+        fingerprint: str = "",
+    ):
+        """
+        Args:
+            backend: Model to run
+            max_batch: Largest batch per forward pass
+            max_wait_ms: How long the first request of a batch waits for company
+            warmup_batches: Forward passes run (at batch 1 and max_batch) before serving
+            fingerprint: Identity of the model weights (e.g. file digest)
+        """
+        self.backend = backend
+        self.classes = backend.classes
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+        self.fingerprint = fingerprint
+        self._queue: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._batches: deque = deque(maxlen=METRICS_WINDOW)
+        self._waits: deque = deque(maxlen=METRICS_WINDOW)
+        self.batch_count = 0
+        self.item_count = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.warmup_ms = self._warm_up(warmup_batches)
+        self._closed = False
+        self._worker: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        _INSTANCES.add(self)
+
+    def _warm_up(self, rounds: int) -> float:
+        started = time.perf_counter()
+        size = self.backend.input_size
+        for batch in sorted({1, self.max_batch}):
+            for _ in range(max(0, int(rounds))):
+                self.backend.predict(np.zeros((batch, size, size), dtype=np.float32))
+        return round((time.perf_counter() - started) * 1000, 3)
+
+    def _reset_after_fork(self) -> None:
+        # The parent's worker thread does not exist here and its locks/queue may be mid-use
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._worker = None
+
+    def _ensure_worker(self) -> None:
+        """Start the worker thread of this process (first call, or after it died)."""
+        if self._closed:
+            raise RuntimeError("XrayClassifier is closed")
+        worker = self._worker
+        if worker is not None and worker.is_alive():
+            return
+        with self._start_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._serve, name="xray-classifier", daemon=True)
+                self._worker.start()
+
+    # ------------------------------------------------------------------
+    # Client side
+    # ------------------------------------------------------------------
+    def submit(self, pixels: np.ndarray) -> Future:
+        """Queue one grayscale image; the future resolves to {class: probability}."""
+        self._ensure_worker()
+        pending = _Pending(self.backend.preprocess(pixels))
+        self._queue.put(pending)
+        return pending.future
+
+    def predict(self, pixels: np.ndarray, timeout: Optional[float] = None) -> Dict[str, float]:
+        """
+        Class probabilities of one image (batched with concurrent callers).
+
+        Raises:
+            concurrent.futures.TimeoutError: No result within ``timeout``
+                seconds (the request is cancelled if not yet running)
+        """
+        future = self.submit(pixels)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            with self._lock:
+                self.timeouts += 1
+            raise
+
+    def predict_many(self, images: Sequence[np.ndarray], timeout: Optional[float] = None) -> List[Dict[str, float]]:
+        """Submit all images at once, then wait for every result (input order)."""
+        futures = [self.submit(pixels) for pixels in images]
+        return [future.result(timeout) for future in futures]
+
+    def close(self) -> None:
+        """Finish queued requests and stop the worker."""
+        self._closed = True
+        worker = self._worker
+        if worker is not None and worker.is_alive():
+            self._queue.put(_STOP)
+            worker.join()
+
+    # ------------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------------
+    def _serve(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch = [first]
+            stopping = False
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._run_batch(batch)
+            if stopping:
+                return
+
+    def _run_batch(self, batch: List[_Pending]) -> None:
+        # Drop requests whose caller gave up; the rest can no longer be cancelled
+        batch = [pending for pending in batch if pending.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        started = time.perf_counter()
+        try:
+            probabilities = self.backend.predict(np.stack([pending.inputs for pending in batch]))
+        except Exception as error:
+            with self._lock:
+                self.errors += 1
+            for pending in batch:
+                pending.future.set_exception(error)
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        with self._lock:
+            self.batch_count += 1
+            self.item_count += len(batch)
+            self._batches.append((len(batch), elapsed_ms))
+            self._waits.extend((started - pending.enqueued_at) * 1000 for pending in batch)
+        for pending, row in zip(batch, probabilities):
+            pending.future.set_result({name: float(prob) for name, prob in zip(self.classes, row)})
+
+    # ------------------------------------------------------------------
+    # Metrics
+    # ------------------------------------------------------------------
+    def stats(self) -> Dict:
+        """Batch sizes, per-batch forward latency and queue wait (recent window)."""
+        with self._lock:
+            sizes = np.array([size for size, _ in self._batches], dtype=np.float64)
+            latencies = np.array([ms for _, ms in self._batches], dtype=np.float64)
+            waits = np.array(self._waits, dtype=np.float64)
+            batches, items, errors, timeouts = self.batch_count, self.item_count, self.errors, self.timeouts
+
+        def percentiles(values: np.ndarray) -> Dict:
+            if not values.size:
+                return {"p50": None, "p95": None, "max": None}
+            p50, p95 = np.percentile(values, [50, 95])
+            return {"p50": round(float(p50), 3), "p95": round(float(p95), 3), "max": round(float(values.max()), 3)}
+
+        return {
+            "backend": self.backend.name,
+            "classes": list(self.classes),
+            "input_size": self.backend.input_size,
+            "threads": self.backend.threads,
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "warmup_ms": self.warmup_ms,
+            "batches": batches,
+            "items": items,
+            "errors": errors,
+            "timeouts": timeouts,
+            "mean_batch_size": round(float(sizes.mean()), 3) if sizes.size else None,
+            "batch_latency_ms": percentiles(latencies),
+            "queue_wait_ms": percentiles(waits),
+        }
+
+
+def load_classifier(
+    path: Optional[Union[str, Path]],
+    max_batch: int = 8,
+    max_wait_ms: float = 5.0,
+    threads: int = 0,
+    warmup_batches: int = 2,
+) -> Optional[XrayClassifier]:
+    """
+    Classifier for the model at ``path``, or None if there is no such file.
+
+    Raises:
+        ImportError: For an .onnx model without onnxruntime installed
+        ValueError: For an unsupported or malformed model file
+    """
+    if not path or not Path(path).is_file():
+        return None
+    backend = load_backend(path, threads)
+    return XrayClassifier(backend, max_batch, max_wait_ms, warmup_batches, fingerprint=_file_digest(Path(path)))
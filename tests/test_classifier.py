@@ -0,0 +1,167 @@
+import io
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from agents.imaging_agent import ImagingAgent
+from config import IMAGING_CONFIG
+from models.xray_classifier import (
+    ClassifierBackend, XrayClassifier, load_backend, load_classifier, save_numpy_model
+)
+from utils.image_artifact import ImageArtifact
+
+
+@pytest.fixture
+def model_path(tmp_path):
+    rng = np.random.default_rng(0)
+    layers = [(rng.normal(0, 0.05, (16 * 16, 8)), rng.normal(0, 0.1, 8)), (rng.normal(0, 1, (8, 5)), np.zeros(5))]
+    return save_numpy_model(tmp_path / "tiny.npz", layers, input_size=16)
+
+
+def _images(count, side=40):
+    rng = np.random.default_rng(1)
+    return [rng.integers(0, 256, (side, side), dtype=np.uint8) for _ in range(count)]
+
+
+def test_concurrent_requests_share_batched_forward_passes(model_path):
+    backend = load_backend(model_path)
+    classifier = XrayClassifier(backend, max_batch=4, max_wait_ms=200, warmup_batches=1)
+    try:
+        images = _images(8)
+        results = classifier.predict_many(images)
+        stats = classifier.stats()
+    finally:
+        classifier.close()
+
+    assert stats["batches"] == 2 and stats["items"] == 8 and stats["mean_batch_size"] == 4
+    assert stats["batch_latency_ms"]["p50"] is not None and stats["warmup_ms"] >= 0
+    for pixels, result in zip(images, results):
+        alone = backend.predict(backend.preprocess(pixels)[None])[0]
+        assert list(result) == backend.classes
+        assert np.allclose(list(result.values()), alone, atol=1e-6)
+
+    with pytest.raises(RuntimeError):
+        classifier.predict(images[0])
+
+
+def test_backend_without_predict_fails_at_construction():
+    class Incomplete(ClassifierBackend):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete(["NORMAL", "PNEUMONIA"], input_size=8)
+
+
+def test_imaging_agent_uses_model_when_present(model_path, tmp_path, monkeypatch):
+    encoded = io.BytesIO()
+    Image.fromarray(_images(1, side=120)[0]).save(encoded, format="PNG")
+    ingestion = {
+        "xray_path": "scan.png",
+        "xray_artifact": ImageArtifact(encoded.getvalue(), name="scan.png"),
+        "patient": {"age": 40}, "spo2": 97, "notes": "",
+    }
+
+    monkeypatch.setitem(IMAGING_CONFIG, "classifier_model", str(tmp_path / "missing.npz"))
+    heuristic = ImagingAgent()
+    assert heuristic.classifier is None and load_classifier(tmp_path / "missing.npz") is None
+    assert heuristic.classifier_stats()["enabled"] is False
+
+    monkeypatch.setitem(IMAGING_CONFIG, "classifier_model", str(model_path))
+    agent = ImagingAgent()
+    result = agent.process(ingestion)
+    expected = agent.classifier.predict(ingestion["xray_artifact"].working_grayscale(agent.max_side))
+    assert result["condition_probs"] == agent._normalise(expected)
+    assert agent.classifier_stats()["items"] == 2  # the explicit predict above included
+    assert agent._result_key(ingestion["xray_artifact"], {}) != heuristic._result_key(ingestion["xray_artifact"], {})
+
+    # An unusable model file degrades to the heuristics instead of failing
+    broken = tmp_path / "broken.npz"
+    broken.write_bytes(b"not a model")
+    monkeypatch.setitem(IMAGING_CONFIG, "classifier_model", str(broken))
+    fallback = ImagingAgent()
+    assert fallback.classifier is None
+    assert fallback.process(ingestion)["condition_probs"] == heuristic.process(ingestion)["condition_probs"]
+
+
+def _ingestion(side=120, notes=""):
+    encoded = io.BytesIO()
+    Image.fromarray(_images(1, side=side)[0]).save(encoded, format="PNG")
+    return {
+        "xray_path": "scan.png",
+        "xray_artifact": ImageArtifact(encoded.getvalue(), name="scan.png"),
+        "patient": {"age": 40}, "spo2": 97, "notes": notes,
+    }
+
+
+def test_slow_or_failing_model_falls_back_to_heuristics(model_path, tmp_path, monkeypatch):
+    import time
+
+    ingestion = _ingestion()
+    monkeypatch.setitem(IMAGING_CONFIG, "classifier_model", str(tmp_path / "missing.npz"))
+    heuristic = ImagingAgent().process(ingestion)["condition_probs"]
+
+    monkeypatch.setitem(IMAGING_CONFIG, "classifier_model", str(model_path))
+    monkeypatch.setitem(IMAGING_CONFIG, "classifier_timeout_s", 0.05)
+    agent = ImagingAgent()
+    backend_predict = agent.classifier.backend.predict
+
+    def slow(batch):
+        time.sleep(0.3)
+        return backend_predict(batch)
+
+    monkeypatch.setattr(agent.classifier.backend, "predict", slow)
+    assert agent.process(ingestion)["condition_probs"] == heuristic
+    stats = agent.classifier_stats()
+    assert stats["timeouts"] == 1 and stats["fallbacks"] == 1 and stats["timeout_s"] == 0.05
+
+    def broken(batch):
+        raise RuntimeError("backend crashed")
+
+    monkeypatch.setattr(agent.classifier.backend, "predict", broken)
+    assert agent.process(ingestion)["condition_probs"] == heuristic
+    assert agent.classifier_stats()["fallbacks"] == 2
+
+    # Fallback results are not cached under the model's key
+    monkeypatch.setattr(agent.classifier.backend, "predict", backend_predict)
+    expected = agent._normalise(agent.classifier.predict(ingestion["xray_artifact"].working_grayscale(agent.max_side)))
+    assert agent.process(ingestion)["condition_probs"] == expected != heuristic
+    agent.classifier.close()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_model_backed_agent_classifies_in_forked_worker(model_path, monkeypatch):
+    import json
+
+    # As under gunicorn preload_app: built and used in the master, then forked
+    monkeypatch.setitem(IMAGING_CONFIG, "classifier_model", str(model_path))
+    monkeypatch.setitem(IMAGING_CONFIG, "classifier_timeout_s", 5.0)
+    agent = ImagingAgent()
+    agent.process(_ingestion())
+    assert agent.classifier._worker.is_alive()
+
+    ingestion = _ingestion(side=96, notes="fever")
+    expected = agent._normalise(agent.classifier.predict(ingestion["xray_artifact"].working_grayscale(agent.max_side)))
+
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover - runs in the child
+        status = 1
+        try:
+            os.close(read_end)
+            result = agent.process(ingestion)
+            report = {"probs": result["condition_probs"], "fallbacks": agent.classifier_fallbacks}
+            os.write(write_end, json.dumps(report).encode())
+            status = 0
+        finally:
+            os._exit(status)
+
+    os.close(write_end)
+    with os.fdopen(read_end, "rb") as pipe:
+        report = json.loads(pipe.read() or b"{}")
+    _, status = os.waitpid(pid, 0)
+    agent.classifier.close()
+
+    assert os.WEXITSTATUS(status) == 0
+    assert report == {"probs": expected, "fallbacks": 0}
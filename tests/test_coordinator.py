@@ -185,6 +185,199 @@ def test_ingestion_to_imaging_handoff(sample_ingestion_output):
     return imaging_result
 
 
+def test_image_artifact_is_reused_after_ingestion(upload_dir, tmp_path):
+    """Imaging works from the bytes read at ingestion, without touching the saved file."""
+    import hashlib
+    import io
+
+    import numpy as np
+    from PIL import Image
+
+    pixels = (np.arange(64 * 48) % 251).astype(np.uint8).reshape(64, 48)
+    encoded = io.BytesIO()
+    Image.fromarray(pixels).save(encoded, format="PNG")
+    upload = io.BytesIO(encoded.getvalue())
+    upload.name = "scan.png"
+
+    ingestion = IngestionAgent(upload_dir=upload_dir).process(
+        {"xray_file": upload, "patient_info": {"age": 40}, "pincode": "400001"}
+    )
+    artifact = ingestion["xray_artifact"]
+    assert ingestion["xray_sha256"] == hashlib.sha256(encoded.getvalue()).hexdigest()
+    assert Path(ingestion["xray_path"]).read_bytes() == bytes(artifact.data)
+
+    Path(ingestion["xray_path"]).unlink()
+    result = ImagingAgent().process(ingestion)
+    assert "condition_probs" in result, result.get("error")
+    assert np.array_equal(artifact.grayscale, pixels)
+    assert artifact.grayscale is artifact.grayscale
+
+    # Path-only callers still work and see the same image
+    path = tmp_path / "scan.png"
+    path.write_bytes(encoded.getvalue())
+    from_path = ImagingAgent().process({
+        "xray_path": str(path),
+        "patient": ingestion["patient"],
+        "spo2": ingestion["spo2"],
+        "notes": ingestion["notes"],
+    })
+    assert from_path["condition_probs"] == result["condition_probs"]
+
+
+@pytest.mark.parametrize("fmt", ["PNG", "JPEG"])
+def test_large_images_use_bounded_working_resolution(fmt):
+    """Large X-rays are decoded reduced; features are measured against the full-resolution decode."""
+    import io
+
+    import numpy as np
+    from PIL import Image
+
+    from utils.image_artifact import ImageArtifact, grayscale_histogram
+
+    # Synthetic radiograph: gradient, sensor noise and sharp rib-like bands
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:1500, 0:1200]
+    image = 60 + x / 10 + y / 15 + rng.normal(0, 8, x.shape) + 45 * (np.sin(y / 18 + np.sin(x / 90)) > 0.6)
+    encoded = io.BytesIO()
+    Image.fromarray(np.clip(image, 0, 255).astype(np.uint8)).save(encoded, format=fmt)
+    artifact = ImageArtifact(encoded.getvalue(), name=f"large.{fmt.lower()}")
+
+    reduced = artifact.working_grayscale(512)
+    assert max(reduced.shape) <= 512
+    assert reduced is artifact.working_grayscale(512)
+
+    full = ImagingAgent._histogram_features(grayscale_histogram(artifact.grayscale))
+    bounded = ImagingAgent._histogram_features(grayscale_histogram(reduced))
+    delta = {name: bounded[name] - full[name] for name in full}
+    # Measured deltas here: mean -0.11 / +0.14, std -0.70 / -0.62, contrast -18 / -20,
+    # dark/bright ratios within 0.0025 (PNG / JPEG)
+    assert abs(delta["mean"]) <= 0.5
+    assert abs(delta["std"]) < 1.0
+    assert abs(delta["dark_ratio"]) < 0.005 and abs(delta["bright_ratio"]) < 0.005
+    assert -0.15 * full["contrast"] <= delta["contrast"] <= 0
+    if fmt == "PNG":
+        # Pure box reduction (the factor 3 divides both sides): the documented guarantees
+        assert reduced.shape == (500, 400)
+        assert reduced.min() >= artifact.grayscale.min() and reduced.max() <= artifact.grayscale.max()
+        assert delta["std"] <= 0
+
+    # Within the bound (or unbounded) the full-resolution pixels are used
+    assert artifact.working_grayscale(2000) is artifact.grayscale
+    assert artifact.working_grayscale(0) is artifact.grayscale
+
+
+def test_histogram_features_match_pixel_statistics():
+    import io
+
+    import numpy as np
+    from PIL import Image
+
+    from utils.image_artifact import ImageArtifact
+
+    pixels = np.random.default_rng(1).integers(0, 256, (300, 200), dtype=np.uint8)
+    pixels[0, 0], pixels[-1, -1] = 3, 251
+    encoded = io.BytesIO()
+    Image.fromarray(pixels).save(encoded, format="PNG")
+    artifact = ImageArtifact(encoded.getvalue(), name="scan.png")
+
+    features = ImagingAgent()._extract_image_features(artifact)
+    histogram = features.pop("histogram")
+    assert histogram.tolist() == np.bincount(pixels.ravel(), minlength=256).tolist()
+    assert histogram is artifact.histogram(ImagingAgent().max_side)
+
+    array = pixels.astype(np.float32)
+    expected = {
+        "mean": float(np.mean(array)),
+        "std": float(np.std(array)),
+        "contrast": float(np.max(array) - np.min(array)),
+        "dark_ratio": float(np.mean(array < 90)),
+        "bright_ratio": float(np.mean(array > 200)),
+    }
+    assert features == pytest.approx(expected, rel=1e-6)
+
+
+def test_imaging_results_are_cached_by_content(tmp_path):
+    import io
+
+    import numpy as np
+    from PIL import Image
+
+    from utils.image_artifact import ImageArtifact
+    from utils.result_cache import ResultCache
+
+    encoded = io.BytesIO()
+    Image.fromarray((np.arange(80 * 60) % 199).astype(np.uint8).reshape(80, 60)).save(encoded, format="PNG")
+
+    def analyze(agent, notes="Fever and dry cough"):
+        artifact = ImageArtifact(encoded.getvalue(), name="scan.png")
+        result = agent.process({
+            "xray_path": "scan.png", "xray_artifact": artifact,
+            "patient": {"age": 40}, "spo2": 95, "notes": notes,
+        })
+        return artifact, {k: v for k, v in result.items() if k not in ("timestamp", "processing_time_seconds")}
+
+    agent = ImagingAgent()
+    agent.result_cache = ResultCache(maxsize=8, directory=tmp_path)
+    first_artifact, first = analyze(agent)
+    assert first_artifact._grayscale is not None
+
+    # Same bytes under another object, same normalized notes: nothing is decoded
+    artifact, repeat = analyze(agent, notes="FEVER AND DRY COUGH")
+    assert repeat == first
+    assert artifact._grayscale is None and not artifact._histograms
+    assert agent.result_cache_stats()["hits"] == 1
+
+    analyze(agent, notes="productive cough")
+    assert agent.result_cache_stats()["misses"] == 2
+
+    # A fresh agent (a restart) finds the result on disk
+    restarted = ImagingAgent()
+    restarted.result_cache = ResultCache(maxsize=8, directory=tmp_path)
+    artifact, persisted = analyze(restarted)
+    assert persisted == first and artifact._grayscale is None
+    assert restarted.result_cache_stats()["disk_hits"] == 1
+
+    # Results of other rules never match
+    restarted.RULES_VERSION = "next"
+    artifact, _ = analyze(restarted)
+    assert artifact._grayscale is not None
+
+
+
+def test_result_cache_counts_disk_entries_and_prunes_past_slack(tmp_path, monkeypatch):
+    import os
+
+    from utils.result_cache import ResultCache
+
+    scans = []
+    original_scan = ResultCache._scan
+    monkeypatch.setattr(ResultCache, "_scan", lambda self: scans.append(1) or original_scan(self))
+
+    cache = ResultCache(maxsize=4, directory=tmp_path, max_disk_entries=10)
+    assert cache.prune_threshold == 11 and len(scans) == 1  # The startup scan
+    for n in range(11):
+        cache.put(f"{n:02d}", {"n": n})
+        os.utime(tmp_path / f"{n:02d}.json", (n, n))  # Oldest first
+    cache.put("05", {"n": "rewritten"})
+    os.utime(tmp_path / "05.json", (5, 5))
+    stats = cache.stats()
+    assert stats["disk_entries"] == 11 and stats["disk_prunes"] == 0 and len(scans) == 1
+    assert stats["disk_bytes"] == sum(path.stat().st_size for path in tmp_path.glob("*.json"))
+
+    # Past the slack: one scan prunes back to max_disk_entries, least recently used first
+    cache.put("11", {"n": 11})
+    assert len(scans) == 2 and cache.stats()["disk_prunes"] == 1
+    assert sorted(path.stem for path in tmp_path.glob("*.json")) == [f"{n:02d}" for n in range(2, 12)]
+    assert cache.disk_entries() == 10
+    assert cache.stats()["disk_bytes"] == sum(path.stat().st_size for path in tmp_path.glob("*.json"))
+
+    # A corrupt file is dropped from the count; a restart starts from one scan
+    (tmp_path / "03.json").write_text("{broken")
+    cache.memory.clear()
+    assert cache.get("03") is None and cache.disk_entries() == 9
+    assert ResultCache(maxsize=4, directory=tmp_path, max_disk_entries=10).disk_entries() == 9
+    assert cache.clear() >= 0 and cache.disk_entries() == 0 and not list(tmp_path.glob("*.json"))
+
 # ============= TEST 2: IMAGING → THERAPY HANDOFF =============
 
 def test_imaging_to_therapy_handoff(sample_imaging_output, sample_ingestion_output, data_dir):
@@ -370,6 +563,111 @@ def test_escalation_to_doctor(data_dir):
     return doctor_result
 
 
+def test_deterministic_context_gives_identical_results(coordinator):
+    """Agents driven by a deterministic RequestContext repeat byte for byte."""
+    import json
+    import random
+
+    import numpy as np
+    from PIL import Image
+
+    from utils.request_context import RequestContext
+
+    # Two full pipeline runs, including the pharmacy reservation
+    xray = coordinator.ingestion_agent.upload_dir / "scan.png"
+    Image.fromarray(np.random.default_rng(3).integers(60, 200, (256, 256), dtype=np.uint8)).save(xray)
+    upload = {
+        "xray_file": str(xray),
+        "patient_info": {"age": 30, "gender": "F", "allergies": []},
+        "symptoms": "mild cough",
+        "spo2": 98,
+        "pincode": "400001",
+    }
+    live_holds = len(coordinator.pharmacy_agent.reservations)
+    pipelines = []
+    for _ in range(2):
+        result = coordinator.execute_pipeline(dict(upload), RequestContext(deterministic=True, seed=7))
+        assert result["status"] == "SUCCESS" and result["pharmacy"]["status"] == "success"
+        result.pop("event_log")  # Records cache hits on the second run
+        pipelines.append(json.dumps(result, sort_keys=True, default=str))
+
+    assert pipelines[0] == pipelines[1]
+    # Replays preview the hold against the shared ledger but never take stock
+    pharmacy = json.loads(pipelines[0])["pharmacy"]
+    assert pharmacy["reserved_units"] > 0
+    assert pharmacy["reservation_id"] is None and pharmacy["reservation_expires_at"] is None
+    assert len(coordinator.pharmacy_agent.reservations) == live_holds
+
+    doctor_agent = coordinator.doctor_agent
+    therapy_agent = coordinator.therapy_agent
+    escalation_data = {
+        "imaging_result": {"condition_probs": {"pneumonia": 0.7, "normal": 0.3}, "severity_hint": "moderate"},
+        "patient": {"age": 58},
+    }
+    imaging = {"condition_probs": {"bronchitis": 0.6, "normal": 0.4}, "severity_hint": "mild"}
+    patient = {"age": 30, "allergies": [], "current_medications": []}
+    global_state = random.getstate()
+
+    runs = []
+    for _ in range(2):
+        context = RequestContext(deterministic=True, seed=7)
+        runs.append(json.dumps({
+            "session": coordinator._create_session(context),
+            "doctor": doctor_agent.process(escalation_data, context),
+            "therapy": therapy_agent.process(imaging, patient, context),
+            "order": coordinator._generate_order_summary({}, {"items": []}, context)["order_id"],
+        }, sort_keys=True))
+
+    assert runs[0] == runs[1]
+    assert random.getstate() == global_state
+
+    scores = [
+        [d["match_score"] for d in doctor_agent.process(escalation_data, RequestContext(seed=seed))["available_doctors"]]
+        for seed in (1, 2, 1)
+    ]
+    assert scores[0] == scores[2]
+
+
+
+def test_concurrent_pipelines_keep_separate_sessions_and_logs(coordinator, tmp_path):
+    """Runs sharing one Coordinator never see each other's session or events."""
+    import json
+    from concurrent.futures import ThreadPoolExecutor
+
+    import numpy as np
+    from PIL import Image
+
+    from utils.request_context import RequestContext
+
+    xray = coordinator.ingestion_agent.upload_dir / "scan.png"
+    Image.fromarray(np.random.default_rng(5).integers(60, 200, (256, 256), dtype=np.uint8)).save(xray)
+    upload = {"xray_file": str(xray), "patient_info": {"age": 30}, "symptoms": "mild cough", "pincode": "400001"}
+    coordinator_log = list(coordinator.event_log)
+
+    def run(seed):
+        return coordinator.execute_pipeline(dict(upload), RequestContext(seed=seed))
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(run, range(8)))
+
+    sessions = [result["session_id"] for result in results]
+    assert len(set(sessions)) == len(sessions)
+    for result in results:
+        starts = [event["message"] for event in result["event_log"] if event["message"].startswith("Starting pipeline")]
+        assert starts == [f"Starting pipeline execution - Session: {result['session_id']}"]
+        assert result["event_log"][-1]["message"] == "Pipeline completed successfully"
+    assert coordinator.event_log == coordinator_log and coordinator.current_session is None
+
+    # Session APIs called after a run report the last finished one
+    last = next(result for result in results if result["session_id"] == coordinator.last_run.session_id)
+    assert coordinator.get_event_log() == last["event_log"]
+    coordinator.export_session(str(tmp_path / "session.json"))
+    exported = json.loads((tmp_path / "session.json").read_text())
+    assert exported["session_id"] == last["session_id"] and exported["event_log"] == last["event_log"]
+    coordinator.clear_event_log()
+    assert coordinator.get_event_log() == []
+    assert coordinator.event_log[-1]["message"] == f"Session exported to {tmp_path / 'session.json'}"
+
 # ============= TEST 5: END-TO-END COORDINATOR FLOW =============
 
 def test_coordinator_pipeline_integration(coordinator):
@@ -1,9 +1,12 @@
 import math
 from datetime import datetime
 
+import numpy as np
 import pytest
 
 from agents.pharmacy_agent import PharmacyAgent
+from config import DEFAULT_LOCATION
+from utils.geo_utils import load_pincode_directory
 
 
 DATA_DIR = "./data"
@@ -83,3 +86,497 @@ def test_pharmacy_process_returns_reservation_details(pharmacy_agent):
     # Ensure reservation expiry is ISO formatted
     datetime.fromisoformat(result["reservation_expires_at"])
     datetime.fromisoformat(result["estimated_delivery"])
+
+
+def test_nearby_pharmacies_rank_exact_pincode_first():
+    agent = PharmacyAgent(data_dir=DATA_DIR)
+    churchgate = (18.9322, 72.8264)  # 400001 centroid
+
+    nearby = agent._find_nearby_pharmacies(
+        churchgate,
+        agent.max_search_radius_km,
+        patient_city="Mumbai",
+        patient_pincode="400001",
+    )
+
+    assert nearby, "Expected pharmacies around Churchgate"
+    matches = [p["location_match"] for p in nearby]
+    assert matches[0] == "exact_pincode"
+    # Match classes are contiguous and ordered: exact pincode, same city, nearby
+    rank = {"exact_pincode": 0, "same_city": 1, "nearby": 2}
+    assert [rank[m] for m in matches] == sorted(rank[m] for m in matches)
+    assert all(p["distance_km"] <= min(agent.max_search_radius_km, p["delivery_km"]) for p in nearby)
+    exact = [p["distance_km"] for p in nearby if p["location_match"] == "exact_pincode"]
+    assert exact == sorted(exact)
+
+
+def test_spatial_index_matches_full_scan_and_applies_filters():
+    agent = PharmacyAgent(data_dir=DATA_DIR)
+    index = agent.spatial_index
+    lat, lon = 19.2183, 72.9781  # Thane
+
+    full = index.query(lat, lon, 25)
+    distances = np.array([
+        agent._haversine_distance(lat, lon, row["lat"], row["lon"])
+        for row in agent._pharmacy_records
+    ])
+    expected = np.flatnonzero(distances <= np.minimum(25, agent._ph_delivery_km))
+    assert full.indices.tolist() == expected.tolist()
+    assert full.cells_visited < index.cell_count
+
+    ring = index.query(lat, lon, 25, min_results=3, initial_radius_km=2)
+    assert ring.searched_radius_km <= 25
+    assert len(ring.indices) >= 3 or ring.searched_radius_km == 25
+    assert set(ring.indices.tolist()) <= set(full.indices.tolist())
+
+    filtered = index.query(lat, lon, 25, verified_only=True, min_rating=4.5,
+                           required_services=["home_delivery"])
+    for i in filtered.indices:
+        record = agent._pharmacy_records[i]
+        assert record["verified"] and record["rating"] >= 4.5
+        assert "home_delivery" in record["services"]
+
+    assert len(index.query(lat, lon, 25, required_services=["teleportation"]).indices) == 0
+
+
+def test_pincode_coverage_lookup_and_rebuild_on_data_change(tmp_path):
+    import os
+    import shutil
+
+    for name in ("pharmacies.json", "inventory.csv", "zipcodes.csv", "meds.csv"):
+        shutil.copy(os.path.join(DATA_DIR, name), tmp_path / name)
+    agent = PharmacyAgent(data_dir=str(tmp_path))
+
+    entry = agent.pincode_coverage["400601"]
+    coords = (entry.lat, entry.lon)
+    from_table = agent._find_nearby_pharmacies(coords, agent.max_search_radius_km, "Thane", "400601")
+    agent.pincode_coverage = {}
+    from_index = agent._find_nearby_pharmacies(coords, agent.max_search_radius_km, "Thane", "400601")
+    # Only the first max_results are ranked by the index path; the rest is the same set
+    top = agent.max_results
+    assert [p["id"] for p in from_table][:top] == [p["id"] for p in from_index][:top]
+    assert sorted(p["id"] for p in from_table) == sorted(p["id"] for p in from_index)
+
+    zip_file = tmp_path / "zipcodes.csv"
+    with open(zip_file, "a") as handle:
+        handle.write("Thane,400699,Test Area,19.2000,72.9700,Thane\n")
+    os.utime(zip_file, ns=(0, 10**18))
+
+    agent._refresh_location_indexes()
+    assert "400699" in agent.pincode_coverage
+    assert "400601" in agent.pincode_coverage
+
+
+def test_stock_check_uses_dense_matrix_with_catalog_details():
+    agent = PharmacyAgent(data_dir=DATA_DIR)
+    stock = agent.stock
+    assert stock.qty.dtype == np.int32 and stock.price.dtype == np.float32
+
+    pharmacy_id, sku = agent.inventory.iloc[0][["pharmacy_id", "sku"]]
+    row = agent._pharmacy_records[stock.pharmacy_index[pharmacy_id]]
+    candidate = dict(row, distance_km=0.0)
+
+    matches = agent._check_stock_availability([candidate], {sku: {}, "OTC999": {}})
+
+    assert len(matches) == 1
+    match = matches[0]
+    assert match["missing_items"] == ["OTC999"]
+    assert match["stock_percentage"] == 50.0
+    item = match["available_items"][0]
+    catalog = agent.medicines.set_index("sku").loc[sku]
+    assert item["drug_name"] == catalog["drug_name"]
+    assert item["form"] == catalog["form"]
+    assert item["strength"] == catalog["strength"]
+    assert item["qty_available"] == int(agent.inventory.iloc[0]["qty_available"])
+
+
+def test_basket_bitsets_match_matrix_and_follow_stock_updates():
+    agent = PharmacyAgent(data_dir=DATA_DIR)
+    stock = agent.stock
+    basket = stock.skus[:3]
+    cols = [stock.sku_index[sku] for sku in basket]
+    candidates = stock.pharmacy_ids[:50]
+
+    in_stock = stock.qty[:50][:, cols] > 0
+    result = agent.match_baskets([basket], pharmacy_ids=candidates)[0]
+    assert result["full_match"] == [candidates[i] for i in np.flatnonzero(in_stock.all(axis=1))]
+    assert result["coverage"] == {
+        candidates[i]: int(n) for i, n in enumerate(in_stock.sum(axis=1)) if n
+    }
+
+    # Zeroing a cell through the matrix must clear the bit in both directions
+    row = stock.pharmacy_index[result["full_match"][0]] if result["full_match"] else 0
+    stock.set_stock(row, cols[0], 0)
+    after = agent.match_baskets([basket], pharmacy_ids=candidates)[0]
+    assert stock.pharmacy_ids[row] not in after["full_match"]
+    stock.set_stock(row, cols[0], 5, price=10.0)
+    assert stock.availability.sku_bits[cols[0]] >> row & 1
+    assert agent.match_baskets([["OTC999"]])[0]["full_match"] == []
+
+
+def test_pincode_directory_distinguishes_hits_from_default_fallback():
+    agent = PharmacyAgent(data_dir=DATA_DIR)
+    directory = agent.pincodes
+    assert directory is load_pincode_directory(f"{DATA_DIR}/zipcodes.csv")
+
+    hit = directory.resolve(400001)
+    assert hit.found and hit.record.pincode == "400001"
+    assert hit.record.city == "Mumbai" and hit.record.area == "Churchgate"
+    assert agent._get_coordinates("400001") == hit.coords
+
+    miss = directory.resolve("999999")
+    assert not miss.found
+    assert miss.coords == (DEFAULT_LOCATION["lat"], DEFAULT_LOCATION["lon"])
+    assert agent._get_coordinates("999999") == miss.coords
+    assert agent._get_coordinates("12345") is None
+
+
+def test_process_many_matches_process_in_input_order():
+    agent = PharmacyAgent(data_dir=DATA_DIR)
+    basket_a = {"otc_options": [{"sku": "OTC001", "frequency": "Every 6 hours", "duration": "3 days"},
+                                {"sku": "OTC015", "frequency": "Once daily", "duration": "5 days"}]}
+    basket_b = {"otc_options": [{"sku": "OTC002", "frequency": "Twice daily", "duration": "2 days"}]}
+    requests = [
+        (basket_a, {"pincode": "400001", "city": "Mumbai"}),
+        (basket_b, {"pincode": "400001", "city": "Mumbai"}),
+        ({"otc_options": []}, {"pincode": "400001"}),
+        (basket_a, {"pincode": "400001", "city": "Mumbai"}),
+        (basket_a, {"pincode": "421302", "city": "Bhiwandi",
+                    "pharmacy_filters": {"required_services": ["home_delivery"]}}),
+        (basket_b, {"pincode": "abc"}),
+    ]
+
+    volatile = {"timestamp", "estimated_delivery", "reservation_id", "reservation_expires_at"}
+
+    def strip(result):
+        # Holds from earlier requests lower the ATP seen by later ones, and a
+        # batch group reads it once, so available quantities are not compared
+        stripped = {key: value for key, value in result.items() if key not in volatile}
+        stripped["items"] = [
+            {key: value for key, value in item.items() if key != "quantity_available"}
+            for item in result.get("items", [])
+        ]
+        return stripped
+
+    batched = agent.process_many(requests)
+    sequential = PharmacyAgent(data_dir=DATA_DIR)
+    assert len(batched) == len(requests)
+    for (therapy_result, location), result in zip(requests, batched):
+        assert strip(result) == strip(sequential.process(therapy_result, location))
+    assert batched[2]["status"] != "success"
+
+
+def test_ranking_returns_top_k_alternatives_in_full_sort_order():
+    from agents.pharmacy_agent import top_k_order
+
+    scores = np.array([5.0, 1.0, 3.0, 1.0, 9.0, 0.5, 3.0])
+    order = top_k_order(scores, 3)
+    assert order[:3].tolist() == [5, 1, 3]
+    assert sorted(order.tolist()) == list(range(scores.size))
+    assert top_k_order(scores, None).tolist() == np.argsort(scores, kind="stable").tolist()
+
+    agent = PharmacyAgent(data_dir=DATA_DIR)
+    agent.max_results = 4
+    therapy_result = {"otc_options": [{"sku": "OTC001"}, {"sku": "OTC015"}]}
+    result = agent.process(therapy_result, {"pincode": "400001", "city": "Mumbai"})
+    assert result["status"] == "success"
+    assert len(result["alternatives"]) == 3
+
+    request, _ = agent._resolve_request(therapy_result, {"pincode": "400001", "city": "Mumbai"})
+    _, matches = agent._search_and_check_stock(request)
+    full = sorted(matches, key=agent._ranking_key)
+    assert [result["pharmacy_id"]] + [alt["pharmacy_id"] for alt in result["alternatives"]] == [
+        match["id"] for match in full[:4]
+    ]
+
+
+def test_reservation_ledger_never_overpromises_and_expires_holds():
+    import threading
+
+    from utils.reservations import ReservationLedger
+
+    agent = PharmacyAgent(data_dir=DATA_DIR)
+    stock = agent.stock
+    pharmacy_id, sku = agent.inventory.iloc[0][["pharmacy_id", "sku"]]
+    row, col = stock.pharmacy_index[pharmacy_id], stock.sku_index[sku]
+    stock.set_stock(row, col, 50)
+
+    now = [1000.0]
+    ledger = ReservationLedger(stock, ttl_seconds=7200, stripes=8, clock=lambda: now[0])
+    granted = []
+
+    def worker(n):
+        reservation = ledger.hold(f"RSV{n}", pharmacy_id, {sku: 3})
+        if reservation is not None:
+            granted.append(reservation.lines[sku])
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(40)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(granted) == 50
+    assert ledger.available(np.array([row]), np.array([col]))[0, 0] == 0
+    assert ledger.preview(pharmacy_id, {sku: 3}) is None
+
+    # Held stock is invisible to the matcher until the holds expire
+    agent.reservations = ledger
+    candidate = dict(agent._pharmacy_records[row], distance_km=0.0)
+    assert agent._check_stock_availability([candidate], {sku: {}}) == []
+
+    released = next(iter(ledger._reservations))
+    released_units = ledger.get(released).lines[sku]
+    assert ledger.release(released) and not ledger.release(released)
+    assert ledger.available(np.array([row]), np.array([col]))[0, 0] == released_units
+    preview = ledger.preview(pharmacy_id, {sku: 1000})
+    assert preview.status == "preview" and preview.lines == {sku: released_units} and ledger.get("") is None
+    assert ledger.available(np.array([row]), np.array([col]))[0, 0] == released_units
+
+    remaining = len(ledger)
+    now[0] += 7199
+    assert ledger.sweep() == 0
+    now[0] += 1
+    assert ledger.sweep() == remaining
+    assert len(ledger) == 0
+    assert agent._check_stock_availability([candidate], {sku: {}})[0]["available_items"][0]["qty_available"] == 50
+
+
+
+def test_reservation_ledger_rebind_moves_expiries_with_renumbered_rows():
+    from utils.inventory_index import StockMatrix
+    from utils.reservations import ReservationLedger
+
+    def matrix(pharmacy_ids):
+        stock = StockMatrix(pharmacy_ids, ["SKU1"])
+        for row in range(len(pharmacy_ids)):
+            stock.set_stock(row, 0, 10)
+        return stock
+
+    now = [0.0]
+    ledger = ReservationLedger(matrix(["P0", "P1", "P2"]), ttl_seconds=60, stripes=3, clock=lambda: now[0])
+    assert ledger.hold("A", "P1", {"SKU1": 4}) and ledger.hold("B", "P2", {"SKU1": 2})
+    assert ledger.hold("C", "P0", {"SKU1": 1})
+
+    # P0 vanishes and P1/P2 swap rows, so both live holds change stripe
+    assert ledger.rebind(matrix(["P2", "P1"])) == 1
+    assert ledger.get("C") is None and len(ledger) == 2
+    assert [len(stripe.expiries) for stripe in ledger._stripes] == [1, 1, 0]
+    assert ledger.held[:2, 0].tolist() == [2, 4]
+
+    assert ledger.commit("B") and ledger.stock.qty[0, 0] == 8 and ledger.held[0, 0] == 0
+    now[0] += 60
+    assert ledger.sweep() == 1 and len(ledger) == 0 and ledger.held.sum() == 0
+
+    ledger.start_sweeper(interval_seconds=3600)
+    first = ledger._sweeper
+    ledger.start_sweeper(interval_seconds=3600)
+    assert ledger._sweeper is first
+    ledger.stop_sweeper()
+
+def test_inventory_deltas_apply_in_place_from_api_and_file_drop(tmp_path):
+    import json
+    import os
+    import shutil
+
+    import pandas as pd
+
+    for name in ("pharmacies.json", "inventory.csv", "zipcodes.csv", "meds.csv"):
+        shutil.copy(os.path.join(DATA_DIR, name), tmp_path / name)
+    agent = PharmacyAgent(data_dir=str(tmp_path))
+    stock = agent.stock
+    pharmacy_id, sku = agent.inventory.iloc[0][["pharmacy_id", "sku"]]
+    row, col = stock.pharmacy_index[pharmacy_id], stock.sku_index[sku]
+
+    result = agent.apply_inventory_deltas([
+        {"pharmacy_id": pharmacy_id, "sku": sku, "qty": 0},
+        {"pharmacy_id": "ph-missing", "sku": sku, "qty": 3},
+        {"pharmacy_id": pharmacy_id, "sku": sku},
+    ])
+    assert result["status"] == "partial"
+    assert (result["version"], result["applied"], result["rejected"]) == (1, 1, 2)
+    assert stock.qty[row, col] == 0
+    assert not stock.availability.sku_bits[col] >> row & 1
+
+    inbox = tmp_path / "inventory_deltas"
+    inbox.mkdir()
+    (inbox / "001.ndjson").write_text(
+        json.dumps({"pharmacy_id": pharmacy_id, "sku": sku, "qty_delta": 7, "price": 12.5}) + "\n"
+    )
+    (inbox / "002.csv").write_text(f"pharmacy_id,sku,qty_delta\n{pharmacy_id},{sku},-2\n")
+    summaries = agent.ingest_inventory_drops()
+    assert [summary["status"] for summary in summaries] == ["success", "success"]
+    assert stock.version == 3 and stock.qty[row, col] == 5
+    assert stock.availability.sku_bits[col] >> row & 1
+    assert sorted(path.name for path in (inbox / "processed").iterdir()) == ["001.ndjson", "002.csv"]
+
+    agent.compact_inventory()
+    on_disk = pd.read_csv(tmp_path / "inventory.csv")
+    cell = on_disk[(on_disk["pharmacy_id"] == pharmacy_id) & (on_disk["sku"] == sku)].iloc[0]
+    assert (cell["qty_available"], cell["price"]) == (5, 12.5)
+    assert len(on_disk) == len(pd.read_csv(os.path.join(DATA_DIR, "inventory.csv")).drop_duplicates(["pharmacy_id", "sku"]))
+
+
+def test_out_of_range_deltas_are_rejected_and_bad_files_quarantined(tmp_path):
+    import json
+    import os
+    import shutil
+
+    from utils.inventory_deltas import QTY_LIMIT, parse_delta_text
+    from utils.inventory_index import QTY_MAX
+
+    for name in ("pharmacies.json", "inventory.csv", "zipcodes.csv", "meds.csv"):
+        shutil.copy(os.path.join(DATA_DIR, name), tmp_path / name)
+    agent = PharmacyAgent(data_dir=str(tmp_path))
+    stock = agent.stock
+    pharmacy_id, sku = agent.inventory.iloc[0][["pharmacy_id", "sku"]]
+    row, col = stock.pharmacy_index[pharmacy_id], stock.sku_index[sku]
+
+    lines = [
+        {"pharmacy_id": pharmacy_id, "sku": sku, "qty": 99999999999},
+        {"pharmacy_id": pharmacy_id, "sku": sku, "qty_delta": 2 ** 40},
+        {"pharmacy_id": pharmacy_id, "sku": sku, "qty": 2.7},
+        {"pharmacy_id": pharmacy_id, "sku": sku, "qty": "inf"},
+        {"pharmacy_id": pharmacy_id, "sku": sku, "price": "inf"},
+        {"pharmacy_id": pharmacy_id, "sku": sku, "qty": "4.0"},
+    ]
+    deltas, errors = parse_delta_text("\n".join(json.dumps(line) for line in lines), "ndjson")
+    assert [delta.qty for delta in deltas] == [4] and len(errors) == 5
+
+    result = agent.apply_inventory_deltas([{"pharmacy_id": pharmacy_id, "sku": sku, "qty_delta": 2 ** 40}])
+    assert result["status"] == "error" and stock.version == 0
+
+    # Deltas within range still cannot overflow the int32 cell
+    stock.apply_delta(row, col, qty=QTY_LIMIT)
+    assert stock.apply_delta(row, col, qty_delta=QTY_LIMIT) == QTY_MAX
+
+    inbox = tmp_path / "inventory_deltas"
+    inbox.mkdir()
+    (inbox / "001.ndjson").write_text(json.dumps(lines[0]) + "\n")
+    (inbox / "002.csv").write_text(f"pharmacy_id,sku,qty\n{pharmacy_id},{sku},6\n")
+    agent._last_inbox_poll = float("-inf")
+    agent._poll_inventory_inbox()
+    assert [path.name for path in (inbox / "failed").iterdir()] == ["001.ndjson"]
+    assert [path.name for path in (inbox / "processed").iterdir()] == ["002.csv"]
+    assert stock.qty[row, col] == 6
+
+    # A write failing midway still bumps the version for the cells already changed
+    version = stock.version
+    original = stock.apply_delta
+    calls = []
+    def fail_second(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 2:
+            raise RuntimeError("disk on fire")
+        return original(*args, **kwargs)
+    stock.apply_delta = fail_second
+    with pytest.raises(RuntimeError):
+        agent.apply_inventory_deltas([{"pharmacy_id": pharmacy_id, "sku": sku, "qty": 9}] * 2)
+    del stock.apply_delta
+    assert stock.version == version + 1 and stock.qty[row, col] == 9
+
+    # A file that blows up while being applied is quarantined, not retried forever
+    (inbox / "003.ndjson").write_text(json.dumps({"pharmacy_id": pharmacy_id, "sku": sku, "qty": 1}) + "\n")
+    def explode(*args, **kwargs):
+        raise OverflowError("boom")
+    agent.apply_inventory_deltas = explode
+    assert agent.ingest_inventory_drops()[0]["status"] == "error"
+    assert sorted(path.name for path in (inbox / "failed").iterdir()) == ["001.ndjson", "003.ndjson"]
+
+
+def test_binary_snapshot_loads_memory_mapped_and_falls_back_when_stale(tmp_path):
+    import os
+    import shutil
+
+    import pandas as pd
+
+    from utils.snapshot import build_snapshot, is_fresh, load_table, read_source
+
+    for name in ("pharmacies.json", "inventory.csv", "zipcodes.csv", "meds.csv"):
+        shutil.copy(os.path.join(DATA_DIR, name), tmp_path / name)
+    build_snapshot(tmp_path)
+
+    def memory_mapped(array):
+        while array is not None:
+            if isinstance(array, np.memmap):
+                return True
+            array = array.base
+        return False
+
+    for table in ("pharmacies", "inventory"):
+        loaded, source = load_table(tmp_path, table), read_source(tmp_path, table)
+        for name, column in loaded.items():
+            if isinstance(column.dtype, pd.CategoricalDtype):
+                assert memory_mapped(column.array.codes), name
+                loaded[name] = column.astype(source[name].dtype)
+            elif column.dtype != object:
+                assert memory_mapped(column.to_numpy()), name
+        pd.testing.assert_frame_equal(loaded, source)
+    assert load_table(tmp_path, "inventory")["pharmacy_id"].dtype == "category"
+    assert load_table(tmp_path, "doctors") is None  # no source, no table
+    assert load_table(tmp_path, "meds") is None  # too small to be worth a snapshot
+
+    messages = []
+    from_snapshot = PharmacyAgent(data_dir=str(tmp_path), log_callback=lambda agent, level, msg: messages.append(msg))
+    assert any("pharmacies from snapshot" in message for message in messages)
+    baseline = PharmacyAgent(data_dir=DATA_DIR)
+    assert np.array_equal(from_snapshot.stock.qty, baseline.stock.qty)
+    assert from_snapshot._pharmacy_records == baseline._pharmacy_records
+
+    inventory = tmp_path / "inventory.csv"
+    os.utime(inventory, ns=(0, inventory.stat().st_mtime_ns + 10**9))
+    assert not is_fresh(tmp_path, "inventory")
+    assert load_table(tmp_path, "inventory") is None
+    assert is_fresh(tmp_path, "pharmacies")
+
+
+def test_data_store_shares_tables_and_indexes_between_agents():
+    from agents.doctor_agent import DoctorAgent
+    from agents.therapy_agent import TherapyAgent
+    from utils.data_store import DataStore
+
+    store = DataStore(DATA_DIR)
+    assert store._tables == {}  # nothing is read until asked for
+
+    first = PharmacyAgent(data_store=store)
+    second = PharmacyAgent(data_store=store)
+    assert first.pharmacies is second.pharmacies
+    assert first.spatial_index is second.spatial_index
+    assert first.pincode_coverage is second.pincode_coverage
+    assert first.stock is second.stock and first.reservations is second.reservations
+
+    therapy = TherapyAgent(data_store=store)
+    assert therapy.meds_df is store.table("meds")
+    # The pharmacy agent's encoded inventory replaced the store's copy; therapy must not reload it
+    assert "inventory" not in store._tables
+    assert therapy.option_details["OTC001"]["price_range"].startswith("₹")
+    assert "doctors" not in store._tables
+    DoctorAgent(data_store=store)
+    assert "doctors" in store._tables
+
+    assert DataStore.shared(DATA_DIR) is DataStore.shared(DATA_DIR + "/.")
+    assert not store.refresh("pharmacies", "meds")
+
+
+def test_inventory_is_dictionary_encoded():
+    import pandas as pd
+
+    agent = PharmacyAgent(data_dir=DATA_DIR)
+    for column in ("pharmacy_id", "sku", "drug_name"):
+        assert isinstance(agent.inventory[column].dtype, pd.CategoricalDtype)
+    assert isinstance(agent.pharmacies["city"].dtype, pd.CategoricalDtype)
+    # The pharmacy_id dictionary starts with the pharmacy table order
+    assert list(agent.inventory["pharmacy_id"].cat.categories[:3]) == agent.pharmacies["id"].astype(str).tolist()[:3]
+
+    report = agent.memory_diagnostics()
+    inventory = report["tables"]["inventory"]
+    assert report["status"] == "success"
+    assert inventory["encoded_bytes"] * 3 < inventory["decoded_bytes"]
+
+    rows, nearby = agent._search_candidates(
+        (DEFAULT_LOCATION["lat"], DEFAULT_LOCATION["lon"]), agent.max_search_radius_km
+    )
+    therapy_map = {sku: {} for sku in agent.stock.skus[:3]}
+    by_row = agent._check_stock_availability(nearby, therapy_map, rows=rows)
+    by_id = agent._check_stock_availability(nearby, therapy_map)
+    assert by_row == by_id
@@ -0,0 +1,275 @@
+import pytest
+
+from agents.therapy_agent import TherapyAgent
+
+DATA_DIR = "./data"
+
+
+@pytest.fixture(scope="module")
+def therapy_agent():
+    return TherapyAgent(data_dir=DATA_DIR)
+
+
+def _free_text_allergy(med, allergy):
+    """Original allergy rule: exact comma-separated keyword or drug-name substring."""
+    contra = [k.strip() for k in str(med["contra_allergy_keywords"]).lower().split(",")]
+    return allergy.lower() in contra or allergy.lower() in str(med["drug_name"]).lower()
+
+
+def _ontology_allergy(agent, med, allergy):
+    """Allergy rule with the ontology: free text, or the allergen's closure hits the drug or a keyword."""
+    import re
+
+    if allergy.lower() == "none":
+        return False
+    ontology = agent.allergen_index.ontology
+    covered = ontology.expand(allergy)
+    keywords = {ontology.canonical(k) for k in re.split(r"[\s,]+", str(med["contra_allergy_keywords"]).lower()) if k}
+    keywords.discard("none")
+    return (
+        _free_text_allergy(med, allergy)
+        or ontology.canonical(med["drug_name"]) in covered
+        or bool(keywords & covered)
+    )
+
+
+def _scan_otc_skus(agent, condition, patient_age, allergies, allergy_rule=_free_text_allergy):
+    """Row-by-row reference for _get_otc_medicines (the pre-index implementation)."""
+    indications = agent.condition_map.get(condition, [])
+    skus = []
+    for _, med in agent.meds_df.iterrows():
+        if not any(ind in str(med["indication"]).lower() for ind in indications):
+            continue
+        if patient_age < med["age_min"]:
+            continue
+        if any(allergy_rule(med, allergy) for allergy in allergies):
+            continue
+        skus.append(med["sku"])
+    return skus
+
+
+def _greedy_basket(agent, skus, limit=5):
+    """Reference greedy selection using pairwise index lookups."""
+    from utils.interaction_index import LEVEL_CODES
+
+    names = dict(zip(agent.meds_df["sku"], agent.meds_df["drug_name"]))
+    basket = []
+    for sku in skus:
+        clash = any(
+            LEVEL_CODES.get(entry.level, 1) >= agent.basket_conflict_level
+            for chosen in basket
+            for entry in agent.interaction_index.lookup(names[sku], names[chosen])
+        )
+        if not clash:
+            basket.append(sku)
+        if len(basket) == limit:
+            break
+    return basket
+
+
+@pytest.mark.parametrize("condition", ["pneumonia", "covid_suspect", "bronchitis", "normal"])
+@pytest.mark.parametrize("patient_age", [1, 6, 12, 45])
+@pytest.mark.parametrize("allergies", [[], ["aspirin"], ["Paracetamol", "syrup"], ["none"]])
+def test_indication_index_matches_row_scan(therapy_agent, condition, patient_age, allergies):
+    index = therapy_agent.medicine_index
+    scanned = _scan_otc_skus(therapy_agent, condition, patient_age, allergies)
+    rows = index.suitable(therapy_agent.condition_map.get(condition, []), patient_age, allergies)
+    assert [index.skus[row] for row in rows] == scanned
+
+    # Ranked by how many of the condition's indications a medicine covers,
+    # with allergies resolved through the allergen ontology
+    scanned = _scan_otc_skus(
+        therapy_agent, condition, patient_age, allergies,
+        lambda med, allergy: _ontology_allergy(therapy_agent, med, allergy)
+    )
+    texts = dict(zip(therapy_agent.meds_df["sku"], therapy_agent.meds_df["indication"].str.lower()))
+    indications = therapy_agent.condition_map.get(condition, [])
+    ranked = sorted(scanned, key=lambda sku: -sum(ind in texts[sku] for ind in indications))
+
+    options = therapy_agent._get_otc_medicines(condition, patient_age, allergies, "mild")
+    assert [option["sku"] for option in options] == _greedy_basket(therapy_agent, ranked)
+
+
+def test_medicine_index_resolves_phrases_by_substring(therapy_agent):
+    index = therapy_agent.medicine_index
+    texts = [str(value).lower() for value in therapy_agent.meds_df["indication"]]
+
+    for phrase in ("chest congestion", "pain", "ain", "est con", "cold fever"):
+        expected = [row for row, text in enumerate(texts) if phrase in text]
+        assert index.rows_for_indications([phrase]).tolist() == expected
+    assert "fever" in index.token_rows
+
+
+def test_interaction_index_is_unordered_and_expands_classes():
+    import pandas as pd
+
+    from utils.interaction_index import InteractionIndex
+
+    interactions = pd.DataFrame(
+        [
+            ("Ibuprofen", "Naproxen", "high", "both NSAIDs"),
+            ("Naproxen", "ibuprofen ", "mild", "second entry"),
+            ("NSAID", "Warfarin", "high", "bleeding"),
+        ],
+        columns=["drug_a", "drug_b", "level", "note"],
+    )
+    classes = pd.DataFrame([("NSAID", "Ibuprofen"), ("NSAID", "Naproxen")], columns=["drug_class", "drug"])
+    index = InteractionIndex(interactions, classes)
+
+    assert [entry.note for entry in index.lookup("naproxen", "IBUPROFEN")] == ["both NSAIDs", "second entry"]
+    assert [entry.via_class for entry in index.lookup("Warfarin", "Ibuprofen")] == ["NSAID"]
+    assert index.lookup("warfarin", "nsaid")[0].via_class is None
+    assert index.lookup("Ibuprofen", "Paracetamol") == []
+
+
+def test_check_interactions_reports_each_pair_once(therapy_agent):
+    warnings = therapy_agent._check_interactions(
+        [{"drug_name": "Ibuprofen"}, {"drug_name": "Cetirizine"}],
+        ["naproxen", "Warfarin", "Diphenhydramine"],
+    )
+    assert [(w["drug_a"], w["drug_b"], w["level"]) for w in warnings] == [
+        ("Ibuprofen", "naproxen", "high"),
+        ("Ibuprofen", "Warfarin", "high"),
+        ("Cetirizine", "Diphenhydramine", "moderate"),
+    ]
+
+
+def test_basket_is_screened_for_internal_interactions(therapy_agent):
+    graph = therapy_agent.interaction_graph
+    index = therapy_agent.medicine_index
+    paracetamol, ibuprofen, acetaminophen = (index.sku_rows[sku] for sku in ("OTC001", "OTC002", "OTC015"))
+
+    assert graph.submatrix([paracetamol, ibuprofen, acetaminophen]).tolist() == [[0, 1, 4], [1, 0, 0], [4, 0, 0]]
+    selected, skipped = graph.select_compatible([paracetamol, acetaminophen, ibuprofen], limit=5, min_level=2)
+    assert selected == [paracetamol, ibuprofen]
+    assert skipped == [(acetaminophen, paracetamol)]
+
+    result = therapy_agent.process(
+        {"condition_probs": {"pneumonia": 0.7, "normal": 0.3}, "severity_hint": "mild"},
+        {"age": 30, "allergies": [], "current_medications": []},
+    )
+    names = [option["drug_name"] for option in result["otc_options"]]
+    assert "Paracetamol" in names and "Acetaminophen" not in names
+    assert [(w["drug_a"], w["drug_b"], w["level"]) for w in result["interaction_warnings"]] == [
+        ("Paracetamol", "Ibuprofen", "mild")
+    ]
+
+
+def test_relevance_scores_weight_every_condition(therapy_agent):
+    import numpy as np
+
+    from utils.medicine_index import RankedRows, RelevanceScorer
+
+    probs = {"pneumonia": 0.5, "bronchitis": 0.3, "normal": 0.2, "not_a_condition": 0.9}
+    scorer = therapy_agent._relevance_scorer()
+    texts = therapy_agent.meds_df["indication"].str.lower().tolist()
+    expected = [
+        sum(
+            prob * sum(phrase in text for phrase in therapy_agent.condition_map.get(condition, []))
+            for condition, prob in probs.items()
+        )
+        for text in texts
+    ]
+    scores = scorer.scores(probs)
+    assert np.allclose(scores, expected)
+
+    order = np.concatenate(list(RelevanceScorer.ranked(scores, window=3))).tolist()
+    assert order == sorted(np.flatnonzero(scores > 0), key=lambda row: (-scores[row], row))
+
+    # RankedRows only knows the head until a consumer reads past it
+    ranked = RankedRows(scores, window=3)
+    assert ranked.head.tolist() == order[:ranked.head.size] and not ranked.complete
+    rows = iter(row for chunk in ranked for row in chunk)
+    assert [next(rows) for _ in range(ranked.head.size)] == order[:ranked.head.size]
+    assert ranked.decided_by_head
+    assert list(rows) == order[ranked.head.size:] and not ranked.decided_by_head
+    assert RankedRows(scores, window=len(order)).complete
+
+    mostly_bronchitis = therapy_agent._get_otc_medicines(
+        "pneumonia", 30, [], "mild", {"pneumonia": 0.4, "bronchitis": 0.35, "normal": 0.25}
+    )
+    pneumonia_only = therapy_agent._get_otc_medicines("pneumonia", 30, [], "mild")
+    assert [o["sku"] for o in mostly_bronchitis] != [o["sku"] for o in pneumonia_only]
+
+
+def test_allergen_ontology_closure_excludes_class_members(therapy_agent):
+    from utils.inventory_index import AvailabilityBitsets
+
+    index = therapy_agent.allergen_index
+    names = therapy_agent.medicine_index.drug_names
+
+    def excluded(*allergies):
+        return sorted(names[row] for row in AvailabilityBitsets.bits_to_rows(index.excluded_bits(allergies)))
+
+    assert index.ontology.expand("NSAIDs") >= {"nsaid", "salicylate", "aspirin", "ibuprofen", "naproxen"}
+    assert excluded("nsaids") == ["Aspirin", "Ibuprofen"]
+    assert excluded("Tylenol") == ["Acetaminophen", "Paracetamol"]
+    assert excluded("beta-lactam") == ["Antibiotic Respiratory"]
+    assert excluded("none") == []
+    assert excluded("tylenol", "syrup") == sorted(excluded("tylenol") + excluded("syrup"))
+
+    safe, conflicts = therapy_agent._filter_allergies(
+        [{"sku": "OTC002", "drug_name": "Ibuprofen"}, {"sku": "OTC006", "drug_name": "Vitamin C"}],
+        ["NSAID"],
+    )
+    assert [option["sku"] for option in safe] == ["OTC006"]
+    assert conflicts[0]["allergy"] == "NSAID"
+
+
+def test_plan_cache_keys_on_normalized_inputs(therapy_agent):
+    imaging = {"condition_probs": {"pneumonia": 0.6, "bronchitis": 0.3, "normal": 0.1}, "severity_hint": "mild"}
+    therapy_agent.plan_cache.clear()
+    hits = therapy_agent.plan_cache.hits
+
+    first = therapy_agent.process(imaging, {"age": 30, "allergies": ["syrup", "Aspirin"], "current_medications": []})
+    # Same allergy set in another order, same age band
+    second = therapy_agent.process(imaging, {"age": 40, "allergies": ["Aspirin", "syrup", "syrup"]})
+    assert therapy_agent.plan_cache.hits == hits + 1
+    assert {k: v for k, v in first.items() if k != "timestamp"} == {k: v for k, v in second.items() if k != "timestamp"}
+
+    # Cached plans are copies: mutating a result does not leak into the next hit
+    second["otc_options"].clear()
+    assert therapy_agent.process(imaging, {"age": 30, "allergies": ["Aspirin", "syrup"]})["otc_options"]
+
+    # A child falls in another age band and gets its own plan
+    child = therapy_agent.process(imaging, {"age": 1, "allergies": ["Aspirin", "syrup"]})
+    assert therapy_agent._age_band(1) != therapy_agent._age_band(30)
+    assert [o["sku"] for o in child["otc_options"]] != [o["sku"] for o in first["otc_options"]]
+
+    # Other probabilities that rank the catalog the same way reuse the plan
+    hits = therapy_agent.plan_cache.hits
+    nearby = {"condition_probs": {"pneumonia": 0.583, "bronchitis": 0.312, "normal": 0.105}, "severity_hint": "mild"}
+    assert therapy_agent.process(nearby, {"age": 30, "allergies": ["Aspirin", "syrup"]})["otc_options"] == first["otc_options"]
+    assert therapy_agent.plan_cache.hits == hits + 1
+    # Same primary condition, but COVID weight reorders the catalog: a new plan
+    reranked = {"condition_probs": {"pneumonia": 0.4, "bronchitis": 0.35, "covid_suspect": 0.25}, "severity_hint": "mild"}
+    therapy_agent.process(reranked, {"age": 30, "allergies": ["Aspirin", "syrup"]})
+    assert therapy_agent.plan_cache.hits == hits + 1
+
+    paracetamol = next(o for o in first["otc_options"] if o["sku"] == "OTC001")
+    assert (paracetamol["form"], paracetamol["strength"]) == ("Tablet", "500mg")
+    assert paracetamol["price_range"] == therapy_agent.option_details["OTC001"]["price_range"]
+
+    # A new data version drops every cached plan
+    therapy_agent.data_version = ("stale",)
+    therapy_agent.process(imaging, {"age": 30, "allergies": ["Aspirin", "syrup"]})
+    assert therapy_agent.data_version == therapy_agent._data_version()
+    assert len(therapy_agent.plan_cache) == 1
+
+
+def test_ttl_cache_evicts_lru_and_expires():
+    from utils.ttl_cache import TTLCache, stable_hash
+
+    now = [0.0]
+    cache = TTLCache(maxsize=2, ttl_seconds=10, clock=lambda: now[0])
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)  # "b" is least recently used
+    assert cache.get("b") is None and cache.get("c") == 3
+
+    now[0] = 10.0
+    assert cache.get("a") is None
+    assert cache.stats()["evictions"] == 1 and cache.stats()["expirations"] == 1
+
+    assert stable_hash({"x": [1, 2], "y": "z"}) == stable_hash({"y": "z", "x": [1, 2]})
@@ -0,0 +1,192 @@
+"""
+Allergen ontology and precomputed allergen -> excluded-SKU bitsets.
+Location: utils/allergen_ontology.py
+
+data/allergen_ontology.csv holds ``term,relation,target`` rows:
+
+- ``synonym``: ``term`` is another name for ``target`` (tylenol -> paracetamol)
+- ``is_a``: ``term`` belongs to the class ``target`` (aspirin -> salicylate)
+
+drug_classes.csv memberships are read as extra ``is_a`` edges. An allergy
+to a class covers everything below it (nsaid -> salicylate -> aspirin), so
+the transitive closure is computed once and every allergen is compiled to a
+bitset of the catalog rows it excludes (bit ``i`` = catalog row ``i``, as in
+AvailabilityBitsets). Filtering a patient is then an OR across their
+allergies' bitsets and one mask over the candidate rows.
+
+A row is excluded by an allergen when the closure contains the row's drug
+name or one of its contraindication keywords. The original free-text rules
+(allergy equals a comma-separated keyword, or is a substring of the drug
+name) still apply on top, so no allergy that matched before is missed.
+"""
+
+import re
+import threading
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Set
+
+import numpy as np
+import pandas as pd
+
+from utils.inventory_index import AvailabilityBitsets
+from utils.medicine_index import MedicineIndex
+
+NO_ALLERGEN = "none"
+
+
+def normalize_term(term) -> str:
+    """Case- and whitespace-insensitive ontology key."""
+    return " ".join(str(term).split()).lower()
+
+
+class AllergenOntology:
+    """Synonyms plus a class hierarchy, with the transitive closure precomputed."""
+
+    def __init__(self, edges: Optional[pd.DataFrame] = None, drug_classes: Optional[pd.DataFrame] = None):
+        """
+        Args:
+            edges: Rows of term, relation (synonym / is_a), target
+            drug_classes: Optional rows of drug_class, drug (read as drug is_a class)
+        """
+        self._synonyms: Dict[str, str] = {}
+        children: Dict[str, Set[str]] = {}
+        is_a: List[tuple] = []
+
+        if edges is not None and not edges.empty:
+            for term, relation, target in edges[["term", "relation", "target"]].itertuples(index=False):
+                relation = normalize_term(relation)
+                if relation == "synonym":
+                    self._synonyms[normalize_term(term)] = normalize_term(target)
+                elif relation == "is_a":
+                    is_a.append((term, target))
+                else:
+                    raise ValueError(f"Unknown allergen relation '{relation}' for '{term}'")
+        if drug_classes is not None and not drug_classes.empty:
+            is_a.extend(drug_classes[["drug", "drug_class"]].itertuples(index=False, name=None))
+
+        for term, target in is_a:
+            children.setdefault(self.canonical(target), set()).add(self.canonical(term))
+
+        self.concepts: FrozenSet[str] = frozenset(children) | frozenset(
+            member for members in children.values() for member in members
+        ) | frozenset(self._synonyms.values())
+        self._closure: Dict[str, FrozenSet[str]] = {}
+        for concept in self.concepts:
+            self._closure[concept] = self._descendants(concept, children)
+
+    def canonical(self, term) -> str:
+        """Preferred name for ``term`` (synonym chains followed)."""
+        name = normalize_term(term)
+        seen = set()
+        while name in self._synonyms and name not in seen:
+            seen.add(name)
+            name = self._synonyms[name]
+        return name
+
+    @staticmethod
+    def _descendants(concept: str, children: Dict[str, Set[str]]) -> FrozenSet[str]:
+        found = {concept}
+        stack = [concept]
+        while stack:
+            for child in children.get(stack.pop(), ()):
+                if child not in found:
+                    found.add(child)
+                    stack.append(child)
+        return frozenset(found)
+
+    def expand(self, allergy) -> FrozenSet[str]:
+        """Every concept an allergy to ``allergy`` covers (itself and all descendants)."""
+        concept = self.canonical(allergy)
+        return self._closure.get(concept, frozenset((concept,)))
+
+
+class AllergenIndex:
+    """
+    Allergen -> excluded catalog rows, as Python int bitsets.
+
+    Closure bitsets for every ontology concept are built up front. The
+    free-text part (drug-name substrings) needs a catalog scan, so it is
+    compiled per allergy string on first use and memoized.
+    """
+
+    MAX_CACHED_TERMS = 4096
+
+    def __init__(self, ontology: AllergenOntology, medicines: MedicineIndex):
+        self.ontology = ontology
+        self.medicines = medicines
+
+        # Concepts each catalog row can be excluded through
+        concept_rows: Dict[str, Set[int]] = {}
+        for row in range(len(medicines)):
+            concepts = {ontology.canonical(medicines.drug_names[row])}
+            for raw in medicines.contraindications[row]:
+                concepts.update(
+                    ontology.canonical(token) for token in re.split(r"[\s,]+", raw) if token and token != NO_ALLERGEN
+                )
+            for concept in concepts:
+                concept_rows.setdefault(concept, set()).add(row)
+        self._concept_bits: Dict[str, int] = {
+            concept: AvailabilityBitsets.rows_to_bits(rows) for concept, rows in concept_rows.items()
+        }
+        # Transitive closure folded into one bitset per class/concept
+        self._closure_bits: Dict[str, int] = {
+            concept: self._closure(concept) for concept in ontology.concepts
+        }
+
+        self._term_bits: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _closure(self, term: str) -> int:
+        bits = 0
+        for concept in self.ontology.expand(term):
+            bits |= self._concept_bits.get(concept, 0)
+        return bits
+
+    def _compile(self, term: str) -> int:
+        concept = self.ontology.canonical(term)
+        bits = self._closure_bits.get(concept)
+        if bits is None:
+            bits = self._concept_bits.get(concept, 0)
+
+        # Original free-text rules: exact comma-separated keyword, or drug-name substring
+        keyword_rows = self.medicines.contra_rows.get(term)
+        if keyword_rows is not None:
+            bits |= AvailabilityBitsets.rows_to_bits(keyword_rows.tolist())
+        bits |= AvailabilityBitsets.rows_to_bits(
+            row for row, name in enumerate(self.medicines.drug_names) if term in str(name).lower()
+        )
+        return bits
+
+    def bits(self, allergy) -> int:
+        """Bitset of catalog rows an allergy excludes ("none" excludes nothing)."""
+        term = str(allergy).lower()
+        if normalize_term(term) == NO_ALLERGEN:
+            return 0
+        bits = self._term_bits.get(term)
+        if bits is None:
+            bits = self._compile(term)
+            if len(self._term_bits) < self.MAX_CACHED_TERMS:
+                with self._lock:
+                    self._term_bits[term] = bits
+        return bits
+
+    def excluded_bits(self, allergies: Iterable) -> int:
+        """OR of the bitsets of all ``allergies``."""
+        bits = 0
+        for allergy in allergies:
+            bits |= self.bits(allergy)
+        return bits
+
+    def keep_mask(self, rows: np.ndarray, allergies: Sequence) -> np.ndarray:
+        """Boolean mask over ``rows``: True where no allergy excludes the row."""
+        rows = np.asarray(rows, dtype=np.int64)
+        excluded = self.excluded_bits(allergies)
+        if not excluded or not rows.size:
+            return np.ones(rows.size, dtype=bool)
+        return ~np.isin(rows, AvailabilityBitsets.bits_to_rows(excluded))
+
+    def first_conflict(self, row: int, allergies: Sequence) -> Optional[str]:
+        """The first allergy (as given) that excludes ``row``, if any."""
+        for allergy in allergies:
+            if self.bits(allergy) >> row & 1:
+                return allergy
+        return None
@@ -0,0 +1,179 @@
+"""
+Process-wide store of reference tables and derived indexes.
+Location: utils/data_store.py
+
+One DataStore per data folder owns the parsed tables (pharmacies, inventory,
+meds, interactions, doctors, zipcodes) and any index built from them. Agents
+receive it by injection instead of each reading ``data_dir`` themselves.
+
+Loading is lazy and thread-safe: the first caller for a table or derived
+index builds it while concurrent callers for the same key wait, and later
+callers get the cached object. Call :meth:`DataStore.preload` before a
+pre-forking server (``gunicorn --preload``) forks its workers so the tables
+are shared copy-on-write instead of being loaded again in every worker.
+
+Tables are shared between agents and must be treated as read-only.
+"""
+
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import pandas as pd
+
+from utils.geo_utils import PincodeDirectory, load_pincode_directory
+from utils.snapshot import SNAPSHOT_SOURCES, load_table, read_source
+
+
+class DataStore:
+    """Lazily loaded, shared reference data for one ``data_dir``."""
+
+    _shared: Dict[str, "DataStore"] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, data_dir="./data", log_callback: Optional[Callable] = None):
+        self.data_dir = Path(data_dir)
+        self.log_callback = log_callback
+        self._tables: Dict[str, pd.DataFrame] = {}
+        self._fingerprints: Dict[str, Optional[Tuple[int, int]]] = {}
+        self._derived: Dict[Hashable, Tuple[Any, Any]] = {}
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+
+    @classmethod
+    def shared(cls, data_dir="./data", log_callback: Optional[Callable] = None) -> "DataStore":
+        """The process-wide store for ``data_dir`` (created on first use)."""
+        key = str(Path(data_dir).resolve())
+        with cls._shared_lock:
+            store = cls._shared.get(key)
+            if store is None:
+                store = cls._shared[key] = cls(data_dir, log_callback)
+            return store
+
+    def _key_lock(self, key: Hashable) -> threading.Lock:
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    def source_path(self, name: str) -> Path:
+        return self.data_dir / SNAPSHOT_SOURCES[name]
+
+    def _source_fingerprint(self, name: str) -> Optional[Tuple[int, int]]:
+        try:
+            stat = self.source_path(name).stat()
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def table_version(self, name: str) -> Optional[Tuple[int, int]]:
+        """Source (mtime, size) of the loaded table, for keying derived objects."""
+        self.table(name)
+        return self._fingerprints.get(name)
+
+    def source_version(self, name: str) -> Optional[Tuple[int, int]]:
+        """Current source (mtime, size) of a table, without loading it."""
+        return self._source_fingerprint(name)
+
+    def peek(self, name: str) -> pd.DataFrame:
+        """
+        The table's contents without caching them in the store.
+
+        For one-off derived builds over a table whose owner keeps its own
+        copy and has invalidated the store's (e.g. the pharmacy inventory):
+        the cached frame is reused if present, but a reload is not kept.
+        """
+        frame = self._tables.get(name)
+        if frame is not None:
+            return frame
+        frame = load_table(self.data_dir, name)
+        return frame if frame is not None else read_source(self.data_dir, name)
+
+    def has_table(self, name: str) -> bool:
+        """True if the table's source file exists."""
+        return self.source_path(name).exists()
+
+    def table(self, name: str) -> pd.DataFrame:
+        """
+        Shared DataFrame for a reference table (snapshot first, then CSV/JSON).
+
+        Raises:
+            FileNotFoundError: If the table's source file does not exist
+        """
+        frame = self._tables.get(name)
+        if frame is not None:
+            return frame
+
+        with self._key_lock(("table", name)):
+            frame = self._tables.get(name)
+            if frame is None:
+                if not self.has_table(name):
+                    raise FileNotFoundError(f"Data file not found: {self.source_path(name)}")
+                fingerprint = self._source_fingerprint(name)
+                frame = load_table(self.data_dir, name)
+                origin = "snapshot"
+                if frame is None:
+                    frame = read_source(self.data_dir, name)
+                    origin = SNAPSHOT_SOURCES[name]
+                self._tables[name] = frame
+                self._fingerprints[name] = fingerprint
+                self._log("INFO", f"Loaded {len(frame)} {name} from {origin}")
+            return frame
+
+    @property
+    def pincodes(self) -> PincodeDirectory:
+        """Pincode directory for this folder's zipcodes.csv."""
+        return load_pincode_directory(self.source_path("zipcodes"))
+
+    def derived(self, key: Hashable, factory: Callable[[], Any], version: Hashable = None) -> Any:
+        """
+        Shared derived object (index, matrix, ...) built once by ``factory``.
+
+        If ``version`` differs from the version the cached object was built
+        for (e.g. a source-file fingerprint), it is rebuilt.
+        """
+        entry = self._derived.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+
+        with self._key_lock(("derived", key)):
+            entry = self._derived.get(key)
+            if entry is None or entry[0] != version:
+                entry = (version, factory())
+                self._derived[key] = entry
+            return entry[1]
+
+    def invalidate(self, *names: str) -> None:
+        """Drop cached tables so the next access reloads them from disk."""
+        with self._lock:
+            for name in names:
+                self._tables.pop(name, None)
+                self._fingerprints.pop(name, None)
+
+    def refresh(self, *names: str) -> bool:
+        """
+        Invalidate any of ``names`` whose source file changed since it was loaded.
+
+        Returns:
+            True if at least one table was invalidated
+        """
+        stale = [
+            name for name in names
+            if name in self._tables and self._fingerprints.get(name) != self._source_fingerprint(name)
+        ]
+        if stale:
+            self.invalidate(*stale)
+        return bool(stale)
+
+    def preload(self) -> "DataStore":
+        """Load every table whose source exists, plus the pincode directory."""
+        for name in SNAPSHOT_SOURCES:
+            if self.has_table(name):
+                self.table(name)
+        _ = self.pincodes
+        return self
+
+    def _log(self, level: str, message: str) -> None:
+        if self.log_callback:
+            self.log_callback("DataStore", level, message)
@@ -0,0 +1,403 @@
+"""
+Geospatial helpers shared by the pharmacy matching code.
+Location: utils/geo_utils.py
+
+Array helpers take destination columns that are already in radians so the
+conversion is paid once when a table is loaded, not on every request.
+"""
+
+import math
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import DEFAULT_LOCATION, GEO_CONFIG, ZIPCODES_FILE
+from utils.snapshot import SNAPSHOT_SOURCES, load_table
+
+EARTH_RADIUS_KM = float(GEO_CONFIG["earth_radius_km"])
+
+
+def to_radians(lat: float, lon: float) -> Tuple[float, float]:
+    """Convert a single (lat, lon) pair from degrees to radians."""
+    return math.radians(lat), math.radians(lon)
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance in kilometres between two points given in degrees."""
+    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+    return 2 * math.asin(math.sqrt(a)) * EARTH_RADIUS_KM
+
+
+def haversine_km_many(
+    lat: float,
+    lon: float,
+    lats_rad: np.ndarray,
+    lons_rad: np.ndarray,
+) -> np.ndarray:
+    """
+    Distance in kilometres from one point to many points in a single pass.
+
+    Args:
+        lat, lon: Origin in degrees
+        lats_rad, lons_rad: Destination columns in radians
+
+    Returns:
+        float64 array of distances aligned with the destination columns
+    """
+    lat_rad, lon_rad = to_radians(lat, lon)
+    dlat = lats_rad - lat_rad
+    dlon = lons_rad - lon_rad
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat_rad) * np.cos(lats_rad) * np.sin(dlon / 2) ** 2
+    return 2 * np.arcsin(np.sqrt(np.minimum(a, 1.0))) * EARTH_RADIUS_KM
+
+
+KM_PER_DEGREE_LAT = EARTH_RADIUS_KM * math.pi / 180.0
+
+
+class GridQueryResult(NamedTuple):
+    """Rows found by a radius query, ordered by row index."""
+
+    indices: np.ndarray
+    distances_km: np.ndarray
+    searched_radius_km: float
+    cells_visited: int
+
+
+class SpatialGridIndex:
+    """
+    Uniform lat/lon grid over a fixed set of points.
+
+    Each point lives in exactly one cell. Radius queries only touch the cells
+    whose bounding box overlaps the search disk and grow that disk ring by ring
+    until enough candidates are found, so per-query cost depends on local
+    density rather than on the size of the table.
+
+    Optional per-point attributes (``verified``, ``rating``, ``services``) are
+    stored as columns so filters are applied inside the index, before any
+    distance is computed.
+    """
+
+    def __init__(
+        self,
+        lats_deg: np.ndarray,
+        lons_deg: np.ndarray,
+        reach_km: Optional[np.ndarray] = None,
+        cell_deg: float = 0.05,
+        verified: Optional[np.ndarray] = None,
+        rating: Optional[np.ndarray] = None,
+        services: Optional[Sequence[Iterable[str]]] = None,
+    ):
+        """
+        Build the grid.
+
+        Args:
+            lats_deg, lons_deg: Point coordinates in degrees
+            reach_km: Optional per-point maximum distance (e.g. delivery radius)
+            cell_deg: Cell edge length in degrees (0.05° ≈ 5.5 km of latitude)
+            verified: Optional boolean column for the ``verified_only`` filter
+            rating: Optional numeric column for the ``min_rating`` filter
+            services: Optional per-point service lists for ``required_services``
+        """
+        lats = np.asarray(lats_deg, dtype=np.float64)
+        lons = np.asarray(lons_deg, dtype=np.float64)
+        size = lats.size
+
+        self.cell_deg = float(cell_deg)
+        self.size = size
+        self._lats_rad = np.ascontiguousarray(np.radians(lats))
+        self._lons_rad = np.ascontiguousarray(np.radians(lons))
+        self._reach_km = (
+            np.full(size, np.inf) if reach_km is None
+            else np.ascontiguousarray(reach_km, dtype=np.float64)
+        )
+
+        self._verified = None if verified is None else np.asarray(verified, dtype=bool)
+        self._rating = None if rating is None else np.asarray(rating, dtype=np.float32)
+        self.service_bits: Dict[str, int] = {}
+        self._service_masks = None
+        if services is not None:
+            masks = np.zeros(size, dtype=np.int64)
+            for row, row_services in enumerate(services):
+                for service in row_services or []:
+                    key = str(service).lower()
+                    bit = self.service_bits.setdefault(key, 1 << len(self.service_bits))
+                    masks[row] |= bit
+            self._service_masks = masks
+
+        rows = np.floor(lats / self.cell_deg).astype(np.int64)
+        cols = np.floor(lons / self.cell_deg).astype(np.int64)
+        self._cells: Dict[Tuple[int, int], np.ndarray] = {}
+        if size:
+            order = np.lexsort((cols, rows))
+            keys = np.stack([rows[order], cols[order]], axis=1)
+            starts = np.flatnonzero(np.any(np.diff(keys, axis=0) != 0, axis=1)) + 1
+            for chunk in np.split(order, starts):
+                first = chunk[0]
+                self._cells[(int(rows[first]), int(cols[first]))] = np.sort(chunk)
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def cell_count(self) -> int:
+        """Number of non-empty cells."""
+        return len(self._cells)
+
+    def services_mask(self, required_services: Optional[Iterable[str]]) -> Optional[int]:
+        """Encode required services as a bitmask; None if a service is unknown."""
+        mask = 0
+        for service in required_services or []:
+            bit = self.service_bits.get(str(service).lower())
+            if bit is None:
+                return None
+            mask |= bit
+        return mask
+
+    def filter_mask(
+        self,
+        indices: np.ndarray,
+        verified_only: bool = False,
+        min_rating: Optional[float] = None,
+        required_services: Optional[Iterable[str]] = None,
+    ) -> np.ndarray:
+        """Boolean mask over ``indices`` for rows passing the pushdown filters."""
+        keep = np.ones(indices.size, dtype=bool)
+        if verified_only and self._verified is not None:
+            keep &= self._verified[indices]
+        if min_rating is not None and self._rating is not None:
+            keep &= self._rating[indices] >= min_rating
+        if required_services:
+            required = self.services_mask(required_services)
+            if required is None or self._service_masks is None:
+                return np.zeros(indices.size, dtype=bool)
+            keep &= (self._service_masks[indices] & required) == required
+        return keep
+
+    def query(
+        self,
+        lat: float,
+        lon: float,
+        radius_km: float,
+        min_results: Optional[int] = None,
+        initial_radius_km: Optional[float] = None,
+        verified_only: bool = False,
+        min_rating: Optional[float] = None,
+        required_services: Optional[Iterable[str]] = None,
+    ) -> GridQueryResult:
+        """
+        Find points within ``min(radius_km, reach_km)`` of (lat, lon).
+
+        The search starts with a disk of ``initial_radius_km`` and doubles it
+        (capped at ``radius_km``) while fewer than ``min_results`` points are in
+        range. The returned set is exact for ``searched_radius_km``; with
+        ``min_results=None`` the full ``radius_km`` disk is always searched.
+        """
+        radius_km = float(radius_km)
+        current = radius_km if min_results is None else min(radius_km, initial_radius_km or radius_km)
+
+        visited = set()
+        found_idx: List[np.ndarray] = []
+        found_km: List[np.ndarray] = []
+
+        while True:
+            new_cells = [key for key in self._cells_overlapping(lat, lon, current) if key not in visited]
+            visited.update(new_cells)
+            if new_cells:
+                idx = np.concatenate([self._cells[key] for key in new_cells])
+                idx = idx[self.filter_mask(idx, verified_only, min_rating, required_services)]
+                found_idx.append(idx)
+                found_km.append(haversine_km_many(lat, lon, self._lats_rad[idx], self._lons_rad[idx]))
+
+            indices = np.concatenate(found_idx) if found_idx else np.empty(0, dtype=np.int64)
+            distances = np.concatenate(found_km) if found_km else np.empty(0, dtype=np.float64)
+            in_range = distances <= np.minimum(current, self._reach_km[indices])
+
+            if current >= radius_km or (min_results is not None and in_range.sum() >= min_results):
+                break
+            current = min(radius_km, current * 2)
+
+        order = np.argsort(indices[in_range], kind="stable")
+        return GridQueryResult(
+            indices=indices[in_range][order],
+            distances_km=distances[in_range][order],
+            searched_radius_km=current,
+            cells_visited=len(visited),
+        )
+
+    def _cells_overlapping(self, lat: float, lon: float, radius_km: float) -> List[Tuple[int, int]]:
+        """Non-empty cells whose bounding box intersects the search disk."""
+        dlat = radius_km / KM_PER_DEGREE_LAT
+        widest_lat = min(89.9, abs(lat) + dlat)
+        dlon = radius_km / (KM_PER_DEGREE_LAT * math.cos(math.radians(widest_lat)))
+
+        row_min = math.floor((lat - dlat) / self.cell_deg)
+        row_max = math.floor((lat + dlat) / self.cell_deg)
+        col_min = math.floor((lon - dlon) / self.cell_deg)
+        col_max = math.floor((lon + dlon) / self.cell_deg)
+
+        span = (row_max - row_min + 1) * (col_max - col_min + 1)
+        if span > len(self._cells):
+            return [
+                key for key in self._cells
+                if row_min <= key[0] <= row_max and col_min <= key[1] <= col_max
+            ]
+        return [
+            (row, col)
+            for row in range(row_min, row_max + 1)
+            for col in range(col_min, col_max + 1)
+            if (row, col) in self._cells
+        ]
+
+
+class PincodeRecord(NamedTuple):
+    """One row of zipcodes.csv."""
+
+    pincode: str
+    lat: float
+    lon: float
+    city: str
+    district: str
+    area: str
+
+    @property
+    def coords(self) -> Tuple[float, float]:
+        return self.lat, self.lon
+
+
+class PincodeLookup(NamedTuple):
+    """Result of :meth:`PincodeDirectory.resolve`; ``found`` is False for the default fallback."""
+
+    record: PincodeRecord
+    found: bool
+
+    @property
+    def coords(self) -> Tuple[float, float]:
+        return self.record.coords
+
+
+DEFAULT_PINCODE_RECORD = PincodeRecord(
+    pincode=str(DEFAULT_LOCATION["pincode"]),
+    lat=float(DEFAULT_LOCATION["lat"]),
+    lon=float(DEFAULT_LOCATION["lon"]),
+    city=str(DEFAULT_LOCATION["city"]),
+    district="",
+    area="",
+)
+
+
+def normalize_pincode(pincode) -> Optional[str]:
+    """Return the pincode as a 6-digit string, or None if it is not one."""
+    if pincode is None or (isinstance(pincode, float) and math.isnan(pincode)):
+        return None
+    if isinstance(pincode, float) and pincode.is_integer():
+        pincode = int(pincode)
+    key = str(pincode).strip()
+    return key if len(key) == 6 and key.isdigit() else None
+
+
+class PincodeDirectory:
+    """
+    Pincode -> :class:`PincodeRecord` hash map built once from zipcodes.csv.
+
+    Keys are 6-digit strings regardless of how the CSV column was parsed.
+    When a pincode appears more than once the first row wins, matching the
+    old ``DataFrame`` filter + ``iloc[0]`` behaviour.
+    """
+
+    def __init__(self, records: Iterable[PincodeRecord] = ()):
+        self._records: Dict[str, PincodeRecord] = {}
+        for record in records:
+            self._records.setdefault(record.pincode, record)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "PincodeDirectory":
+        """Build from a zipcodes DataFrame (rows without a valid pincode or coordinates are skipped)."""
+        if df is None or df.empty:
+            return cls()
+
+        def column(name):
+            values = df[name] if name in df else pd.Series("", index=df.index)
+            return values.fillna("").astype(str).tolist()
+
+        records = []
+        for pincode, lat, lon, city, district, area in zip(
+            df["pincode"].tolist(), df["lat"].tolist(), df["lon"].tolist(),
+            column("city"), column("district"), column("area"),
+        ):
+            key = normalize_pincode(pincode)
+            if key is None or pd.isna(lat) or pd.isna(lon):
+                continue
+            records.append(PincodeRecord(key, float(lat), float(lon), city, district, area))
+        return cls(records)
+
+    @classmethod
+    def from_csv(cls, path) -> "PincodeDirectory":
+        return cls.from_frame(pd.read_csv(path, dtype={"pincode": str}))
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __contains__(self, pincode) -> bool:
+        key = normalize_pincode(pincode)
+        return key is not None and key in self._records
+
+    def __iter__(self):
+        return iter(self._records.values())
+
+    def get(self, pincode) -> Optional[PincodeRecord]:
+        """Record for ``pincode`` or None."""
+        key = normalize_pincode(pincode)
+        return None if key is None else self._records.get(key)
+
+    def resolve(self, pincode, default: PincodeRecord = DEFAULT_PINCODE_RECORD) -> PincodeLookup:
+        """Record for ``pincode``, falling back to ``default`` with ``found=False``."""
+        record = self.get(pincode)
+        if record is None:
+            return PincodeLookup(default, False)
+        return PincodeLookup(record, True)
+
+    def to_frame(self) -> pd.DataFrame:
+        """Records as a DataFrame with string pincodes, in load order."""
+        return pd.DataFrame(list(self._records.values()), columns=PincodeRecord._fields)
+
+
+_DIRECTORY_CACHE: Dict[str, Tuple[Tuple[int, int], PincodeDirectory]] = {}
+_DIRECTORY_LOCK = threading.Lock()
+
+
+def load_pincode_directory(path=ZIPCODES_FILE) -> PincodeDirectory:
+    """
+    Shared, process-wide pincode directory for ``path``.
+
+    The parsed directory is reused until the file's (mtime, size) changes, so
+    agents, the Streamlit app and the data scripts all read the CSV once.
+    A missing file yields an empty directory.
+    """
+    path = Path(path)
+    try:
+        stat = path.stat()
+    except OSError:
+        return PincodeDirectory()
+
+    key = str(path.resolve())
+    fingerprint = (stat.st_mtime_ns, stat.st_size)
+    with _DIRECTORY_LOCK:
+        cached = _DIRECTORY_CACHE.get(key)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+        frame = load_table(path.parent, "zipcodes") if path.name == SNAPSHOT_SOURCES["zipcodes"] else None
+        directory = PincodeDirectory.from_csv(path) if frame is None else PincodeDirectory.from_frame(frame)
+        _DIRECTORY_CACHE[key] = (fingerprint, directory)
+        return directory
+
+
+def get_coordinates_for_pincode(pincode, path=ZIPCODES_FILE) -> Optional[Tuple[float, float]]:
+    """(lat, lon) for ``pincode`` from the shared directory, or None if unknown."""
+    record = load_pincode_directory(path).get(pincode)
+    return None if record is None else record.coords
@@ -0,0 +1,233 @@
+"""
+Uploaded image held in memory for the whole pipeline.
+Location: utils/image_artifact.py
+
+An X-ray used to be read from disk by every stage: ingestion copied it and
+reopened it to verify, imaging decoded it, and hashed it again for its
+seed. An ImageArtifact is built once at ingestion instead. The upload is
+read in chunks, with its content hashes updated as each chunk arrives,
+into one immutable buffer exposed as a memoryview. Later stages decode
+from that buffer, and the grayscale pixel array is decoded at most once.
+
+``working_grayscale`` decodes large images at a bounded resolution instead:
+JPEGs at a reduced DCT scale (``Image.draft``), then an integer box
+reduction (``Image.reduce``). Where only the box reduction runs (PNG and
+other non-JPEG input), each output pixel is the mean of a block of input
+pixels, rounded to 8 bits, so
+
+- the mean moves by at most 0.5 plus the weight of the partial blocks on
+  the right/bottom edge (zero when the factor divides the size);
+- min/max, and so contrast, can only move inwards, and the standard
+  deviation shrinks by the pixel-level noise that is averaged away;
+- dark/bright ratios change only through pixels whose block mean lands on
+  the other side of a threshold.
+
+"Inwards" is not "close": isolated extreme pixels average away, so contrast
+can drop by tens of levels on noisy scans. For JPEGs none of the above is a
+guarantee, because ``draft`` scales in the DCT domain and carries the
+codec's own error. The deltas are measured instead. tests/test_coordinator.py
+checks both paths against the full-resolution decode of a synthetic
+radiograph, and benchmark_imaging.py reports them on large inputs.
+
+``histogram`` is the 256-bin intensity histogram of the working image,
+computed in one pass over the uint8 pixels. It determines every global
+intensity statistic, so feature code reads it instead of re-scanning the
+array.
+"""
+
+import hashlib
+import io
+import math
+import threading
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional, Union
+
+import numpy as np
+from PIL import Image
+
+CHUNK_SIZE = 1 << 16
+# Pixels per np.bincount call (bincount widens its input to intp, 8 bytes/pixel)
+HISTOGRAM_CHUNK = 1 << 20
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+
+def grayscale_histogram(pixels: np.ndarray) -> np.ndarray:
+    """256-bin histogram (int64 counts) of a uint8 pixel array, in one pass."""
+    flat = np.ravel(pixels)
+    histogram = np.zeros(256, dtype=np.int64)
+    for start in range(0, flat.size, HISTOGRAM_CHUNK):
+        histogram += np.bincount(flat[start:start + HISTOGRAM_CHUNK], minlength=256)
+    return histogram
+
+
+class ImageArtifact:
+    """Raw bytes, content hashes and lazily decoded grayscale of one image."""
+
+    def __init__(
+        self,
+        data: BytesLike,
+        name: str = "",
+        path: Optional[Path] = None,
+        sha256: Optional[str] = None,
+        sha1: Optional[str] = None,
+    ):
+        """
+        Args:
+            data: Encoded image bytes
+            name: Original file name (for the extension)
+            path: Where the bytes are persisted, if anywhere
+            sha256: Precomputed SHA-256 hex digest of ``data``
+            sha1: Precomputed SHA-1 hex digest of ``data``
+        """
+        # bytes(...) of a bytes object is the object itself, not a copy
+        self._buffer = bytes(data)
+        self.data = memoryview(self._buffer)
+        self.name = name
+        self.path = Path(path) if path is not None else None
+        if sha256 is None or sha1 is None:
+            sha256, sha1 = self._digest(self.data)
+        self.sha256 = sha256
+        self.sha1 = sha1
+        self._grayscale: Optional[np.ndarray] = None
+        self._reduced: Dict[int, np.ndarray] = {}
+        self._histograms: Dict[int, np.ndarray] = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _digest(data: memoryview):
+        sha256, sha1 = hashlib.sha256(), hashlib.sha1()
+        for start in range(0, len(data), CHUNK_SIZE):
+            chunk = data[start:start + CHUNK_SIZE]
+            sha256.update(chunk)
+            sha1.update(chunk)
+        return sha256.hexdigest(), sha1.hexdigest()
+
+    @classmethod
+    def from_stream(cls, stream: BinaryIO, name: str = "", max_bytes: Optional[int] = None) -> "ImageArtifact":
+        """
+        Read ``stream`` to the end, hashing each chunk as it is read.
+
+        Raises:
+            ValueError: If the stream is longer than ``max_bytes``
+        """
+        chunks = []
+        size = 0
+        sha256, sha1 = hashlib.sha256(), hashlib.sha1()
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if max_bytes is not None and size > max_bytes:
+                raise ValueError(f"Uploaded file exceeds {max_bytes // (1024 * 1024)}MB limit")
+            chunks.append(chunk)
+            sha256.update(chunk)
+            sha1.update(chunk)
+        return cls(b"".join(chunks), name=name, sha256=sha256.hexdigest(), sha1=sha1.hexdigest())
+
+    @classmethod
+    def from_path(cls, path: Union[str, Path], max_bytes: Optional[int] = None) -> "ImageArtifact":
+        """Artifact for a file on disk (read once, in chunks)."""
+        path = Path(path)
+        with open(path, "rb") as handle:
+            artifact = cls.from_stream(handle, name=path.name, max_bytes=max_bytes)
+        artifact.path = path
+        return artifact
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __repr__(self) -> str:
+        return f"ImageArtifact(name={self.name!r}, bytes={len(self)}, sha256={self.sha256[:12]})"
+
+    @property
+    def suffix(self) -> str:
+        return Path(self.name).suffix.lower() if self.name else ""
+
+    @property
+    def seed(self) -> int:
+        """Stable integer seed derived from the content (first 32 bits of the SHA-1)."""
+        return int(self.sha1[:8], 16)
+
+    def open(self) -> Image.Image:
+        """PIL image over the in-memory bytes (nothing is read from disk)."""
+        return Image.open(io.BytesIO(self._buffer))
+
+    def verify(self) -> None:
+        """
+        Check that the bytes are a readable image.
+
+        Raises:
+            Exception: Whatever PIL raises for a truncated or corrupt file
+        """
+        with self.open() as image:
+            image.verify()
+
+    @property
+    def grayscale(self) -> np.ndarray:
+        """8-bit grayscale pixels, decoded on first access and then reused (read-only)."""
+        if self._grayscale is None:
+            with self._lock:
+                if self._grayscale is None:
+                    with self.open() as image:
+                        array = np.asarray(image.convert("L"), dtype=np.uint8)
+                    array.setflags(write=False)
+                    self._grayscale = array
+        return self._grayscale
+
+    def working_grayscale(self, max_side: Optional[int]) -> np.ndarray:
+        """
+        8-bit grayscale whose longer side is at most ``max_side`` (cached per bound).
+
+        Images already within the bound, or a falsy ``max_side``, give the
+        full-resolution ``grayscale``.
+        """
+        if not max_side:
+            return self.grayscale
+        array = self._reduced.get(max_side)
+        if array is not None:
+            return array
+
+        with self._lock:
+            array = self._reduced.get(max_side)
+            if array is None:
+                array = self._decode_reduced(int(max_side))
+                self._reduced[max_side] = array
+        return array
+
+    def histogram(self, max_side: Optional[int] = None) -> np.ndarray:
+        """256-bin histogram of ``working_grayscale(max_side)`` (cached, read-only)."""
+        key = max_side or 0
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = grayscale_histogram(self.working_grayscale(max_side))
+                    histogram.setflags(write=False)
+                    self._histograms[key] = histogram
+        return histogram
+
+    def _decode_reduced(self, max_side: int) -> np.ndarray:
+        with self.open() as image:
+            width, height = image.size
+            longest = max(width, height)
+            if longest <= max_side:
+                return self.grayscale
+            # JPEG only: decode straight to the smallest DCT scale still >= the target
+            image.draft("L", (math.ceil(width * max_side / longest), math.ceil(height * max_side / longest)))
+            gray = image.convert("L")
+        factor = math.ceil(max(gray.size) / max_side)
+        if factor > 1:
+            gray = gray.reduce(factor)
+        array = np.asarray(gray, dtype=np.uint8)
+        array.setflags(write=False)
+        return array
+
+    def write_to(self, destination: Union[str, Path]) -> Path:
+        """Persist the bytes to ``destination`` and remember it as ``path``."""
+        destination = Path(destination)
+        destination.write_bytes(self.data)
+        self.path = destination
+        return destination
@@ -0,0 +1,192 @@
+"""
+Hashed drug-interaction lookup.
+Location: utils/interaction_index.py
+
+interactions.csv lists (drug_a, drug_b, level, note) rows. Checking a pair
+used to filter the whole table; here the rows are loaded once into a dict
+keyed on the normalized unordered pair, so a check is one hash lookup no
+matter how large the interaction database grows.
+
+A pair may carry several interactions (kept in file order). Either side of
+a row may name a drug class from drug_classes.csv (e.g. "NSAID"); such rows
+are expanded to every member drug, and the class name itself stays a key
+so a medication list that says "NSAID" still matches.
+
+``SkuInteractionGraph`` projects the index onto catalog SKUs as an
+adjacency matrix of interaction levels, so a whole recommended basket is
+screened with one submatrix lookup.
+"""
+
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+PairKey = Tuple[str, str]
+
+# Adjacency matrix cell values (0 = no known interaction)
+LEVEL_CODES = {"mild": 1, "moderate": 2, "high": 3, "severe": 4}
+
+
+def normalize_drug(name) -> str:
+    """Case- and whitespace-insensitive drug key."""
+    return " ".join(str(name).split()).lower()
+
+
+def pair_key(drug_a, drug_b) -> PairKey:
+    """Order-independent key for a drug pair."""
+    a, b = normalize_drug(drug_a), normalize_drug(drug_b)
+    return (a, b) if a <= b else (b, a)
+
+
+class Interaction(NamedTuple):
+    """One interaction row, as it applies to a looked-up pair."""
+
+    drug_a: str
+    drug_b: str
+    level: str
+    note: str
+    row: int
+    via_class: Optional[str] = None
+
+
+class InteractionIndex:
+    """Unordered drug pair -> interactions."""
+
+    def __init__(self, interactions: pd.DataFrame, drug_classes: Optional[pd.DataFrame] = None):
+        """
+        Args:
+            interactions: Rows of drug_a, drug_b, level, note
+            drug_classes: Optional rows of drug_class, drug
+        """
+        self.class_members: Dict[str, List[str]] = {}
+        if drug_classes is not None and not drug_classes.empty:
+            for drug_class, drug in drug_classes[["drug_class", "drug"]].itertuples(index=False):
+                members = self.class_members.setdefault(normalize_drug(drug_class), [])
+                if normalize_drug(drug) not in members:
+                    members.append(normalize_drug(drug))
+
+        self._pairs: Dict[PairKey, List[Interaction]] = {}
+        self.rows = 0
+        if interactions is None or interactions.empty:
+            return
+
+        columns = interactions[["drug_a", "drug_b", "level", "note"]].itertuples(index=False)
+        for row, (drug_a, drug_b, level, note) in enumerate(columns):
+            self.rows += 1
+            seen: Set[PairKey] = set()
+            for side_a, class_a in self._expand(drug_a):
+                for side_b, class_b in self._expand(drug_b):
+                    key = pair_key(side_a, side_b)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    self._pairs.setdefault(key, []).append(
+                        Interaction(str(drug_a), str(drug_b), str(level), str(note), row, class_a or class_b)
+                    )
+
+    def _expand(self, drug) -> Iterable[Tuple[str, Optional[str]]]:
+        """The drug itself, plus its members (tagged with the class) if it names a class."""
+        name = normalize_drug(drug)
+        yield name, None
+        for member in self.class_members.get(name, ()):
+            yield member, str(drug)
+
+    def __len__(self) -> int:
+        return len(self._pairs)
+
+    def items(self) -> Iterable[Tuple[PairKey, List[Interaction]]]:
+        return self._pairs.items()
+
+    def lookup(self, drug_a, drug_b) -> List[Interaction]:
+        """Interactions recorded for the pair, in file order (empty if none)."""
+        return self._pairs.get(pair_key(drug_a, drug_b), [])
+
+
+class SkuInteractionGraph:
+    """
+    Interaction levels between catalog SKUs as a symmetric adjacency matrix.
+
+    Only SKUs that take part in some interaction get a matrix row, so the
+    matrix stays small for a large formulary; one extra all-zero row/column
+    at the end lets every other SKU be encoded as ``-1``. Cells hold the
+    highest LEVEL_CODES value over all interactions for the pair.
+    """
+
+    def __init__(self, index: InteractionIndex, drug_names: Sequence):
+        """
+        Args:
+            index: Pair-keyed interaction index
+            drug_names: Drug name per catalog row (the SKU order)
+        """
+        name_rows: Dict[str, List[int]] = {}
+        for row, name in enumerate(drug_names):
+            name_rows.setdefault(normalize_drug(name), []).append(row)
+
+        edges: List[Tuple[int, int, int]] = []
+        for (a, b), entries in index.items():
+            rows_a, rows_b = name_rows.get(a), name_rows.get(b)
+            if not rows_a or not rows_b:
+                continue
+            level = max(LEVEL_CODES.get(normalize_drug(entry.level), 1) for entry in entries)
+            edges.extend((i, j, level) for i in rows_a for j in rows_b if i != j)
+
+        involved = sorted({row for i, j, _ in edges for row in (i, j)})
+        self.node_of_row = np.full(len(drug_names) + 1, -1, dtype=np.int64)
+        self.node_of_row[involved] = np.arange(len(involved))
+        self.levels = np.zeros((len(involved) + 1, len(involved) + 1), dtype=np.int8)
+        for i, j, level in edges:
+            a, b = self.node_of_row[i], self.node_of_row[j]
+            self.levels[a, b] = self.levels[b, a] = max(self.levels[a, b], level)
+
+    @property
+    def node_count(self) -> int:
+        return self.levels.shape[0] - 1
+
+    def submatrix(self, rows: Sequence[int]) -> np.ndarray:
+        """Interaction levels among the given catalog rows."""
+        nodes = self.node_of_row[np.asarray(rows, dtype=np.int64)]
+        return self.levels[np.ix_(nodes, nodes)]
+
+    def conflicts(self, rows: Sequence[int], min_level: int = 1) -> List[Tuple[int, int, int]]:
+        """(row_a, row_b, level) for every pair in ``rows`` at or above ``min_level``."""
+        rows = list(rows)
+        if len(rows) < 2:
+            return []
+        block = np.triu(self.submatrix(rows), k=1)
+        first, second = np.nonzero(block >= min_level)
+        return [(rows[i], rows[j], int(block[i, j])) for i, j in zip(first, second)]
+
+    def select_compatible(
+        self,
+        candidates: Iterable[int],
+        limit: int,
+        min_level: int
+    ) -> Tuple[List[int], List[Tuple[int, int]]]:
+        """
+        Greedily keep candidates (in order) that do not conflict with those already kept.
+
+        Args:
+            candidates: Catalog rows, best first
+            limit: Basket size
+            min_level: Interactions at or above this level are conflicts
+
+        Returns:
+            (selected rows, [(skipped row, conflicting selected row), ...])
+        """
+        selected: List[int] = []
+        skipped: List[Tuple[int, int]] = []
+        # blocked[node] is the selected row it conflicts with, or -1
+        blocked = np.full(self.levels.shape[0], -1, dtype=np.int64)
+        for row in candidates:
+            node = self.node_of_row[row]
+            if node >= 0:
+                if blocked[node] >= 0:
+                    skipped.append((row, int(blocked[node])))
+                    continue
+                newly = (self.levels[node] >= min_level) & (blocked < 0)
+                blocked[newly] = row
+            selected.append(row)
+            if len(selected) >= limit:
+                break
+        return selected, skipped
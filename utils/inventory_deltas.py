@@ -0,0 +1,185 @@
+"""
+Incremental inventory updates for the pharmacy matcher.
+Location: utils/inventory_deltas.py
+
+A delta names one (pharmacy_id, sku) cell and either an absolute quantity
+(``qty``) or a change (``qty_delta``), optionally with a new ``price``.
+Deltas arrive through the API or as NDJSON/CSV files dropped into an inbox
+folder; they are applied in place to the StockMatrix so readers never wait
+for a reload, and the accumulated state is compacted back to
+``inventory.csv`` from time to time.
+"""
+
+import csv
+import io
+import json
+import math
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+DELTA_FILE_SUFFIXES = (".ndjson", ".jsonl", ".csv")
+# Quantities are stored in an int32 matrix
+QTY_LIMIT = 2 ** 31 - 1
+
+
+class InventoryDelta(NamedTuple):
+    """One inventory change. Exactly one of ``qty`` / ``qty_delta`` is set, or only ``price``."""
+
+    pharmacy_id: str
+    sku: str
+    qty: Optional[int] = None
+    qty_delta: Optional[int] = None
+    price: Optional[float] = None
+
+
+def _is_blank(value) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _optional_quantity(value, field: str) -> Optional[int]:
+    """Whole number within +/- QTY_LIMIT ("3", 3, 3.0 are fine; 2.7, inf, 2**40 are not)."""
+    if _is_blank(value):
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"{field} must be a whole number")
+    if isinstance(value, int):
+        number = value
+    else:
+        text = str(value).strip()
+        try:
+            number = int(text)
+        except ValueError:
+            parsed = float(text)
+            if not math.isfinite(parsed) or not parsed.is_integer():
+                raise ValueError(f"{field} must be a whole number, got {value!r}")
+            number = int(parsed)
+    if abs(number) > QTY_LIMIT:
+        raise ValueError(f"{field} {number} is out of range (limit {QTY_LIMIT})")
+    return number
+
+
+def _optional_price(value) -> Optional[float]:
+    if _is_blank(value):
+        return None
+    price = float(value)
+    if not math.isfinite(price):
+        raise ValueError(f"price must be finite, got {value!r}")
+    return price
+
+
+def parse_delta(record: Dict) -> InventoryDelta:
+    """
+    Validate one delta record (a dict from JSON or a CSV row).
+
+    Accepts ``qty`` / ``qty_available`` for absolute quantities and
+    ``qty_delta`` / ``delta`` for changes.
+
+    Raises:
+        ValueError: If identifiers are missing, a quantity is not a whole
+            number within the int32 range, or the quantity fields conflict
+    """
+    pharmacy_id = str(record.get("pharmacy_id") or "").strip()
+    sku = str(record.get("sku") or "").strip()
+    if not pharmacy_id or not sku:
+        raise ValueError("delta needs pharmacy_id and sku")
+
+    qty = _optional_quantity(record.get("qty", record.get("qty_available")), "qty")
+    qty_delta = _optional_quantity(record.get("qty_delta", record.get("delta")), "qty_delta")
+    price = _optional_price(record.get("price"))
+
+    if qty is not None and qty_delta is not None:
+        raise ValueError(f"delta for {pharmacy_id}/{sku} sets both qty and qty_delta")
+    if qty is None and qty_delta is None and price is None:
+        raise ValueError(f"delta for {pharmacy_id}/{sku} changes nothing")
+    if qty is not None and qty < 0:
+        raise ValueError(f"delta for {pharmacy_id}/{sku} has negative qty")
+    if price is not None and price < 0:
+        raise ValueError(f"delta for {pharmacy_id}/{sku} has negative price")
+
+    return InventoryDelta(pharmacy_id, sku, qty, qty_delta, price)
+
+
+def parse_delta_text(text: str, fmt: str) -> Tuple[List[InventoryDelta], List[str]]:
+    """
+    Parse NDJSON (``fmt="ndjson"``) or CSV (``fmt="csv"``) delta text.
+
+    Returns:
+        (deltas, errors) - malformed lines are reported, not fatal
+    """
+    deltas: List[InventoryDelta] = []
+    errors: List[str] = []
+
+    if fmt == "csv":
+        rows: Iterable = enumerate(csv.DictReader(io.StringIO(text)), start=2)
+    else:
+        rows = (
+            (number, line) for number, line in enumerate(text.splitlines(), start=1) if line.strip()
+        )
+
+    for number, row in rows:
+        try:
+            record = json.loads(row) if isinstance(row, str) else row
+            if not isinstance(record, dict):
+                raise ValueError("expected an object")
+            deltas.append(parse_delta(record))
+        except (ValueError, TypeError, OverflowError) as exc:  # json.JSONDecodeError is a ValueError
+            errors.append(f"line {number}: {exc}")
+    return deltas, errors
+
+
+def read_delta_file(path) -> Tuple[List[InventoryDelta], List[str]]:
+    """Parse a dropped ``.ndjson``/``.jsonl``/``.csv`` delta file."""
+    path = Path(path)
+    fmt = "csv" if path.suffix.lower() == ".csv" else "ndjson"
+    return parse_delta_text(path.read_text(encoding="utf-8"), fmt)
+
+
+class DeltaInbox:
+    """
+    File-drop folder for delta files.
+
+    ``pending()`` lists complete files oldest first (names starting with
+    ``.`` or ``~`` are treated as still being written). After a file is
+    applied it is moved to ``processed/``, or to ``failed/`` if nothing in it
+    could be parsed or applying it raised.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def pending(self) -> List[Path]:
+        if not self.directory.is_dir():
+            return []
+        files = [
+            path for path in self.directory.iterdir()
+            if path.is_file()
+            and path.suffix.lower() in DELTA_FILE_SUFFIXES
+            and not path.name.startswith((".", "~"))
+        ]
+        return sorted(files, key=lambda path: (path.stat().st_mtime_ns, path.name))
+
+    def archive(self, path: Path, failed: bool = False) -> Path:
+        target_dir = self.directory / ("failed" if failed else "processed")
+        target_dir.mkdir(exist_ok=True)
+        target = target_dir / path.name
+        shutil.move(str(path), str(target))
+        return target
+
+
+def write_csv_atomic(path, header: List[str], rows: Iterable[Iterable]) -> None:
+    """Write a CSV next to ``path`` and rename it into place."""
+    path = Path(path)
+    fd, tmp_name = tempfile.mkstemp(prefix=f".{path.stem}-", suffix=".csv", dir=str(path.parent))
+    try:
+        with os.fdopen(fd, "w", newline="", encoding="utf-8") as handle:
+            writer = csv.writer(handle)
+            writer.writerow(header)
+            writer.writerows(rows)
+        os.replace(tmp_name, path)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
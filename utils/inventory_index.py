@@ -0,0 +1,297 @@
+"""
+Dense inventory structures for the pharmacy matching code.
+Location: utils/inventory_index.py
+
+inventory.csv is a long table of (pharmacy_id, sku, qty_available, price)
+rows. Matching needs "how much of each required SKU does each candidate
+pharmacy hold", so the table is pivoted once into a pharmacy × SKU matrix
+and every request becomes a fancy-indexing lookup.
+"""
+
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# Largest quantity a StockMatrix cell holds (qty is int32)
+QTY_MAX = int(np.iinfo(np.int32).max)
+
+
+def encode_categorical(values: pd.Series, categories: Sequence[str] = ()) -> pd.Series:
+    """
+    Dictionary-encode a string column as a pandas categorical.
+
+    ``categories`` come first (e.g. the StockMatrix row or column order) so
+    tables encoded against the same list share one dictionary; values not in
+    it are appended in order of appearance.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype) and not len(categories):
+        return values
+    strings = values.astype(str)
+    dictionary = list(dict.fromkeys([str(value) for value in categories] + strings.dropna().unique().tolist()))
+    return pd.Series(pd.Categorical(strings, categories=dictionary), index=values.index, name=values.name)
+
+
+def encode_frame(frame: pd.DataFrame, columns: Dict[str, Sequence[str]]) -> pd.DataFrame:
+    """Copy of ``frame`` with each of ``columns`` (name -> leading categories) dictionary-encoded."""
+    encoded = frame.copy()
+    for column, categories in columns.items():
+        if column in encoded:
+            encoded[column] = encode_categorical(encoded[column], categories)
+    return encoded
+
+
+def lookup_codes(values: pd.Series, lookup: Dict[str, int]) -> np.ndarray:
+    """
+    Map a column to integer codes through ``lookup`` (-1 for unknown values).
+
+    Only the distinct values go through the dict; rows are then mapped with
+    one integer gather on the categorical codes.
+    """
+    encoded = encode_categorical(values)
+    per_category = np.fromiter(
+        (lookup.get(str(value), -1) for value in encoded.cat.categories),
+        dtype=np.int64,
+        count=len(encoded.cat.categories),
+    )
+    # Code -1 (missing) picks the trailing -1
+    return np.append(per_category, -1)[encoded.cat.codes.to_numpy()]
+
+
+def frame_memory_bytes(frame: pd.DataFrame, decoded: bool = False) -> int:
+    """
+    Deep memory footprint of a frame in bytes.
+
+    With ``decoded=True`` categorical columns are measured as plain string
+    columns, i.e. the footprint the frame would have without encoding.
+    """
+    if decoded:
+        categorical = [name for name in frame.columns if isinstance(frame[name].dtype, pd.CategoricalDtype)]
+        if categorical:
+            frame = frame.astype({name: str for name in categorical})
+    return int(frame.memory_usage(deep=True, index=True).sum())
+
+
+class AvailabilityBitsets:
+    """
+    "In stock" flags of a StockMatrix packed into Python int bitsets.
+
+    ``sku_bits[j]`` has bit ``i`` set when pharmacy row ``i`` holds SKU ``j``;
+    ``pharmacy_bits[i]`` is the transpose. A full-basket match is an AND of
+    SKU bitsets and the number of basket SKUs a pharmacy covers is the
+    popcount of its row bitset masked by the basket, so neither touches the
+    inventory rows.
+    """
+
+    def __init__(self, available: np.ndarray):
+        """
+        Args:
+            available: Boolean (pharmacies, skus) matrix of "qty > 0"
+        """
+        pharmacies, skus = available.shape
+        # Writers only: readers never lock, Python int swaps are atomic
+        self._lock = threading.Lock()
+        self.sku_bits: List[int] = [self._pack(available[:, j]) for j in range(skus)]
+        self.pharmacy_bits: List[int] = [self._pack(available[i, :]) for i in range(pharmacies)]
+
+    @staticmethod
+    def _pack(flags: np.ndarray) -> int:
+        return int.from_bytes(np.packbits(flags, bitorder="little").tobytes(), "little")
+
+    @staticmethod
+    def rows_to_bits(rows: Iterable[int]) -> int:
+        """Bitset with the given (non-negative) row numbers set."""
+        bits = 0
+        for row in rows:
+            if row >= 0:
+                bits |= 1 << int(row)
+        return bits
+
+    @staticmethod
+    def bits_to_rows(bits: int) -> np.ndarray:
+        """Row numbers set in ``bits``, ascending."""
+        if bits <= 0:
+            return np.empty(0, dtype=np.int64)
+        raw = np.frombuffer(bits.to_bytes((bits.bit_length() + 7) // 8, "little"), dtype=np.uint8)
+        return np.flatnonzero(np.unpackbits(raw, bitorder="little"))
+
+    def set(self, row: int, col: int, available: bool) -> None:
+        """Keep both bitset directions in sync with one matrix cell."""
+        with self._lock:
+            if available:
+                self.sku_bits[col] |= 1 << row
+                self.pharmacy_bits[row] |= 1 << col
+            else:
+                self.sku_bits[col] &= ~(1 << row)
+                self.pharmacy_bits[row] &= ~(1 << col)
+
+    def basket_mask(self, cols: Iterable[int]) -> int:
+        """Bitset over SKU columns for a basket (unknown columns ignored)."""
+        return self.rows_to_bits(cols)
+
+    def full_basket(self, cols: Sequence[int], candidates: Optional[int] = None) -> int:
+        """Bitset of pharmacies stocking every SKU in ``cols``, optionally ∩ ``candidates``."""
+        if len(cols) == 0 or any(col < 0 for col in cols):
+            return 0
+        bits = self.sku_bits[cols[0]] if candidates is None else candidates & self.sku_bits[cols[0]]
+        for col in cols[1:]:
+            if not bits:
+                break
+            bits &= self.sku_bits[col]
+        return bits
+
+    def coverage_counts(self, rows: Sequence[int], cols: Iterable[int]) -> np.ndarray:
+        """Number of basket SKUs each pharmacy row holds (popcount)."""
+        basket = self.basket_mask(cols)
+        return np.fromiter(
+            ((self.pharmacy_bits[row] & basket).bit_count() if row >= 0 else 0 for row in rows),
+            dtype=np.int32,
+        )
+
+
+class StockMatrix:
+    """
+    Pharmacy × SKU matrices of quantity (int32) and unit price (float32).
+
+    Rows follow the order of ``pharmacy_ids`` (the pharmacy table order) and
+    columns follow ``skus``. One extra all-zero row and column are kept at
+    the end so unknown IDs can be encoded as ``-1`` and still be indexed
+    safely: they read as "no stock".
+    """
+
+    def __init__(self, pharmacy_ids: Sequence[str], skus: Sequence[str]):
+        self.pharmacy_ids: List[str] = [str(pid) for pid in pharmacy_ids]
+        self.skus: List[str] = [str(sku) for sku in skus]
+        self.pharmacy_index: Dict[str, int] = {pid: i for i, pid in enumerate(self.pharmacy_ids)}
+        self.sku_index: Dict[str, int] = {sku: j for j, sku in enumerate(self.skus)}
+
+        shape = (len(self.pharmacy_ids) + 1, len(self.skus) + 1)
+        self.qty = np.zeros(shape, dtype=np.int32)
+        self.price = np.zeros(shape, dtype=np.float32)
+        # Cells that appear in inventory.csv (a listed SKU may be at qty 0)
+        self.listed = np.zeros(shape, dtype=bool)
+        self.unmatched_rows = 0
+        # Bumped once per applied batch of inventory deltas
+        self.version = 0
+        self.availability = AvailabilityBitsets(self.qty[:-1, :-1] > 0)
+
+        # Catalog attributes per SKU column (joined from meds.csv)
+        self.drug_name: List[str] = list(self.skus)
+        self.form: List[str] = [""] * len(self.skus)
+        self.strength: List[str] = [""] * len(self.skus)
+
+    @classmethod
+    def from_frames(
+        cls,
+        inventory: pd.DataFrame,
+        pharmacy_ids: Sequence[str],
+        medicines: Optional[pd.DataFrame] = None,
+    ) -> "StockMatrix":
+        """
+        Pivot the inventory table into a dense matrix.
+
+        Args:
+            inventory: Rows of pharmacy_id, sku, qty_available, price
+            pharmacy_ids: Pharmacy IDs in row order
+            medicines: Optional meds.csv frame for drug_name/form/strength
+
+        Returns:
+            StockMatrix covering every catalog and inventory SKU
+        """
+        catalog_skus = [] if medicines is None or medicines.empty else medicines["sku"].astype(str).tolist()
+        inventory_skus = encode_categorical(inventory["sku"]).cat.categories.tolist() if not inventory.empty else []
+        skus = list(dict.fromkeys(catalog_skus + inventory_skus))
+
+        matrix = cls(pharmacy_ids, skus)
+
+        if not inventory.empty:
+            rows = lookup_codes(inventory["pharmacy_id"], matrix.pharmacy_index)
+            cols = lookup_codes(inventory["sku"], matrix.sku_index)
+            known = rows >= 0
+            matrix.qty[rows[known], cols[known]] = (
+                inventory["qty_available"].fillna(0).to_numpy(dtype=np.int32)[known]
+            )
+            matrix.price[rows[known], cols[known]] = (
+                inventory["price"].fillna(0).to_numpy(dtype=np.float32)[known]
+            )
+            matrix.listed[rows[known], cols[known]] = True
+            matrix.unmatched_rows = int((~known).sum())
+
+        if medicines is not None and not medicines.empty:
+            catalog = medicines.drop_duplicates("sku").set_index(medicines["sku"].astype(str))
+            for column, target in (("drug_name", matrix.drug_name), ("form", matrix.form), ("strength", matrix.strength)):
+                if column not in catalog:
+                    continue
+                values = catalog[column]
+                for j, sku in enumerate(matrix.skus):
+                    if sku in values.index and not pd.isna(values[sku]):
+                        target[j] = str(values[sku])
+
+        matrix.availability = AvailabilityBitsets(matrix.qty[:-1, :-1] > 0)
+        return matrix
+
+    @property
+    def shape(self) -> tuple:
+        """(pharmacies, skus) excluding the padding row/column."""
+        return len(self.pharmacy_ids), len(self.skus)
+
+    def pharmacy_codes(self, pharmacy_ids) -> np.ndarray:
+        """Row codes for pharmacy IDs (-1 for unknown IDs)."""
+        lookup = self.pharmacy_index
+        return np.fromiter((lookup.get(str(pid), -1) for pid in pharmacy_ids), dtype=np.int64)
+
+    def sku_codes(self, skus) -> np.ndarray:
+        """Column codes for SKUs (-1 for unknown SKUs)."""
+        lookup = self.sku_index
+        return np.fromiter((lookup.get(str(sku), -1) for sku in skus), dtype=np.int64)
+
+    def block(self, rows: np.ndarray, cols: np.ndarray):
+        """
+        Quantity and price sub-matrices for the given rows and columns.
+
+        Returns:
+            (qty, price) arrays of shape (len(rows), len(cols))
+        """
+        grid = np.ix_(rows, cols)
+        return self.qty[grid], self.price[grid]
+
+    def set_stock(self, row: int, col: int, qty: int, price: Optional[float] = None) -> None:
+        """Set one cell and keep the availability bitsets in sync."""
+        self.qty[row, col] = qty
+        if price is not None:
+            self.price[row, col] = price
+        self.availability.set(row, col, qty > 0)
+
+    def apply_delta(
+        self,
+        row: int,
+        col: int,
+        qty: Optional[int] = None,
+        qty_delta: Optional[int] = None,
+        price: Optional[float] = None,
+    ) -> int:
+        """
+        Apply one inventory delta in place (absolute ``qty`` or ``qty_delta``).
+
+        Quantities are clamped to [0, int32 max]. Returns the new quantity.
+        """
+        current = int(self.qty[row, col])
+        if qty is not None:
+            current = int(qty)
+        elif qty_delta is not None:
+            current += int(qty_delta)
+        current = min(max(0, current), QTY_MAX)
+        self.set_stock(row, col, current, price)
+        self.listed[row, col] = True
+        return current
+
+    def to_frame(self) -> pd.DataFrame:
+        """Listed cells as an inventory.csv-shaped frame (pharmacy_id, sku, qty_available, price)."""
+        rows, cols = np.nonzero(self.listed[:-1, :-1])
+        return pd.DataFrame({
+            "pharmacy_id": np.asarray(self.pharmacy_ids, dtype=object)[rows],
+            "sku": np.asarray(self.skus, dtype=object)[cols],
+            "qty_available": self.qty[rows, cols].astype(np.int64),
+            "price": np.round(self.price[rows, cols].astype(np.float64), 2),
+        })
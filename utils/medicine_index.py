@@ -0,0 +1,275 @@
+"""
+Precomputed lookup structures over the OTC medicine catalog.
+Location: utils/medicine_index.py
+
+TherapyAgent matches a condition's indication phrases against each
+medicine's ``indication`` text, then drops medicines the patient is too
+young for or allergic to. With a formulary of tens of thousands of SKUs a
+per-request scan of meds.csv is too slow, so the catalog is indexed once:
+
+- an inverted index from indication token to catalog rows, which narrows a
+  phrase to the few rows that can contain it before the substring check;
+- ``age_min`` as a NumPy array, so the age rule is one vectorized compare;
+- contraindication keywords pre-split into per-row sets plus an inverted
+  keyword -> rows index for the allergy rule.
+
+``RelevanceScorer`` ranks the catalog for a whole ``condition_probs``
+vector instead of only the most likely condition.
+
+Matching rules are exactly those of the original row scan: an indication
+phrase matches when it is a substring of the lower-cased indication text,
+and an allergy excludes a medicine when it equals one of its
+comma-separated contraindication keywords or is a substring of its name.
+"""
+
+import threading
+from itertools import islice
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+class MedicineIndex:
+    """Inverted indication / contraindication index over a meds.csv frame."""
+
+    def __init__(self, meds: pd.DataFrame):
+        self.skus: List = meds["sku"].tolist()
+        self.sku_rows: Dict[str, int] = {str(sku): row for row, sku in enumerate(self.skus)}
+        self.drug_names: List = meds["drug_name"].tolist()
+        self.indications: List = meds["indication"].tolist()
+        self.age_min = meds["age_min"].to_numpy(dtype=np.float64)
+
+        self._indication_text = [str(value).lower() for value in self.indications]
+        self._drug_name_text = [str(value).lower() for value in self.drug_names]
+
+        # Keywords are split on commas, stripped, and kept in file order
+        self.contraindications: List[List[str]] = [
+            [keyword.strip() for keyword in str(value).lower().split(",")]
+            for value in meds["contra_allergy_keywords"].tolist()
+        ]
+        self._contra_sets: List[FrozenSet[str]] = [frozenset(keywords) for keywords in self.contraindications]
+
+        self.token_rows: Dict[str, np.ndarray] = self._invert(text.split() for text in self._indication_text)
+        self.contra_rows: Dict[str, np.ndarray] = self._invert(self.contraindications)
+
+        self._phrase_cache: Dict[Tuple[str, ...], np.ndarray] = {}
+        self._cache_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.skus)
+
+    @staticmethod
+    def _invert(tokens_per_row: Iterable[Iterable[str]]) -> Dict[str, np.ndarray]:
+        postings: Dict[str, List[int]] = {}
+        for row, tokens in enumerate(tokens_per_row):
+            for token in dict.fromkeys(tokens):
+                postings.setdefault(token, []).append(row)
+        return {token: np.asarray(rows, dtype=np.int64) for token, rows in postings.items()}
+
+    def _rows_with_substring(self, fragment: str) -> np.ndarray:
+        """Rows having an indication token that contains ``fragment``."""
+        matches = [rows for token, rows in self.token_rows.items() if fragment in token]
+        if not matches:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(matches))
+
+    def _phrase_rows(self, phrase: str) -> np.ndarray:
+        """Rows whose lower-cased indication contains ``phrase``."""
+        words = phrase.split()
+        if not words or phrase != " ".join(words):
+            # Leading/trailing/repeated whitespace: the token index cannot narrow it
+            return np.asarray(
+                [row for row, text in enumerate(self._indication_text) if phrase in text],
+                dtype=np.int64,
+            )
+
+        # Each word of the phrase lies inside some indication token
+        candidates = self._rows_with_substring(words[0])
+        for word in words[1:]:
+            if not candidates.size:
+                break
+            candidates = np.intersect1d(candidates, self._rows_with_substring(word), assume_unique=True)
+        if len(words) == 1:
+            return candidates
+        return candidates[[phrase in self._indication_text[row] for row in candidates]]
+
+    def rows_for_indications(self, phrases: Sequence[str]) -> np.ndarray:
+        """
+        Catalog rows matching any of ``phrases``, in catalog order.
+
+        The union for a given phrase list is computed once and cached.
+        """
+        key = tuple(phrases)
+        rows = self._phrase_cache.get(key)
+        if rows is None:
+            parts = [self._phrase_rows(phrase) for phrase in key]
+            rows = np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+            with self._cache_lock:
+                self._phrase_cache[key] = rows
+        return rows
+
+    def suitable(
+        self,
+        phrases: Sequence[str],
+        patient_age: float,
+        allergies: Sequence[str] = (),
+        limit: Optional[int] = None
+    ) -> List[int]:
+        """
+        Rows treating ``phrases`` that pass the age and allergy rules.
+
+        Args:
+            phrases: Indication phrases for the condition
+            patient_age: Patient age in years
+            allergies: Patient allergy names
+            limit: Stop after this many rows
+
+        Returns:
+            Catalog rows in catalog order
+        """
+        return list(islice(self.iter_suitable(phrases, patient_age, allergies), limit))
+
+    def iter_suitable(
+        self,
+        phrases: Sequence[str],
+        patient_age: float,
+        allergies: Sequence[str] = ()
+    ) -> Iterator[int]:
+        """Lazy form of ``suitable``: the per-row name check runs only as far as consumed."""
+        return self.eligible(self.rows_for_indications(phrases), patient_age, allergies)
+
+    def eligible(
+        self,
+        rows: np.ndarray,
+        patient_age: float,
+        allergies: Sequence[str] = (),
+        allergens=None
+    ) -> Iterator[int]:
+        """
+        Rows (in the given order) that pass the age and allergy rules.
+
+        With an ``allergens`` index (utils.allergen_ontology.AllergenIndex)
+        the allergy rule is its precomputed bitsets instead of the
+        free-text checks below.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if rows.size:
+            # Written as "not younger than" so a missing age_min never excludes
+            rows = rows[~(patient_age < self.age_min[rows])]
+
+        if allergens is not None:
+            if allergies and rows.size:
+                rows = rows[allergens.keep_mask(rows, allergies)]
+            yield from rows.tolist()
+            return
+
+        allergy_keys = [str(allergy).lower() for allergy in allergies]
+        if allergy_keys and rows.size:
+            blocked = [self.contra_rows[key] for key in allergy_keys if key in self.contra_rows]
+            if blocked:
+                rows = rows[~np.isin(rows, np.concatenate(blocked))]
+
+        for row in rows.tolist():
+            name = self._drug_name_text[row]
+            if any(key in name for key in allergy_keys):
+                continue
+            yield row
+
+
+class RelevanceScorer:
+    """
+    Probability-weighted relevance of every catalog SKU.
+
+    ``condition_weights`` (conditions × indication phrases) marks the
+    phrases each condition is treated for; ``sku_phrases`` (SKUs ×
+    phrases) marks the phrases each SKU's indication matches, under the
+    same substring rule as MedicineIndex. For condition probabilities ``p``
+    the SKU scores are ``sku_phrases @ (condition_weights.T @ p)``: the
+    expected number of the patient's indications a medicine covers.
+    """
+
+    def __init__(self, index: MedicineIndex, condition_map: Dict[str, Sequence[str]]):
+        """
+        Args:
+            index: Catalog index (defines SKU rows and phrase matching)
+            condition_map: Condition -> indication phrases
+        """
+        self.conditions: List[str] = list(condition_map)
+        self.condition_rows: Dict[str, int] = {name: i for i, name in enumerate(self.conditions)}
+        self.phrases: List[str] = list(dict.fromkeys(p for phrases in condition_map.values() for p in phrases))
+        phrase_cols = {phrase: j for j, phrase in enumerate(self.phrases)}
+
+        self.condition_weights = np.zeros((len(self.conditions), len(self.phrases)), dtype=np.float32)
+        for i, name in enumerate(self.conditions):
+            for phrase in condition_map[name]:
+                self.condition_weights[i, phrase_cols[phrase]] = 1.0
+
+        self.sku_phrases = np.zeros((len(index), len(self.phrases)), dtype=np.float32)
+        for j, phrase in enumerate(self.phrases):
+            self.sku_phrases[index.rows_for_indications([phrase]), j] = 1.0
+
+    def probability_vector(self, condition_probs: Dict[str, float]) -> np.ndarray:
+        """Condition probabilities in scorer order (unknown conditions ignored)."""
+        probs = np.zeros(len(self.conditions), dtype=np.float32)
+        for name, prob in condition_probs.items():
+            row = self.condition_rows.get(name)
+            if row is not None:
+                probs[row] = float(prob)
+        return probs
+
+    def scores(self, condition_probs: Dict[str, float]) -> np.ndarray:
+        """Relevance score per catalog row."""
+        phrase_weights = self.condition_weights.T @ self.probability_vector(condition_probs)
+        return self.sku_phrases @ phrase_weights
+
+    @staticmethod
+    def ranked(scores: np.ndarray, window: int) -> Iterator[np.ndarray]:
+        """
+        Rows with a positive score, best first (ties in catalog order), in chunks.
+
+        The first chunk holds the top ``window`` rows from an argpartition
+        selection; the remainder is only sorted if a caller consumes past it.
+        """
+        rows = np.flatnonzero(scores > 0)
+        if rows.size > window:
+            # Everything scoring at least the window-th best (ties included)
+            threshold = np.partition(scores[rows], rows.size - window)[rows.size - window]
+            head = rows[scores[rows] >= threshold]
+            rest = rows[scores[rows] < threshold]
+        else:
+            head, rest = rows, rows[:0]
+        for part in (head, rest):
+            # lexsort's last key is primary: score descending, then row
+            if part.size:
+                yield part[np.lexsort((part, -scores[part]))]
+
+
+class RankedRows:
+    """
+    One pass over ``RelevanceScorer.ranked`` that records how far it was read.
+
+    Only the head window is selected and sorted up front. A consumer that
+    stops inside it (the common case) never sorts the rest. In that case
+    its outcome is a function of ``head`` alone, which is what plan caches
+    key on.
+    """
+
+    def __init__(self, scores: np.ndarray, window: int):
+        self._chunks = RelevanceScorer.ranked(scores, window)
+        self.head: np.ndarray = next(self._chunks, np.empty(0, dtype=np.intp))
+        # Every positive row is in the head: nothing past it can change an outcome
+        self.complete = self.head.size == np.count_nonzero(scores > 0)
+        self.past_head = False
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        """Chunks best first; single use."""
+        yield self.head
+        # Only reached once the consumer asks for more than the head
+        self.past_head = True
+        yield from self._chunks
+
+    @property
+    def decided_by_head(self) -> bool:
+        """True if everything read so far is determined by ``head``."""
+        return self.complete or not self.past_head
@@ -0,0 +1,85 @@
+"""
+Per-request randomness and clock for the agent pipeline.
+Location: utils/request_context.py
+
+Agents used to draw from the global ``random`` module, so identical inputs
+never produced identical outputs and concurrent requests shared (and
+reseeded) one generator. A RequestContext is created once per pipeline run
+and handed to every agent: all random draws, generated IDs and timestamps
+of that run come from it, and nothing touches module-level state.
+
+In deterministic mode the seed is fixed (``SYSTEM_CONFIG["deterministic_seed"]``
+unless given) and the clock is frozen at the context's start instant, so
+identical inputs against identical data give byte-identical results.
+Deterministic contexts are meant for replay and tests, not live traffic:
+their clock is frozen (pass ``now`` to replay a recorded instant), and the
+pharmacy agent only previews stock holds for them instead of taking any.
+"""
+
+import random
+import secrets
+from datetime import datetime
+from typing import Dict, Optional
+
+from config import SYSTEM_CONFIG
+
+# Frozen clock of deterministic contexts (unless an explicit start is given)
+DETERMINISTIC_EPOCH = datetime(2025, 1, 1)
+
+
+class RequestContext:
+    """Seeded RNG plus clock shared by all agents handling one request."""
+
+    def __init__(self, seed: Optional[int] = None, deterministic: bool = False, now: Optional[datetime] = None):
+        """
+        Args:
+            seed: RNG seed; drawn from the OS when omitted (unless deterministic)
+            deterministic: Freeze the clock and default to the configured seed
+            now: Start instant (defaults to DETERMINISTIC_EPOCH or the wall clock)
+        """
+        if seed is None:
+            seed = SYSTEM_CONFIG["deterministic_seed"] if deterministic else secrets.randbits(64)
+        self.seed = int(seed)
+        self.deterministic = bool(deterministic)
+        self.rng = random.Random(self.seed)
+        self.started_at = now or (DETERMINISTIC_EPOCH if self.deterministic else datetime.now())
+
+    @classmethod
+    def create(cls, seed: Optional[int] = None, deterministic: Optional[bool] = None) -> "RequestContext":
+        """New context; deterministic mode follows SYSTEM_CONFIG unless given."""
+        if deterministic is None:
+            deterministic = SYSTEM_CONFIG["deterministic_mode"]
+        return cls(seed=seed, deterministic=deterministic)
+
+    @classmethod
+    def ensure(cls, context: Optional["RequestContext"]) -> "RequestContext":
+        """``context`` itself, or a fresh one for callers that did not pass one."""
+        return context if context is not None else cls.create()
+
+    def now(self) -> datetime:
+        """Current time (the start instant in deterministic mode)."""
+        return self.started_at if self.deterministic else datetime.now()
+
+    def epoch(self) -> float:
+        """``now()`` as epoch seconds, for components keyed on ``time.time()``."""
+        return self.now().timestamp()
+
+    def timestamp(self) -> str:
+        return self.now().isoformat()
+
+    def stamp(self, result: Dict) -> Dict:
+        """Set ``result["timestamp"]`` from this context's clock and return it."""
+        result["timestamp"] = self.timestamp()
+        return result
+
+    def randint(self, low: int, high: int) -> int:
+        """Random integer in [low, high] from the request's RNG."""
+        return self.rng.randint(low, high)
+
+    def numeric_id(self, prefix: str, digits: int) -> str:
+        """``prefix`` followed by a random ``digits``-digit number (no leading zero)."""
+        return f"{prefix}{self.rng.randint(10 ** (digits - 1), 10 ** digits - 1)}"
+
+    def hex_id(self, prefix: str, length: int) -> str:
+        """``prefix`` followed by ``length`` random upper-case hex digits."""
+        return f"{prefix}{self.rng.getrandbits(4 * length):0{length}X}"
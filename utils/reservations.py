@@ -0,0 +1,332 @@
+"""
+In-memory reservation ledger for pharmacy stock.
+Location: utils/reservations.py
+
+Holds are tracked in a (pharmacy × SKU) ``held`` matrix that mirrors a
+StockMatrix, so available-to-promise (ATP) stock is ``qty - held``. Each
+pharmacy row is guarded by one of a fixed set of striped locks: requests
+for different pharmacies rarely contend and there is no global lock on the
+hold path. Every stripe keeps its own min-heap of expiry times, which the
+sweeper drains once holds pass their TTL.
+"""
+
+import heapq
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.inventory_index import StockMatrix
+
+
+@dataclass
+class Reservation:
+    """Units held at one pharmacy until ``expires_at`` (epoch seconds)."""
+
+    reservation_id: str
+    pharmacy_id: str
+    lines: Dict[str, int]
+    created_at: float
+    expires_at: float
+    status: str = "held"
+
+    @property
+    def total_units(self) -> int:
+        return sum(self.lines.values())
+
+    @property
+    def expires_at_datetime(self) -> datetime:
+        return datetime.fromtimestamp(self.expires_at)
+
+
+@dataclass
+class _Stripe:
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    expiries: List[Tuple[float, str]] = field(default_factory=list)
+
+
+class ReservationLedger:
+    """
+    Thread-safe holds against a StockMatrix with TTL expiry.
+
+    ``hold`` grants at most the ATP quantity per SKU (partial holds are
+    allowed, as the matcher reserves ``min(available, recommended)``),
+    ``release`` returns units, ``commit`` turns a hold into a real stock
+    decrement and ``sweep`` expires overdue holds.
+    """
+
+    def __init__(
+        self,
+        stock: StockMatrix,
+        ttl_seconds: float = 2 * 60 * 60,
+        stripes: int = 64,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.ttl_seconds = float(ttl_seconds)
+        self.clock = clock
+        self._stripes = [_Stripe() for _ in range(max(1, int(stripes)))]
+        self._reservations: Dict[str, Reservation] = {}
+        self._sweeper: Optional[threading.Thread] = None
+        self._sweeper_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._bind(stock)
+
+    def _bind(self, stock: StockMatrix) -> None:
+        self.stock = stock
+        self.held = np.zeros_like(stock.qty)
+
+    def _stripe(self, row: int) -> _Stripe:
+        return self._stripes[row % len(self._stripes)]
+
+    def __len__(self) -> int:
+        return len(self._reservations)
+
+    def _lock_pharmacy(self, pharmacy_id: str) -> Optional[Tuple[int, _Stripe]]:
+        """
+        Acquire the stripe lock of a pharmacy's current row.
+
+        ``rebind`` may renumber rows between the index lookup and the lock,
+        so the lookup is repeated under the lock until it is stable.
+
+        Returns:
+            (row, stripe) with ``stripe.lock`` held, or None (nothing held)
+            if the pharmacy is not in the stock matrix
+        """
+        while True:
+            row = self.stock.pharmacy_index.get(pharmacy_id)
+            if row is None:
+                return None
+            stripe = self._stripe(row)
+            stripe.lock.acquire()
+            if self.stock.pharmacy_index.get(pharmacy_id) == row:
+                return row, stripe
+            stripe.lock.release()
+
+    def row_lock(self, row: int) -> threading.Lock:
+        """Lock guarding one pharmacy row (for in-place stock updates)."""
+        return self._stripe(row).lock
+
+    def get(self, reservation_id: str) -> Optional[Reservation]:
+        return self._reservations.get(reservation_id)
+
+    def available(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        """
+        Available-to-promise block for the given rows and columns.
+
+        Read without locks: the value may be a moment stale, but ``hold``
+        re-checks under the pharmacy's lock before granting anything.
+        """
+        grid = np.ix_(rows, cols)
+        return np.maximum(self.stock.qty[grid] - self.held[grid], 0)
+
+    def hold(
+        self,
+        reservation_id: str,
+        pharmacy_id: str,
+        quantities: Dict[str, int],
+        now: Optional[float] = None,
+    ) -> Optional[Reservation]:
+        """
+        Atomically hold up to ``quantities`` units per SKU at one pharmacy.
+
+        ``now`` (epoch seconds) stamps the hold and its expiry; the ledger's
+        clock is used when omitted.
+
+        Returns:
+            The Reservation with the units actually granted, or None if no
+            unit of any requested SKU is available
+        """
+        return self._grant(reservation_id, str(pharmacy_id), quantities, now, record=True)
+
+    def preview(
+        self,
+        pharmacy_id: str,
+        quantities: Dict[str, int],
+        now: Optional[float] = None,
+    ) -> Optional[Reservation]:
+        """
+        What ``hold`` would grant right now, without holding anything.
+
+        Returns:
+            An unrecorded Reservation (status ``"preview"``, empty ID), or
+            None if no unit of any requested SKU is available
+        """
+        return self._grant("", str(pharmacy_id), quantities, now, record=False)
+
+    def _grant(
+        self,
+        reservation_id: str,
+        pharmacy_id: str,
+        quantities: Dict[str, int],
+        now: Optional[float],
+        record: bool,
+    ) -> Optional[Reservation]:
+        locked = self._lock_pharmacy(pharmacy_id)
+        if locked is None:
+            return None
+
+        row, stripe = locked
+        stock = self.stock
+        now = self.clock() if now is None else now
+        try:
+            self._expire_stripe(stripe, now)
+            granted: Dict[str, int] = {}
+            for sku, wanted in quantities.items():
+                col = stock.sku_index.get(str(sku))
+                if col is None or wanted <= 0:
+                    continue
+                atp = int(stock.qty[row, col]) - int(self.held[row, col])
+                units = min(int(wanted), atp)
+                if units > 0:
+                    if record:
+                        self.held[row, col] += units
+                    granted[str(sku)] = units
+            if not granted:
+                return None
+
+            reservation = Reservation(
+                reservation_id=reservation_id,
+                pharmacy_id=pharmacy_id,
+                lines=granted,
+                created_at=now,
+                expires_at=now + self.ttl_seconds,
+                status="held" if record else "preview",
+            )
+            if record:
+                self._reservations[reservation_id] = reservation
+                heapq.heappush(stripe.expiries, (reservation.expires_at, reservation_id))
+        finally:
+            stripe.lock.release()
+        return reservation
+
+    def release(self, reservation_id: str) -> bool:
+        """Return a held reservation's units to ATP."""
+        return self._close(reservation_id, "released", decrement_stock=False)
+
+    def commit(self, reservation_id: str) -> bool:
+        """Fulfil a held reservation: decrement on-hand stock and drop the hold."""
+        return self._close(reservation_id, "committed", decrement_stock=True)
+
+    def _close(self, reservation_id: str, status: str, decrement_stock: bool) -> bool:
+        reservation = self._reservations.get(reservation_id)
+        if reservation is None:
+            return False
+        locked = self._lock_pharmacy(reservation.pharmacy_id)
+        if locked is None:
+            return False
+        row, stripe = locked
+        try:
+            if reservation.status != "held":
+                return False
+            self._drop(row, reservation, status)
+            if decrement_stock:
+                for sku, units in reservation.lines.items():
+                    col = self.stock.sku_index.get(sku)
+                    if col is not None:
+                        self.stock.set_stock(row, col, max(0, int(self.stock.qty[row, col]) - units))
+        finally:
+            stripe.lock.release()
+        return True
+
+    def _drop(self, row: int, reservation: Reservation, status: str) -> None:
+        """Remove a reservation's holds; caller holds the row's stripe lock."""
+        for sku, units in reservation.lines.items():
+            col = self.stock.sku_index.get(sku)
+            if col is not None:
+                self.held[row, col] = max(0, int(self.held[row, col]) - units)
+        reservation.status = status
+        self._reservations.pop(reservation.reservation_id, None)
+
+    def _expire_stripe(self, stripe: _Stripe, now: float) -> int:
+        """Pop overdue entries from one stripe's heap; caller holds its lock."""
+        expired = 0
+        while stripe.expiries and stripe.expiries[0][0] <= now:
+            _, reservation_id = heapq.heappop(stripe.expiries)
+            reservation = self._reservations.get(reservation_id)
+            if reservation is None or reservation.status != "held":
+                continue  # already released or committed
+            row = self.stock.pharmacy_index.get(reservation.pharmacy_id)
+            if row is not None:
+                self._drop(row, reservation, "expired")
+                expired += 1
+        return expired
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """
+        Expire every overdue hold.
+
+        Stripes whose earliest expiry is still in the future are skipped
+        without taking their lock, so calling this on the request path is cheap.
+
+        Returns:
+            Number of reservations expired
+        """
+        now = self.clock() if now is None else now
+        expired = 0
+        for stripe in self._stripes:
+            expiries = stripe.expiries
+            if not expiries or expiries[0][0] > now:
+                continue
+            with stripe.lock:
+                expired += self._expire_stripe(stripe, now)
+        return expired
+
+    def rebind(self, stock: StockMatrix) -> int:
+        """
+        Point the ledger at a rebuilt StockMatrix, carrying live holds over.
+
+        Holds are keyed by pharmacy ID and SKU, so they survive row/column
+        renumbering. Since a pharmacy's stripe follows its row, every expiry
+        heap is rebuilt for the new numbering while all stripe locks are
+        held. Reservations at pharmacies that disappeared are expired, and
+        lines for SKUs that disappeared stop counting against ATP.
+
+        Returns:
+            Number of reservations expired because their pharmacy is gone
+        """
+        for stripe in self._stripes:
+            stripe.lock.acquire()
+        try:
+            held = np.zeros_like(stock.qty)
+            expiries: List[List[Tuple[float, str]]] = [[] for _ in self._stripes]
+            expired = 0
+            for reservation in list(self._reservations.values()):
+                row = stock.pharmacy_index.get(reservation.pharmacy_id)
+                if row is None:
+                    reservation.status = "expired"
+                    self._reservations.pop(reservation.reservation_id, None)
+                    expired += 1
+                    continue
+                for sku, units in reservation.lines.items():
+                    col = stock.sku_index.get(sku)
+                    if col is not None:
+                        held[row, col] += units
+                expiries[row % len(self._stripes)].append((reservation.expires_at, reservation.reservation_id))
+            for stripe, entries in zip(self._stripes, expiries):
+                heapq.heapify(entries)
+                stripe.expiries = entries
+            self.stock, self.held = stock, held
+            return expired
+        finally:
+            for stripe in self._stripes:
+                stripe.lock.release()
+
+    def start_sweeper(self, interval_seconds: float = 60.0) -> None:
+        """Run ``sweep`` every ``interval_seconds`` on a daemon thread (idempotent)."""
+        with self._sweeper_lock:
+            if self._sweeper is not None and self._sweeper.is_alive():
+                return
+            self._stop.clear()
+
+            def run():
+                while not self._stop.wait(interval_seconds):
+                    self.sweep()
+
+            self._sweeper = threading.Thread(target=run, name="reservation-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def stop_sweeper(self) -> None:
+        self._stop.set()
@@ -0,0 +1,220 @@
+"""
+Content-addressed result cache: bounded LRU in memory, optionally on disk.
+Location: utils/result_cache.py
+
+For results that are pure functions of their key (e.g. an image digest
+plus the metadata and rules version it was analyzed with). The in-memory
+tier is a TTLCache without expiry. With a ``directory``, every result is
+also written there as ``<key>.json``, so it survives restarts: a memory
+miss falls back to the file and promotes it. The directory is bounded
+too; files are touched on every read and the least recently used ones
+are removed once ``max_disk_entries`` is exceeded by a slack of 10%.
+
+The directory is scanned once at startup. After that a running count
+(and byte size) of the files is kept, so writes and ``stats`` never list
+the directory; only a prune does, once per slack's worth of new files,
+and it resynchronises the counters with what is actually on disk.
+
+Keys must be file-name safe (hex digests from ``stable_hash``) and values
+JSON-serializable.
+"""
+
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+from utils.ttl_cache import TTLCache
+
+# Files allowed over ``max_disk_entries`` before a prune, as a fraction of it
+PRUNE_SLACK = 0.1
+
+
+class ResultCache:
+    """Memory LRU in front of an optional directory of JSON files."""
+
+    def __init__(
+        self,
+        maxsize: int = 256,
+        directory: Optional[Union[str, Path]] = None,
+        max_disk_entries: int = 4096,
+    ):
+        """
+        Args:
+            maxsize: Results kept in memory (0 disables caching entirely)
+            directory: Where results are persisted; None keeps them in memory only
+            max_disk_entries: Files kept in ``directory`` before the oldest are pruned
+        """
+        self.memory = TTLCache(maxsize, ttl_seconds=None)
+        self.directory = Path(directory) if directory and maxsize else None
+        self.max_disk_entries = max(1, int(max_disk_entries))
+        self.prune_threshold = self.max_disk_entries + max(1, int(self.max_disk_entries * PRUNE_SLACK))
+        self._lock = threading.Lock()
+        self._prune_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.disk_writes = 0
+        self.disk_errors = 0
+        self.disk_prunes = 0
+        self._disk_count = 0
+        self._disk_bytes = 0
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            entries = self._scan()
+            self._disk_count = len(entries)
+            self._disk_bytes = sum(entry.stat().st_size for entry in entries)
+
+    def __len__(self) -> int:
+        return len(self.memory)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, key: str) -> Any:
+        """Cached result for ``key`` (memory first, then disk), or None."""
+        value = self.memory.get(key)
+        if value is None and self.directory is not None:
+            value = self._read(key)
+            if value is not None:
+                self.memory.put(key, value)
+                with self._lock:
+                    self.disk_hits += 1
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        """Store ``value`` in memory and, if configured, on disk."""
+        self.memory.put(key, value)
+        if self.directory is not None:
+            self._write(key, value)
+
+    def _read(self, key: str) -> Any:
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as handle:
+                value = json.load(handle)
+            os.utime(path)  # Recency for disk pruning
+            return value
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            # Unreadable or half-written file: drop it and recompute
+            with self._lock:
+                self.disk_errors += 1
+            self._unlink(path)
+            return None
+
+    def _write(self, key: str, value: Any) -> None:
+        temporary = None
+        path = self._path(key)
+        try:
+            # Write to a temporary file and rename, so readers never see a partial entry
+            descriptor, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(descriptor, "w", encoding="utf-8") as handle:
+                json.dump(value, handle, ensure_ascii=False)
+            size = os.path.getsize(temporary)
+            try:
+                replaced = os.path.getsize(path)
+            except FileNotFoundError:
+                replaced = None
+            os.replace(temporary, path)
+        except (OSError, TypeError, ValueError):
+            with self._lock:
+                self.disk_errors += 1
+            if temporary is not None:
+                Path(temporary).unlink(missing_ok=True)
+            return
+        with self._lock:
+            self.disk_writes += 1
+            if replaced is None:
+                self._disk_count += 1
+                self._disk_bytes += size
+            else:
+                self._disk_bytes += size - replaced
+            over = self._disk_count > self.prune_threshold
+        if over:
+            self._prune()
+
+    def _scan(self) -> List[os.DirEntry]:
+        return [entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")]
+
+    def _unlink(self, path: Path) -> None:
+        """Remove one persisted result and take it off the running counters."""
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._disk_count = max(0, self._disk_count - 1)
+            self._disk_bytes = max(0, self._disk_bytes - size)
+
+    def _prune(self) -> None:
+        """Remove the least recently used files down to ``max_disk_entries`` (one scan)."""
+        if not self._prune_lock.acquire(blocking=False):
+            return  # Another thread is already pruning
+        try:
+            entries = []
+            for entry in self._scan():
+                try:
+                    entries.append((entry.stat().st_mtime, entry.stat().st_size, entry.path))
+                except FileNotFoundError:
+                    continue
+            entries.sort()
+            excess = max(0, len(entries) - self.max_disk_entries)
+            removed = 0
+            for _, size, path in entries[:excess]:
+                try:
+                    os.unlink(path)
+                    removed += size
+                except FileNotFoundError:
+                    pass
+            with self._lock:
+                # Resynchronise with the directory (other processes may share it)
+                self._disk_count = len(entries) - excess
+                self._disk_bytes = sum(size for _, size, _ in entries) - removed
+                self.disk_prunes += 1
+        finally:
+            self._prune_lock.release()
+
+    def disk_entries(self) -> int:
+        """Number of results currently persisted (running count, no directory scan)."""
+        return self._disk_count
+
+    def clear(self) -> int:
+        """Drop every entry, in memory and on disk. Returns the number dropped from memory."""
+        dropped = self.memory.clear()
+        if self.directory is not None:
+            for entry in self._scan():
+                Path(entry.path).unlink(missing_ok=True)
+            with self._lock:
+                self._disk_count = 0
+                self._disk_bytes = 0
+        return dropped
+
+    def stats(self) -> Dict:
+        """Size, configuration and hit/miss counters of both tiers."""
+        lookups = self.hits + self.misses
+        memory = self.memory.stats()
+        return {
+            "size": memory["size"],
+            "maxsize": memory["maxsize"],
+            "evictions": memory["evictions"],
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "disk_enabled": self.directory is not None,
+            "disk_entries": self._disk_count,
+            "disk_bytes": self._disk_bytes,
+            "disk_prunes": self.disk_prunes,
+            "disk_hits": self.disk_hits,
+            "disk_writes": self.disk_writes,
+            "disk_errors": self.disk_errors,
+        }
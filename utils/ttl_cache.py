@@ -0,0 +1,103 @@
+"""
+Bounded LRU cache with per-entry expiry.
+Location: utils/ttl_cache.py
+
+Used to memoize results that are pure functions of their (normalized)
+inputs and of the reference data they were computed from. Entries are
+evicted least-recently-used once ``maxsize`` is reached and are treated as
+missing ``ttl_seconds`` after they were stored. Hit/miss counters are kept
+so callers can report the cache's effectiveness.
+
+``stable_hash`` turns a JSON-like key structure into a canonical digest,
+so logically equal inputs (same values, any dict order) share one entry.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+def stable_hash(value: Any) -> str:
+    """SHA-256 of the canonical JSON form of ``value`` (dict keys sorted)."""
+    encoded = json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class TTLCache:
+    """Thread-safe LRU mapping whose entries expire ``ttl_seconds`` after insertion."""
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl_seconds: Optional[float] = 600,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            maxsize: Maximum number of entries (0 disables caching)
+            ttl_seconds: Entry lifetime; None keeps entries until evicted
+            clock: Time source in seconds
+        """
+        self.maxsize = max(0, int(maxsize))
+        self.ttl_seconds = None if ttl_seconds is None else float(ttl_seconds)
+        self.clock = clock
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Cached value for ``key`` (refreshing its recency), or ``default``."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= self.clock():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Store ``value``, evicting the least recently used entries if full."""
+        if not self.maxsize:
+            return
+        expires_at = float("inf") if self.ttl_seconds is None else self.clock() + self.ttl_seconds
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> int:
+        """Drop every entry (counters are kept). Returns the number dropped."""
+        with self._lock:
+            dropped = len(self._entries)
+            self._entries.clear()
+            return dropped
+
+    def stats(self) -> Dict:
+        """Size, configuration and hit/miss counters."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }